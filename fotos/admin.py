@@ -1,9 +1,21 @@
 from django.contrib import admin
-from .models import Photo
+from .models import MediaDeletion, Photo, PhotoJob
 
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-    list_display = ('title', 'created_at')
-    list_filter = ('created_at',)
+    list_display = ('title', 'status', 'created_at')
+    list_filter = ('status', 'created_at')
     search_fields = ('title', 'description')
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+    readonly_fields = ('width', 'height', 'file_size', 'format', 'dominant_color', 'placeholder', 'source_hash', 'phash')
+
+@admin.register(PhotoJob)
+class PhotoJobAdmin(admin.ModelAdmin):
+    list_display = ('photo', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(MediaDeletion)
+class MediaDeletionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'created_at')
+    readonly_fields = ('created_at',)
@@ -0,0 +1,35 @@
+"""
+Выполнение блокирующей работы из асинхронных view.
+
+Pillow, base64 и файловые операции уходят в общий ограниченный пул потоков,
+чтобы не останавливать цикл событий ASGI-воркера. Размер пула ограничивает
+и расход памяти: одновременно декодируется не больше ASYNC_OFFLOAD_THREADS фото.
+ORM из асинхронного кода вызывается через async-методы или sync_to_async,
+а не через этот пул.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+_executor = None
+
+
+def get_thread_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_OFFLOAD_THREADS, thread_name_prefix='fotos-offload'
+        )
+    return _executor
+
+
+async def offload(func, *args, **kwargs):
+    """Выполняет func в пуле потоков и ждёт результат, не блокируя цикл событий"""
+    # run_in_executor не переносит contextvars - копируем сами,
+    # чтобы этапы попадали в Server-Timing текущего запроса
+    context = contextvars.copy_context()
+    call = partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_thread_executor(), call)
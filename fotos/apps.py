@@ -6,15 +6,24 @@ class FotosConfig(AppConfig):
     name = 'fotos'
     
     def ready(self):
-        # Создаём папки для медиа файлов при старте
+        # Сброс кеша альбома при изменении фото
+        from . import signals  # noqa: F401
+
+        # Время запросов к БД для Server-Timing и /metrics
+        from django.db.backends.signals import connection_created
+        from .metrics import install_db_timer
+        connection_created.connect(install_db_timer)
+
+        # Триггеры поискового индекса пропадают, если миграция пересоздаёт таблицу фото
+        from django.db.models.signals import post_migrate
+        from .search import restore_search_triggers
+        post_migrate.connect(restore_search_triggers, sender=self)
+
+        # Создаём папки для медиа файлов при старте. Подпапки ab/cd/
+        # (fotos.storage.sharded_name) storage создаёт сам при записи файла
         from django.conf import settings
-        media_dir = os.path.join(settings.MEDIA_ROOT, 'photos')
         print(f"🔍 MEDIA_ROOT = {settings.MEDIA_ROOT}")
-        print(f"🔍 Creating photos folder at: {media_dir}")
-        os.makedirs(media_dir, exist_ok=True)
-        print(f"✅ Папка для фото создана: {media_dir}")
-        
-        # Также создаём папку для превью
-        thumbs_dir = os.path.join(settings.MEDIA_ROOT, 'thumbnails')
-        os.makedirs(thumbs_dir, exist_ok=True)
-        print(f"✅ Папка для превью создана: {thumbs_dir}")
\ No newline at end of file
+        for folder in ('photos', 'thumbnails', 'renditions'):
+            media_dir = os.path.join(settings.MEDIA_ROOT, folder)
+            os.makedirs(media_dir, exist_ok=True)
+            print(f"✅ Папка медиа создана: {media_dir}")
@@ -0,0 +1,427 @@
+"""
+Воспроизводимые замеры конвейера изображений, базы и страниц (manage.py benchmark).
+
+Каждый замер изображений выполняется в отдельном процессе, чтобы пик памяти
+относился только к нему, а не к предыдущим замерам. Все входные данные
+синтетические и детерминированные - результаты сравнимы между коммитами.
+"""
+import io
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import django
+import PIL
+
+from django.conf import settings
+from PIL import ExifTags, Image, ImageChops, ImageStat
+
+from .images import compress_image
+from .pipeline import IngestPipeline
+
+
+def synthetic_image(width, height, seed=0):
+    """Детерминированное "фото": фрактал, градиенты и шум, похожие по сжатию на реальный снимок"""
+    base = Image.effect_mandelbrot((512, 384), (-2.0 + seed * 0.01, -1.2, 1.0, 1.2), 64)
+    red = base.resize((width, height), Image.Resampling.BICUBIC)
+    green = Image.linear_gradient('L').resize((width, height), Image.Resampling.BILINEAR)
+    blue = Image.radial_gradient('L').resize((width, height), Image.Resampling.BILINEAR)
+    img = Image.merge('RGB', (red, green, blue))
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    return ImageChops.add(img, noise, scale=1.0, offset=-64)
+
+
+def encode(img, format='JPEG', **params):
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+def peak_rss_mb():
+    """Пик RSS текущего процесса в МБ"""
+    # VmHWM относится к адресному пространству процесса и сбрасывается при exec,
+    # а ru_maxrss на Linux наследуется от родителя
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На Linux ru_maxrss в килобайтах, на macOS - в байтах
+    return usage / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _run_measured(conn, func, args):
+    baseline_rss = peak_rss_mb()
+    baseline = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    peak = peak_rss_mb()
+    conn.send({
+        'seconds': elapsed,
+        'cpu_seconds': (usage.ru_utime + usage.ru_stime) - (baseline.ru_utime + baseline.ru_stime),
+        'peak_rss_mb': peak,
+        'peak_rss_delta_mb': peak - baseline_rss,
+        'result': result,
+    })
+    conn.close()
+
+
+def measure(func, *args):
+    """Выполняет func(*args) в отдельном процессе; возвращает время, CPU и пик памяти"""
+    # spawn, а не fork: дочерний процесс не наследует память и пик RSS родителя
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_run_measured, args=(child_conn, func, args))
+    process.start()
+    stats = parent_conn.recv()
+    process.join()
+    return stats
+
+
+def psnr(reference, candidate):
+    """PSNR в дБ между двумя изображениями (выше - ближе к эталону)"""
+    if candidate.size != reference.size:
+        candidate = candidate.resize(reference.size, Image.Resampling.LANCZOS)
+    rms = ImageStat.Stat(ImageChops.difference(reference, candidate)).rms
+    mse = sum(value ** 2 for value in rms) / len(rms)
+    return float('inf') if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+
+def _compress(data, fast):
+    compressed_io, size = compress_image(io.BytesIO(data), fast=fast)
+    return compressed_io.getvalue()
+
+
+def bench_decode(sizes, repeat=3):
+    """Сравнение режимов compress_image: полное декодирование и быстрое (draft + reducing_gap)"""
+    rows = []
+    for width, height in sizes:
+        data = encode(synthetic_image(width, height), quality=92)
+        outputs = {}
+        for mode, fast in (('exact', False), ('fast', True)):
+            runs = [measure(_compress, data, fast) for _ in range(repeat)]
+            outputs[mode] = Image.open(io.BytesIO(runs[0]['result'])).convert('RGB')
+            rows.append({
+                'suite': 'decode',
+                'case': f'{width}x{height}',
+                'mode': mode,
+                'seconds': min(run['seconds'] for run in runs),
+                'cpu_seconds': min(run['cpu_seconds'] for run in runs),
+                'peak_rss_delta_mb': min(run['peak_rss_delta_mb'] for run in runs),
+                'output_bytes': len(runs[0]['result']),
+            })
+        rows[-1]['psnr_vs_exact'] = round(psnr(outputs['exact'], outputs['fast']), 2)
+    return rows
+
+
+def synthetic_source(width, height, mode):
+    """Закодированный исходник нужного вида: RGB, RGBA, P, CMYK или EXIF-rotated"""
+    img = synthetic_image(width, height)
+    if mode == 'RGBA':
+        img.putalpha(Image.linear_gradient('L').resize((width, height)))
+        return encode(img, 'PNG', compress_level=1)
+    if mode == 'P':
+        return encode(img.quantize(colors=256), 'PNG', compress_level=1)
+    if mode == 'CMYK':
+        return encode(img.convert('CMYK'), quality=92)
+    if mode == 'EXIF-rotated':
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        return encode(img, quality=92, exif=exif)
+    return encode(img, quality=92)
+
+
+IMAGE_MODES = ('RGB', 'RGBA', 'P', 'CMYK', 'EXIF-rotated')
+
+
+def _thumbnail(data, size=(300, 300), quality=80):
+    """Превью, как его делала загрузка до IngestPipeline: эталон для сравнения"""
+    img = Image.open(io.BytesIO(data))
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+    thumb_io = io.BytesIO()
+    img.save(thumb_io, format='JPEG', quality=quality, optimize=True)
+    return thumb_io.getvalue()
+
+
+def _ingest(data):
+    return IngestPipeline(io.BytesIO(data)).run().compressed
+
+
+def bench_images(sizes, repeat=3, modes=IMAGE_MODES):
+    """
+    Скорость и пик памяти compress_image, create_thumbnail и полного конвейера
+    загрузки (IngestPipeline) на исходниках разных размеров и режимов
+    """
+    rows = []
+    for width, height in sizes:
+        megapixels = width * height / 1_000_000
+        for mode in modes:
+            data = synthetic_source(width, height, mode)
+            compressed = _compress(data, None)
+            with Image.open(io.BytesIO(compressed)) as img:
+                compressed_megapixels = img.width * img.height / 1_000_000
+            operations = (
+                ('compress_image', _compress, (data, None), megapixels),
+                # Как и раньше в загрузке: превью из уже сжатого JPEG
+                ('create_thumbnail', _thumbnail, (compressed,), compressed_megapixels),
+                ('ingest_pipeline', _ingest, (data,), megapixels),
+            )
+            for operation, func, args, input_megapixels in operations:
+                runs = [measure(func, *args) for _ in range(repeat)]
+                seconds = min(run['seconds'] for run in runs)
+                rows.append({
+                    'suite': 'images',
+                    'case': f'{mode} {width}x{height}',
+                    'mode': operation,
+                    'seconds': seconds,
+                    'cpu_seconds': min(run['cpu_seconds'] for run in runs),
+                    'peak_rss_delta_mb': min(run['peak_rss_delta_mb'] for run in runs),
+                    'megapixels_per_second': input_megapixels / seconds if seconds else None,
+                    'input_bytes': len(args[0]),
+                    'output_bytes': len(runs[0]['result']),
+                })
+    return rows
+
+
+def sqlite_profiles():
+    """Профили SQLite для сравнения: настройки Django по умолчанию и production"""
+    return {
+        'default': {'pragmas': [], 'begin': 'BEGIN', 'timeout': 5.0},
+        'tuned': {
+            'pragmas': settings.SQLITE_PRAGMAS,
+            'begin': 'BEGIN IMMEDIATE',
+            'timeout': settings.SQLITE_BUSY_TIMEOUT,
+        },
+    }
+
+
+def _sqlite_connect(path, profile):
+    conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None, check_same_thread=False)
+    for pragma in profile['pragmas']:
+        conn.execute(f'PRAGMA {pragma}')
+    return conn
+
+
+def _sqlite_reader(path, profile, deadline, stats):
+    """Как страница галереи: одна страница по keyset"""
+    conn = _sqlite_connect(path, profile)
+    while time.perf_counter() < deadline:
+        try:
+            conn.execute(
+                'SELECT id, title FROM photo WHERE id > ? ORDER BY id LIMIT 6', (stats['reads'] % 1000,)
+            ).fetchall()
+            stats['reads'] += 1
+        except sqlite3.OperationalError:
+            stats['errors'] += 1
+    conn.close()
+
+
+def _sqlite_writer(path, profile, deadline, stats, work_seconds):
+    """Как загрузка: чтение, затем запись в одной транзакции, с паузой на "работу" внутри"""
+    conn = _sqlite_connect(path, profile)
+    while time.perf_counter() < deadline:
+        try:
+            conn.execute(profile['begin'])
+            conn.execute('SELECT max(id) FROM photo').fetchone()
+            time.sleep(work_seconds)
+            conn.executemany('INSERT INTO photo (title) VALUES (?)', [('new',)] * 5)
+            conn.execute('COMMIT')
+            stats['writes'] += 1
+        except sqlite3.OperationalError:
+            stats['errors'] += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+    conn.close()
+
+
+def run_sqlite_load(profile, duration=2.0, readers=4, writers=2, work_seconds=0.002):
+    """Читатели и писатели одновременно на временной базе; возвращает счётчики"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        conn = _sqlite_connect(path, profile)
+        conn.execute('CREATE TABLE photo (id INTEGER PRIMARY KEY, title TEXT)')
+        conn.executemany('INSERT INTO photo (title) VALUES (?)', [(f'p{i}',) for i in range(1000)])
+        conn.close()
+
+        reader_stats = [{'reads': 0, 'errors': 0} for _ in range(readers)]
+        writer_stats = [{'writes': 0, 'errors': 0} for _ in range(writers)]
+        deadline = time.perf_counter() + duration
+        threads = [
+            threading.Thread(target=_sqlite_reader, args=(path, profile, deadline, stats))
+            for stats in reader_stats
+        ] + [
+            threading.Thread(target=_sqlite_writer, args=(path, profile, deadline, stats, work_seconds))
+            for stats in writer_stats
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return {
+        'reads_per_second': sum(stats['reads'] for stats in reader_stats) / duration,
+        'writes_per_second': sum(stats['writes'] for stats in writer_stats) / duration,
+        'read_errors': sum(stats['errors'] for stats in reader_stats),
+        'write_errors': sum(stats['errors'] for stats in writer_stats),
+    }
+
+
+def bench_sqlite(duration=5.0, readers=4, writers=2):
+    """Пропускная способность и ошибки "database is locked" до и после настройки SQLite"""
+    rows = []
+    for mode, profile in sqlite_profiles().items():
+        rows.append({
+            'suite': 'sqlite',
+            'case': f'{readers}r/{writers}w',
+            'mode': mode,
+            **run_sqlite_load(profile, duration, readers, writers),
+        })
+    return rows
+
+
+VIEW_ROW_COUNTS = (100, 10_000, 100_000)
+
+
+def _fill_photos(count):
+    """Дополняет таблицу фото до count готовых строк (без файлов - страницы их не читают)"""
+    from .models import Photo
+
+    existing = Photo.objects.count()
+    renditions = {
+        'thumbnail': {'name': 'thumbnails/bench_thumbnail.jpg', 'width': 300, 'height': 200},
+        'medium': {'name': 'renditions/bench_medium.jpg', 'width': 800, 'height': 533},
+        'large': {'name': 'photos/bench.jpg', 'width': 1620, 'height': 1080},
+    }
+    Photo.objects.bulk_create(
+        (
+            Photo(
+                title=f'Фото {number}',
+                description='Описание фотографии ' * 10,
+                image='photos/bench.jpg',
+                renditions=renditions,
+                width=1620, height=1080, file_size=250_000, format='JPEG',
+                dominant_color='#c86432',
+                status=Photo.Status.READY,
+            )
+            for number in range(existing, count)
+        ),
+        batch_size=5000,
+    )
+
+
+def _view_cases(count):
+    """(название, URL) страниц, которые смотрят посетители: первые и глубокие"""
+    from django.urls import reverse
+    from .models import Photo
+
+    ids = list(Photo.objects.order_by('id').values_list('id', flat=True)[:1])
+    last_id = Photo.objects.order_by('-id').values_list('id', flat=True).first()
+    middle_id = ids[0] + count // 2 if ids else 1
+    return [
+        ('gallery', reverse('gallery')),
+        ('gallery deep', f"{reverse('gallery')}?after={last_id - 10}"),
+        ('conclusion', reverse('conclusion')),
+        ('conclusion deep', f"{reverse('conclusion')}?after={last_id - 60}"),
+        ('photo_detail', reverse('photo_detail', args=[middle_id])),
+        # Поиск не кешируется: редкое слово и слово из каждого описания
+        ('search', f"{reverse('search')}?q={count // 2}"),
+        ('search common', f"{reverse('search')}?q=описание"),
+    ]
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def bench_views(row_counts=VIEW_ROW_COUNTS, repeat=20):
+    """
+    Задержка страниц при разном размере альбома: cold - без кеша страниц,
+    cached - повторный запрос анонимного посетителя.
+    Заполняет текущую базу - вызывать только на тестовой (см. manage.py benchmark)
+    """
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    from .cache import bump_album_version
+
+    client = Client()
+    rows = []
+    for count in sorted(row_counts):
+        _fill_photos(count)
+        bump_album_version()
+        for name, url in _view_cases(count):
+            for mode in ('cold', 'cached'):
+                timings = []
+                queries = 0
+                for _ in range(repeat):
+                    if mode == 'cold':
+                        cache.clear()
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = client.get(url)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    queries = len(captured.captured_queries)
+                    if response.status_code != 200:
+                        raise RuntimeError(f'{url}: HTTP {response.status_code}')
+                rows.append({
+                    'suite': 'views',
+                    'case': f'{name} @ {count}',
+                    'mode': mode,
+                    'median_ms': statistics.median(timings),
+                    'p95_ms': _percentile(timings, 95),
+                    'queries': queries,
+                    'response_bytes': len(response.content),
+                })
+    return rows
+
+
+def environment():
+    """Версии и настройки, от которых зависят результаты (для сравнения прогонов)"""
+    from django.conf import settings
+
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=settings.BASE_DIR, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ''
+    return {
+        'git_revision': revision,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'image_quality': settings.IMAGE_QUALITY,
+        'image_fast_decode': settings.IMAGE_FAST_DECODE,
+        'image_modern_formats': settings.IMAGE_MODERN_FORMATS,
+    }
+
+
+def json_safe(value):
+    """inf/nan не допустимы в JSON - заменяем на null"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
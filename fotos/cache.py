@@ -0,0 +1,113 @@
+"""
+Кеш страниц альбома и версия альбома для его инвалидации.
+
+Любое изменение фото увеличивает версию, а она входит в ключи кешированных
+страниц и фрагментов - старые записи просто перестают читаться и вытесняются
+по таймауту. Кеш общий для всех процессов (воркеры gunicorn и process_photos),
+поэтому версия видна всем сразу.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+ALBUM_VERSION_KEY = 'fotos:album_version'
+
+
+def album_version():
+    version = cache.get(ALBUM_VERSION_KEY)
+    if version is None:
+        # Ключ пропал (перезапуск, вытеснение): начинаем с новой метки,
+        # чтобы не совпасть ни с одной из старых версий
+        version = cache.get_or_set(ALBUM_VERSION_KEY, _initial_version(), timeout=None)
+    return version
+
+
+def bump_album_version():
+    try:
+        cache.incr(ALBUM_VERSION_KEY)
+    except ValueError:
+        cache.set(ALBUM_VERSION_KEY, _initial_version(), timeout=None)
+
+
+def _initial_version():
+    return time.time_ns()
+
+
+def page_cache_key(request, view_name, view_kwargs, query_params):
+    """Ключ страницы: версия альбома, view, его аргументы и нужные GET-параметры"""
+    # Берём только известные параметры: произвольные ?x=... не должны
+    # плодить записи в кеше
+    parts = [view_name]
+    parts += [f'{key}={value}' for key, value in sorted(view_kwargs.items())]
+    parts += [f'{param}={request.GET.get(param, "")}' for param in query_params]
+    digest = hashlib.md5('&'.join(parts).encode()).hexdigest()
+    return f'fotos:page:{album_version()}:{digest}'
+
+
+def _cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Есть сообщения для показа - страница одноразовая
+    return not len(get_messages(request))
+
+
+def _cached_response(cached):
+    content, content_type = cached
+    response = HttpResponse(content, content_type=content_type)
+    # Как у свежей страницы: содержимое зависит от сессии
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def _should_store(response):
+    return response.status_code == 200 and not response.streaming and not response.cookies
+
+
+def cache_anonymous_page(query_params=()):
+    """
+    Кеширует страницу для анонимных посетителей до следующего изменения альбома.
+    Суперюзер и запросы с сообщениями всегда получают свежую страницу.
+    Подходит и для обычных, и для асинхронных view
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Пользователь и сообщения читаются из сессии - это запросы к БД
+                if not await sync_to_async(_cacheable_request)(request):
+                    return await view(request, *args, **kwargs)
+
+                key = await sync_to_async(page_cache_key)(request, view.__name__, kwargs, query_params)
+                cached = await cache.aget(key)
+                if cached is not None:
+                    return _cached_response(cached)
+
+                response = await view(request, *args, **kwargs)
+                if _should_store(response):
+                    await cache.aset(key, (response.content, response['Content-Type']), settings.ALBUM_CACHE_TIMEOUT)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            key = page_cache_key(request, view.__name__, kwargs, query_params)
+            cached = cache.get(key)
+            if cached is not None:
+                return _cached_response(cached)
+
+            response = view(request, *args, **kwargs)
+            if _should_store(response):
+                cache.set(key, (response.content, response['Content-Type']), settings.ALBUM_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,139 @@
+"""
+Удаление файлов медиа, которые больше не нужны.
+
+Удаление фото только ставит его файлы в очередь (MediaDeletion) в той же
+транзакции, а сами файлы удаляет воркер process_photos или gc_media - запрос
+не ждёт диска, а откат транзакции не оставляет фото без файлов.
+
+Файлы с именем по хешу (fotos.storage) могут быть общими у нескольких фото:
+такой файл удаляется, только если не осталось фото с файлами того же хеша
+и той же версии обработки.
+
+gc_media дополнительно находит файлы, на которые не ссылается ни одно фото
+(остались от старых удалений, прерванных загрузок и т.п.).
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .db import retry_if_locked
+from .models import MediaDeletion, Photo
+from .renditions import photo_file_names
+from .storage import content_hash, content_key, is_sharded
+
+# Папки MEDIA_ROOT, которые проверяет gc_media
+MEDIA_FOLDERS = ('photos', 'thumbnails', 'renditions', 'incoming')
+QUEUE_BATCH_SIZE = 200
+
+
+def queue_photo_files(photos):
+    """Ставит файлы фото в очередь на удаление (вызывать в транзакции удаления)"""
+    MediaDeletion.objects.bulk_create(
+        [MediaDeletion(name=name) for photo in photos for name in sorted(photo_file_names(photo))]
+    )
+
+
+def keys_in_use(names):
+    """content_key файлов names, которые ещё нужны какому-нибудь фото"""
+    keys = {content_key(name) for name in names} - {None}
+    hashes = {content_hash(name) for name in names} - {None}
+    # Все файлы фото - одной обработки: ключ его изображения - ключ и размеров
+    images = Photo.objects.filter(source_hash__in=hashes).values_list('image', flat=True)
+    return {content_key(image) for image in images} & keys
+
+
+@retry_if_locked
+def delete_queued_files(limit=QUEUE_BATCH_SIZE):
+    """Удаляет до limit файлов из очереди; возвращает, сколько записей очереди обработано"""
+    queued = list(MediaDeletion.objects.order_by('id')[:limit])
+    if not queued:
+        return 0
+    # Проверка при удалении, а не при постановке в очередь: за это время
+    # тот же исходник могли загрузить снова
+    in_use = keys_in_use([item.name for item in queued])
+    for item in queued:
+        if content_key(item.name) not in in_use:
+            default_storage.delete(item.name)
+    MediaDeletion.objects.filter(id__in=[item.id for item in queued]).delete()
+    return len(queued)
+
+
+def drain_deletion_queue():
+    """Удаляет все файлы из очереди; возвращает, сколько записей обработано"""
+    total = 0
+    while done := delete_queued_files():
+        total += done
+    return total
+
+
+class MediaReferences:
+    """
+    Что из MEDIA_ROOT нужно фото: хеши исходников с версией обработки (для
+    имён по хешу) и имена без расширения (для остальных; расширение
+    отбрасывается, чтобы покрыть AVIF/WebP рядом с JPEG)
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.stems = set()
+        photos = Photo.objects.values_list('image', 'thumbnail', 'renditions')
+        for image, thumbnail, renditions in photos.iterator():
+            for name in (image, thumbnail, *(rendition['name'] for rendition in (renditions or {}).values())):
+                if name:
+                    self.add(name)
+
+    def add(self, name):
+        key = content_key(name)
+        # По хешу - только имена в подпапках ab/cd/: имена по хешу в корне
+        # папки остались от фото до shard_media и после переноса не нужны
+        if key is not None and is_sharded(name):
+            self.keys.add(key)
+        else:
+            self.stems.add(os.path.splitext(name)[0])
+
+    def is_referenced(self, name):
+        key = content_key(name)
+        if key is not None and is_sharded(name):
+            return key in self.keys
+        return os.path.splitext(name)[0] in self.stems
+
+
+def media_files(after=''):
+    """
+    Файлы в MEDIA_FOLDERS в порядке имён (с подпапками), после after.
+    Выдаёт (имя в storage, DirEntry)
+    """
+    root = str(settings.MEDIA_ROOT)
+    for folder in sorted(MEDIA_FOLDERS):
+        if _walked(folder, after):
+            continue
+        yield from _walk(os.path.join(root, folder), folder, after)
+
+
+def _walked(folder, after):
+    """Вся папка уже пройдена: все её имена меньше after"""
+    prefix = folder + '/'
+    return prefix < after and not after.startswith(prefix)
+
+
+def _walk(path, relative, after):
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return
+    # Папка сортируется как "имя/": порядок совпадает со сравнением полных имён
+    entries.sort(key=lambda entry: entry.name + '/' if entry.is_dir(follow_symlinks=False) else entry.name)
+    for entry in entries:
+        name = f'{relative}/{entry.name}'
+        if entry.is_dir(follow_symlinks=False):
+            if not _walked(name, after):
+                yield from _walk(entry.path, name, after)
+        elif entry.is_file(follow_symlinks=False) and name > after:
+            yield name, entry
+
+
+def is_stale(entry, grace):
+    """Файл старше grace секунд: только что записанные файлы не трогаем"""
+    return entry.stat(follow_symlinks=False).st_mtime < time.time() - grace
@@ -0,0 +1,41 @@
+"""
+Запись в SQLite при конкурентном доступе.
+
+В production транзакции начинаются с BEGIN IMMEDIATE (см. DATABASES в
+settings), поэтому конфликт писателей проявляется сразу на входе в
+transaction.atomic - до каких-либо изменений - и такой блок можно просто
+повторить.
+"""
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+
+def is_locked_error(error):
+    return isinstance(error, OperationalError) and 'locked' in str(error)
+
+
+def retry_if_locked(func):
+    """
+    Повторяет func при "database is locked" с растущей паузой.
+    Внутри внешней транзакции не повторяет: откатывать её должен вызывающий
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        delay = settings.SQLITE_LOCK_RETRY_DELAY
+        for attempt in range(settings.SQLITE_LOCK_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if (not is_locked_error(e) or connection.in_atomic_block
+                        or attempt == settings.SQLITE_LOCK_RETRIES):
+                    raise
+                logger.warning('%s: база занята, повтор через %.2f с', func.__name__, delay)
+                time.sleep(delay)
+                delay *= 2
+    return wrapper
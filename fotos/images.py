@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from PIL import ExifTags, Image, ImageOps
+import base64
+import io
+
+# EXIF Orientation, при которых изображение поворачивается на 90°
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Допустимые размеры исходника, пикселей
+MAX_IMAGE_SIDE = 8000
+MIN_IMAGE_SIDE = 100
+
+# Размытая заглушка (LQIP): крошечный JPEG прямо в data URI, ~0.5 КБ
+PLACEHOLDER_SIZE = (16, 16)
+PLACEHOLDER_QUALITY = 50
+
+# dHash: 8 строк по 9 точек в оттенках серого -> 64 бита
+PHASH_SIZE = (9, 8)
+
+
+def check_image_dimensions(width, height):
+    """Проверка размеров по заголовку, до декодирования"""
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
+        raise ValidationError(f'Размер изображения не должен превышать {MAX_IMAGE_SIDE}x{MAX_IMAGE_SIDE} пикселей')
+    if width < MIN_IMAGE_SIDE or height < MIN_IMAGE_SIDE:
+        raise ValidationError(f'Размер изображения должен быть не менее {MIN_IMAGE_SIDE}x{MIN_IMAGE_SIDE} пикселей')
+
+
+def decode_image(img, max_width, max_height, fast):
+    """
+    Декодирует открытое изображение (один раз), поворачивает по EXIF и
+    приводит режим к RGB/RGBA. При fast JPEG декодируется сразу в масштабе,
+    не меньшем итогового размера
+    """
+    if fast:
+        # Просим декодер отдать изображение не меньше итогового размера;
+        # при повороте по EXIF ширина и высота меняются местами
+        target = (max_width, max_height)
+        if img.getexif().get(ExifTags.Base.Orientation) in ROTATED_ORIENTATIONS:
+            target = (max_height, max_width)
+        scale = min(target[0] / img.width, target[1] / img.height)
+        if scale < 1:
+            img.draft(None, (int(img.width * scale), int(img.height * scale)))
+
+    # Поворачиваем если нужно (EXIF данные) - до смены режима, без лишней копии
+    ImageOps.exif_transpose(img, in_place=True)
+
+    # Палитру и прочие режимы приводим к RGB/RGBA до уменьшения
+    if img.mode in ('P', 'LA'):
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return img
+
+
+def fit_image(img, max_width, max_height, fast):
+    """Уменьшает до max_width x max_height (с сохранением пропорций) и убирает прозрачность"""
+    width, height = img.size
+    if width > max_width or height > max_height:
+        img.thumbnail(
+            (max_width, max_height),
+            Image.Resampling.LANCZOS,
+            reducing_gap=settings.IMAGE_REDUCING_GAP if fast else None
+        )
+
+    if img.mode == 'RGBA':
+        # Создаём белый фон для прозрачных изображений (уже на уменьшенном)
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    return img
+
+
+def encode_jpeg(img, quality):
+    img_io = io.BytesIO()
+    img.save(
+        img_io, 
+        format='JPEG', 
+        quality=quality, 
+        optimize=True,
+        progressive=True
+    )
+    img_io.seek(0)
+    return img_io
+
+
+def compress_image(image_file, max_width=1920, max_height=1080, quality=85, fast=None):
+    """
+    Сжимает изображение до указанных размеров с оптимизацией качества
+    Оптимизировано для Amvera (ограниченные ресурсы)
+
+    fast=True (по умолчанию settings.IMAGE_FAST_DECODE): JPEG декодируется сразу
+    в уменьшенном масштабе (DCT scaling через Image.draft), а уменьшение идёт
+    с reducing_gap - в разы меньше CPU и памяти на больших оригиналах.
+    fast=False: полное декодирование и чистый LANCZOS (эталонное качество)
+    """
+    if fast is None:
+        fast = settings.IMAGE_FAST_DECODE
+
+    try:
+        # Открываем изображение (читается только заголовок)
+        img = Image.open(image_file)
+        img = decode_image(img, max_width, max_height, fast)
+        img = fit_image(img, max_width, max_height, fast)
+        return encode_jpeg(img, quality), img.size
+        
+    except Exception as e:
+        raise ValueError(f"Ошибка обработки изображения: {str(e)}")
+
+def perceptual_hash(img):
+    """
+    dHash изображения (16 hex-символов): бит = ярче ли точка правой соседки.
+    Почти не меняется при уменьшении, пересжатии и лёгкой правке цвета
+    """
+    gray = img.convert('L').resize(PHASH_SIZE, Image.Resampling.LANCZOS)
+    pixels = list(gray.getdata())
+    width = PHASH_SIZE[0]
+    bits = 0
+    for row in range(PHASH_SIZE[1]):
+        for col in range(width - 1):
+            left = pixels[row * width + col]
+            bits = (bits << 1) | (left > pixels[row * width + col + 1])
+    return f'{bits:016x}'
+
+
+def describe_image(img):
+    """
+    Основной цвет ('#rrggbb'), размытая заглушка (data URI) и перцептивный
+    хеш изображения. Работает по уменьшенной копии, поэтому JPEG можно
+    открыть с draft
+    """
+    small = img.convert('RGB')
+    small.thumbnail((64, 64), Image.Resampling.BOX)
+    phash = perceptual_hash(small)
+
+    # Самый частый цвет из небольшой палитры, а не среднее - среднее у
+    # контрастных снимков уходит в грязно-серый
+    quantized = small.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    count, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+
+    small.thumbnail(PLACEHOLDER_SIZE, Image.Resampling.LANCZOS)
+    placeholder_io = io.BytesIO()
+    small.save(placeholder_io, format='JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+
+    return {
+        'dominant_color': f'#{red:02x}{green:02x}{blue:02x}',
+        'placeholder': 'data:image/jpeg;base64,' + base64.b64encode(placeholder_io.getvalue()).decode('ascii'),
+        'phash': phash,
+    }
+
+
+def read_metadata(image_file, source_format=None):
+    """Метаданные для полей Photo: размеры, формат, основной цвет, заглушка и перцептивный хеш"""
+    with Image.open(image_file) as img:
+        width, height = img.size
+        image_format = source_format or img.format or ''
+        # Для заглушки хватит декодирования в масштабе 1/8
+        img.draft('RGB', (width // 8, height // 8))
+        metadata = describe_image(img)
+    metadata.update(width=width, height=height, format=image_format)
+    return metadata
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from fotos.cache import bump_album_version
+from fotos.images import read_metadata
+from fotos.models import Photo
+
+METADATA_FIELDS = ['width', 'height', 'file_size', 'format', 'dominant_color', 'placeholder', 'phash']
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры, формат, основной цвет, заглушку и перцептивный хеш для уже загруженных фото'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать метаданные и для фото, у которых они уже есть'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько фото сохранять одним запросом'
+        )
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.ready().order_by('id')
+        if not options['all']:
+            # phash появился позже остальных полей
+            photos = photos.filter(Q(width__isnull=True) | Q(phash=''))
+
+        done = 0
+        batch = []
+        for photo in photos.iterator():
+            try:
+                with photo.image.open('rb') as image_file:
+                    metadata = read_metadata(image_file)
+                metadata['file_size'] = photo.image.size
+            except Exception as e:
+                self.stderr.write(f'Фото #{photo.pk}: {e}')
+                continue
+
+            # format - исходный формат, как при загрузке (fotos.pipeline). Исходники
+            # старых фото не сохранились, а сжатый файл - всегда JPEG: по нему
+            # исходный формат не узнать. Файл в другом формате - сам исходник
+            stored_format = metadata.pop('format')
+            if not photo.format and stored_format != 'JPEG':
+                photo.format = stored_format
+            for field, value in metadata.items():
+                setattr(photo, field, value)
+            batch.append(photo)
+            if len(batch) >= options['batch_size']:
+                done += Photo.objects.bulk_update(batch, METADATA_FIELDS)
+                batch = []
+        if batch:
+            done += Photo.objects.bulk_update(batch, METADATA_FIELDS)
+
+        # bulk_update не шлёт post_save - сбрасываем кеш страниц сами
+        if done:
+            bump_album_version()
+        self.stdout.write(self.style.SUCCESS(f'Обработано фото: {done}'))
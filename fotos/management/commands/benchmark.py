@@ -0,0 +1,131 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from fotos import benchmarks
+
+DEFAULT_SIZES = {
+    'decode': ['2000x1500', '4000x3000', '8000x6000'],
+    'images': ['1000x750', '4000x3000'],
+}
+SUITES = ['decode', 'images', 'views', 'sqlite']
+
+# Кеш страниц на время замеров - свой, чтобы не трогать кеш работающего сайта
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = 'Замеры скорости и памяти конвейера изображений, страниц и базы данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--suite', choices=SUITES + ['all'], default='decode',
+            help='decode - быстрое и полное декодирование в compress_image; '
+                 'images - compress_image, create_thumbnail и конвейер загрузки на RGB/RGBA/P/CMYK/EXIF; '
+                 'views - задержка страниц при 100/10k/100k фото (на тестовой базе); '
+                 'sqlite - читатели и писатели одновременно, до и после настройки SQLite'
+        )
+        parser.add_argument(
+            '--sizes', nargs='+',
+            help='Размеры синтетических изображений, например 4000x3000'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Сколько раз повторять каждый замер изображений (берётся лучший)'
+        )
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=list(benchmarks.VIEW_ROW_COUNTS),
+            help='views: сколько фото в альбоме'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=20,
+            help='views: запросов на каждую страницу (медиана и p95)'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=5.0,
+            help='sqlite: длительность нагрузки на каждый профиль, сек.'
+        )
+        parser.add_argument('--readers', type=int, default=4, help='sqlite: потоков-читателей')
+        parser.add_argument('--writers', type=int, default=2, help='sqlite: потоков-писателей')
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Вывести результаты в JSON (с версиями и настройками) вместо таблицы'
+        )
+        parser.add_argument(
+            '--output',
+            help='Записать JSON в файл (для сравнения между коммитами)'
+        )
+
+    def handle(self, *args, **options):
+        suites = SUITES if options['suite'] == 'all' else [options['suite']]
+        rows = []
+        for suite in suites:
+            rows += getattr(self, f'run_{suite}')(options)
+
+        if options['json'] or options['output']:
+            report = json.dumps(
+                benchmarks.json_safe({'environment': benchmarks.environment(), 'results': rows}),
+                ensure_ascii=False, indent=2,
+            )
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8') as output:
+                    output.write(report + '\n')
+            if options['json']:
+                self.stdout.write(report)
+                return
+        self.write_table(rows)
+
+    def parse_sizes(self, options, suite):
+        sizes = options['sizes'] or DEFAULT_SIZES[suite]
+        return [tuple(int(part) for part in size.split('x')) for size in sizes]
+
+    def run_decode(self, options):
+        return benchmarks.bench_decode(self.parse_sizes(options, 'decode'), options['repeat'])
+
+    def run_images(self, options):
+        return benchmarks.bench_images(self.parse_sizes(options, 'images'), options['repeat'])
+
+    def run_sqlite(self, options):
+        return benchmarks.bench_sqlite(options['duration'], options['readers'], options['writers'])
+
+    def run_views(self, options):
+        # Альбом заполняется синтетическими фото - только во временной тестовой базе
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                return benchmarks.bench_views(options['rows'], options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def write_table(self, rows):
+        suites = {}
+        for row in rows:
+            suites.setdefault(row['suite'], []).append(row)
+
+        for suite, suite_rows in suites.items():
+            # Порядок первой строки; поля, которые есть не у всех строк, - в конце
+            columns = list(dict.fromkeys(key for row in suite_rows for key in row if key != 'suite'))
+            cells = [[self.format_value(row.get(column)) for column in columns] for row in suite_rows]
+            widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{suite}'))
+            self.stdout.write('  '.join(column.rjust(width) for column, width in zip(columns, widths)))
+            for line in cells:
+                self.stdout.write('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+    def format_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, float):
+            return f'{value:.3f}'
+        return str(value)
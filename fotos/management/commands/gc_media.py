@@ -0,0 +1,106 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from fotos.cleanup import MEDIA_FOLDERS, MediaReferences, drain_deletion_queue, is_stale, media_files
+
+CURSOR_NAME = '.gc_media.cursor'
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы из очереди удалённых фото и файлы, на которые не ссылается ни одно фото '
+        f'({", ".join(MEDIA_FOLDERS)}); понемногу, с паузами и продолжением с места остановки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов проверять между паузами'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.1,
+            help='Пауза между пачками, сек. (ограничивает нагрузку на диск)'
+        )
+        parser.add_argument(
+            '--max-files', type=int, default=0,
+            help='Проверить не больше стольких файлов и выйти (0 - все); следующий запуск продолжит'
+        )
+        parser.add_argument(
+            '--grace', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд (идущие загрузки и обработка)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+
+    def handle(self, *args, **options):
+        self.cursor_path = os.path.join(settings.MEDIA_ROOT, CURSOR_NAME)
+        dry_run = options['dry_run']
+
+        if not dry_run:
+            queued = drain_deletion_queue()
+            if queued:
+                self.stdout.write(f'Файлов из очереди удалений: {queued}')
+
+        # Снимок ссылок до обхода: файлы новых фото моложе grace и не удаляются
+        references = MediaReferences()
+        after = self.read_cursor()
+        if after:
+            self.stdout.write(f'Продолжаем после {after}')
+
+        checked = removed = freed = 0
+        batch_size = max(1, options['batch_size'])
+        finished = True
+        last = after
+        for name, entry in media_files(after):
+            if options['max_files'] and checked >= options['max_files']:
+                finished = False
+                break
+            checked += 1
+            if not references.is_referenced(name) and is_stale(entry, options['grace']):
+                size = entry.stat(follow_symlinks=False).st_size
+                if dry_run:
+                    self.stdout.write(name)
+                else:
+                    default_storage.delete(name)
+                removed += 1
+                freed += size
+            last = name
+            if checked % batch_size == 0:
+                if not dry_run:
+                    self.write_cursor(last)
+                time.sleep(options['sleep'])
+
+        if not dry_run:
+            if finished:
+                self.clear_cursor()
+            else:
+                self.write_cursor(last)
+
+        verb = 'К удалению' if dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {checked}; {verb} лишних: {removed} ({freed / (1024 * 1024):.1f} МБ)'
+            + ('' if finished else '; обход не закончен, следующий запуск продолжит')
+        ))
+
+    def read_cursor(self):
+        try:
+            with open(self.cursor_path, encoding='utf-8') as cursor:
+                return cursor.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    def write_cursor(self, name):
+        with open(self.cursor_path, 'w', encoding='utf-8') as cursor:
+            cursor.write(name)
+
+    def clear_cursor(self):
+        try:
+            os.remove(self.cursor_path)
+        except FileNotFoundError:
+            pass
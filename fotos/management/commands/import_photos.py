@@ -0,0 +1,237 @@
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from fotos.db import retry_if_locked
+from fotos.models import Photo
+from fotos.pipeline import file_hash, prepare_photo
+from fotos.renditions import photo_file_names
+from fotos.tasks import save_prepared
+
+IMPORT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+CHECKPOINT_NAME = '.import_photos.checkpoint'
+
+
+class Command(BaseCommand):
+    help = 'Импорт папки с фото (рекурсивно): сжатие в пуле процессов, пачки в БД, докачка после прерывания'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Папка с фото (вложенные папки тоже)')
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Сколько фото сжимать параллельно (по умолчанию - все ядра)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Сколько фото записывать в БД одной транзакцией'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help=f'Файл с уже обработанными путями (по умолчанию {CHECKPOINT_NAME} в папке импорта)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать новые файлы и повторы, ничего не импортировать'
+        )
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options['directory'])
+        if not os.path.isdir(directory):
+            raise CommandError(f'Папка {directory} не найдена')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.checkpoint_path = options['checkpoint'] or os.path.join(directory, CHECKPOINT_NAME)
+        done = self.read_checkpoint()
+        # Повторы ищутся по хешу исходника - и среди загруженных через сайт
+        self.known_hashes = set(
+            Photo.objects.exclude(source_hash='').values_list('source_hash', flat=True)
+        )
+        # Хеши файлов, которые сжимаются или ждут записи пачки, -> пути их
+        # повторов в папке. Повтором файл считается, только когда пачка записана
+        self.in_progress = {}
+        self.dry_run = options['dry_run']
+        self.stats = {'imported': 0, 'duplicates': 0, 'failed': 0, 'bytes': 0}
+        self.started = time.perf_counter()
+
+        paths = [path for path in self.walk(directory) if os.path.relpath(path, directory) not in done]
+        self.stdout.write(f'Файлов к импорту: {len(paths)} (уже обработано ранее: {len(done)})')
+
+        processes = max(1, options['processes'])
+        executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+        try:
+            self.run(directory, paths, executor, processes, max(1, options['batch_size']))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        self.report(final=True)
+
+    def walk(self, directory):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMPORT_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+    def run(self, directory, paths, executor, processes, batch_size):
+        """Хеширует файлы, отдаёт новые в пул и пишет готовые пачками"""
+        pending = iter(paths)
+        in_flight = {}
+        batch = []
+
+        while not self.stopping:
+            # Держим пул занятым: заданий в работе вдвое больше процессов
+            while len(in_flight) < processes * 2 and not self.stopping:
+                path = next(pending, None)
+                if path is None:
+                    break
+                relpath = os.path.relpath(path, directory)
+                source_hash = self.new_file_hash(path, relpath)
+                if source_hash is None or self.dry_run:
+                    continue
+                if executor is None:
+                    self.collect(batch, relpath, path, source_hash, lambda: prepare_photo(path, source_hash))
+                else:
+                    in_flight[executor.submit(prepare_photo, path, source_hash)] = (relpath, path, source_hash)
+                if len(batch) >= batch_size:
+                    self.save_batch(batch)
+
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                relpath, path, source_hash = in_flight.pop(future)
+                self.collect(batch, relpath, path, source_hash, future.result)
+            if len(batch) >= batch_size:
+                self.save_batch(batch)
+
+        # Остановка по сигналу: дописываем то, что уже сжато
+        for future in list(in_flight):
+            relpath, path, source_hash = in_flight.pop(future)
+            if not future.cancelled():
+                self.collect(batch, relpath, path, source_hash, future.result)
+        if batch:
+            self.save_batch(batch)
+
+    def new_file_hash(self, path, relpath):
+        """Хеш файла или None, если такой файл уже есть в альбоме"""
+        try:
+            with open(path, 'rb') as image_file:
+                source_hash = file_hash(image_file)
+        except OSError as e:
+            self.fail(relpath, e)
+            return None
+        if source_hash in self.known_hashes:
+            self.stats['duplicates'] += 1
+            if not self.dry_run:
+                self.write_checkpoint([relpath])
+            return None
+        if self.dry_run:
+            self.known_hashes.add(source_hash)
+            self.stats['imported'] += 1
+            return source_hash
+        # Повтор внутри самой папки тоже пропускаем - но записываем как повтор,
+        # только если первый файл импортируется
+        if source_hash in self.in_progress:
+            self.in_progress[source_hash].append(relpath)
+            return None
+        self.in_progress[source_hash] = []
+        return source_hash
+
+    def collect(self, batch, relpath, path, source_hash, get_result):
+        try:
+            batch.append((relpath, path, source_hash, get_result()))
+        except Exception as e:
+            self.fail(relpath, e)
+            self.release(source_hash)
+
+    def release(self, source_hash):
+        # Первый файл не импортирован - его повторы не пишутся в файл прогресса
+        # и импортируются следующим запуском
+        self.in_progress.pop(source_hash, None)
+
+    def fail(self, relpath, error):
+        # Не записывается в файл прогресса - файл попробуем снова при следующем запуске
+        self.stats['failed'] += 1
+        if isinstance(error, ValidationError):
+            error = error.messages[0]
+        self.stderr.write(f'{relpath}: {error}')
+
+    def save_batch(self, batch):
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            for relpath, path, source_hash, prepared in batch:
+                self.fail(relpath, e)
+                self.release(source_hash)
+        else:
+            done = []
+            for relpath, path, source_hash, prepared in batch:
+                self.known_hashes.add(source_hash)
+                duplicates = self.in_progress.pop(source_hash, [])
+                self.stats['duplicates'] += len(duplicates)
+                done += [relpath, *duplicates]
+            self.stats['imported'] += len(batch)
+            self.stats['bytes'] += sum(os.path.getsize(path) for relpath, path, source_hash, prepared in batch)
+            self.write_checkpoint(done)
+            self.report()
+        batch.clear()
+
+    @retry_if_locked
+    def write_batch(self, batch):
+        """Фото пачки и их файлы: либо всё, либо ничего"""
+        photos = []
+        try:
+            with transaction.atomic():
+                created = Photo.objects.bulk_create([
+                    Photo(title=os.path.splitext(os.path.basename(relpath))[0], status=Photo.Status.PROCESSING)
+                    for relpath, path, source_hash, prepared in batch
+                ])
+                for photo, (relpath, path, source_hash, prepared) in zip(created, batch):
+                    photos.append(photo)
+                    save_prepared(photo, prepared)
+        except Exception:
+            # Строки откатились - удаляем и уже записанные файлы пачки
+            for photo in photos:
+                for name in photo_file_names(photo):
+                    default_storage.delete(name)
+            raise
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as checkpoint:
+                return {line.rstrip('\n') for line in checkpoint if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def write_checkpoint(self, relpaths):
+        """Дописывает пути в файл прогресса (после коммита пачки)"""
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            checkpoint.writelines(f'{relpath}\n' for relpath in relpaths)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        stats = self.stats
+        message = (
+            f"{'Новых файлов' if self.dry_run else 'Импортировано'}: {stats['imported']}, "
+            f"повторов: {stats['duplicates']}, "
+            f"ошибок: {stats['failed']}; {elapsed:.1f} с, "
+            f"{stats['imported'] / elapsed:.2f} фото/с, "
+            f"{stats['bytes'] / (1024 * 1024) / elapsed:.2f} МБ/с"
+        )
+        self.stdout.write(self.style.SUCCESS(message) if final else message)
+
+    def stop(self, signum, frame):
+        # Дописываем уже сжатые фото и выходим; остальное - при следующем запуске
+        self.stopping = True
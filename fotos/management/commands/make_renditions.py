@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from fotos.models import Photo
+from fotos.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    help = 'Создаёт превью и промежуточные размеры для уже загруженных фото'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать размеры и для фото, у которых они уже есть'
+        )
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.order_by('id')
+        if not options['all']:
+            photos = photos.filter(renditions={})
+
+        done = 0
+        for photo in photos.iterator():
+            try:
+                generate_renditions(photo)
+                done += 1
+            except Exception as e:
+                self.stderr.write(f'Фото #{photo.pk}: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Обработано фото: {done}'))
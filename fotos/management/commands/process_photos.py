@@ -0,0 +1,73 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from fotos.cleanup import delete_queued_files
+from fotos.tasks import claim_jobs, get_executor, recover_jobs, run_jobs, shutdown_executor
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновой обработки загруженных фото (сжатие и размеры) и удаления их файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать очередь и выйти, не дожидаясь новых заданий'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=2.0,
+            help='Пауза между проверками пустой очереди, сек.'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=settings.PHOTO_WORKER_PROCESSES,
+            help='Сколько фото сжимать параллельно (процессов в пуле)'
+        )
+        parser.add_argument(
+            '--recover', action='store_true',
+            help='Сразу вернуть в очередь задания, прерванные падением воркера'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if options['recover']:
+            recovered = recover_jobs()
+            if recovered:
+                self.stdout.write(f'Возвращено в очередь заданий: {recovered}')
+
+        processes = max(1, options['processes'])
+
+        processed = failed = 0
+        try:
+            while not self.stopping:
+                jobs = claim_jobs(limit=processes)
+                if not jobs:
+                    # Очередь пуста - удаляем файлы удалённых фото
+                    if delete_queued_files():
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+
+                for job, error in run_jobs(jobs, get_executor(processes)).items():
+                    if error is None:
+                        processed += 1
+                        self.stdout.write(f'Фото #{job.photo_id} обработано')
+                    else:
+                        failed += 1
+                        self.stderr.write(f'Фото #{job.photo_id}: {error}')
+        finally:
+            shutdown_executor()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано фото: {processed}, с ошибкой: {failed}'
+        ))
+
+    def stop(self, signum, frame):
+        # Дорабатываем текущее задание и выходим
+        self.stopping = True
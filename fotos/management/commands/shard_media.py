@@ -0,0 +1,151 @@
+import os
+import signal
+import time
+from collections import deque
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from fotos.cache import bump_album_version
+from fotos.db import retry_if_locked
+from fotos.models import Photo
+from fotos.renditions import photo_file_names
+from fotos.storage import content_hash, is_sharded, sharded_name
+
+PHOTO_FIELDS = ('id', 'image', 'thumbnail', 'renditions', 'source_hash')
+
+
+class Command(BaseCommand):
+    help = (
+        'Раскладывает файлы фото по подпапкам ab/cd/ и обновляет пути в БД пачками, '
+        'не останавливая сайт; повторный запуск продолжает с неперенесённых фото'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько фото переносить одной транзакцией'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.1,
+            help='Пауза между пачками, сек.'
+        )
+        parser.add_argument(
+            '--linger', type=float, default=60.0,
+            help='Сколько секунд старые имена ещё отдаются (страницы, открытые до переноса)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать фото, которые нужно перенести'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # (когда удалить, [(фото, старое имя изображения, старые файлы)])
+        self.pending = deque()
+        moved = 0
+        last_id = 0
+        batch_size = max(1, options['batch_size'])
+        while not self.stopping:
+            # В обработке файлы ещё меняются - такие фото перенесёт следующий запуск
+            batch = list(
+                Photo.objects.filter(id__gt=last_id).exclude(status=Photo.Status.PROCESSING)
+                .order_by('id').only(*PHOTO_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            todo = [photo for photo in batch if not all(map(is_sharded, self.names(photo)))]
+            if todo and not options['dry_run']:
+                self.pending.append((time.monotonic() + options['linger'], self.move(todo)))
+                self.stdout.write(f'Перенесено фото: {moved + len(todo)} (до #{last_id})')
+                time.sleep(options['sleep'])
+            moved += len(todo)
+            self.unlink_expired()
+
+        # Старые имена держим linger секунд и после последней пачки
+        while self.pending:
+            time.sleep(max(0.0, self.pending[0][0] - time.monotonic()))
+            self.unlink_expired()
+
+        verb = 'Нужно перенести' if options['dry_run'] else 'Перенесено'
+        message = f'{verb} фото: {moved}'
+        if self.stopping:
+            message += '; остановлено - следующий запуск продолжит'
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def names(self, photo):
+        return [name for name in (photo.image.name, photo.thumbnail.name) if name]
+
+    def move(self, photos):
+        """Ссылки под новыми именами, затем пути в БД; старые имена пока остаются"""
+        moves = []
+        for photo in photos:
+            old_files = [name for name in photo_file_names(photo) if not is_sharded(name)]
+            for name in old_files:
+                self.link(name, sharded_name(name))
+            moves.append((photo, photo.image.name, old_files))
+
+        moved = self.update(moves)
+        bump_album_version()
+        return moved
+
+    def link(self, old, new):
+        # Жёсткая ссылка: без копирования, файл доступен под обоими именами
+        old_path, new_path = default_storage.path(old), default_storage.path(new)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            os.link(old_path, new_path)
+        except FileExistsError:
+            # Ссылка осталась от прерванного запуска
+            pass
+        except FileNotFoundError:
+            # Файла нет (например, AVIF не создавался) - переносить нечего
+            pass
+
+    @retry_if_locked
+    def update(self, moves):
+        moved = []
+        with transaction.atomic():
+            for photo, old_image, old_files in moves:
+                renditions = {
+                    size: {**rendition, 'name': sharded_name(rendition['name'])}
+                    for size, rendition in photo.renditions.items()
+                }
+                updated = self.same_files(photo, old_image).update(
+                    image=sharded_name(old_image),
+                    thumbnail=sharded_name(photo.thumbnail.name) if photo.thumbnail.name else photo.thumbnail.name,
+                    renditions=renditions,
+                )
+                # Фото удалили или изменили во время переноса - старые файлы не трогаем
+                if updated:
+                    moved.append((photo, old_image, old_files))
+        return moved
+
+    def same_files(self, photo, image):
+        """Фото с теми же файлами: повторы одного исходника делят файлы с именем по хешу"""
+        source_hash = content_hash(image)
+        if source_hash is not None:
+            return Photo.objects.filter(source_hash=source_hash, image=image)
+        return Photo.objects.filter(pk=photo.pk, image=image)
+
+    def unlink_expired(self):
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            deadline, moves = self.pending.popleft()
+            for photo, old_image, old_files in moves:
+                # Повтор исходника мог успеть получить старые имена - оставляем их
+                # (его перенесёт следующий запуск)
+                if self.same_files(photo, old_image).exists():
+                    continue
+                for name in old_files:
+                    default_storage.delete(name)
+
+    def stop(self, signum, frame):
+        # Дописываем текущую пачку и выходим
+        self.stopping = True
@@ -0,0 +1,199 @@
+"""
+Отдача файлов из MEDIA_ROOT в production.
+
+В отличие от django.views.static.serve поддерживает ETag/Last-Modified,
+докачку (Range), долгое кеширование неизменяемых файлов, выбор AVIF/WebP
+вместо JPEG по заголовку Accept и передачу отдачи обратному прокси через
+X-Accel-Redirect / X-Sendfile. Под WSGI файл отдаётся через
+wsgi.file_wrapper, под ASGI - блоками, прочитанными в пуле потоков.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .aio import offload
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# JPEG, у которых рядом могут лежать варианты в современных форматах
+NEGOTIABLE_EXTENSIONS = ('.jpg', '.jpeg')
+
+mimetypes.add_type('image/avif', '.avif')
+mimetypes.add_type('image/webp', '.webp')
+
+
+def _cache_control(path):
+    if path.startswith(settings.MEDIA_IMMUTABLE_PREFIXES):
+        # Имена в этих папках никогда не перезаписываются - кешируем навсегда
+        return f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+def _parse_range(header, size):
+    """(start, end) для одного диапазона; None - отдать файл целиком; ValueError - 416"""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Несколько диапазонов и прочие единицы не поддерживаем - отдаём весь файл
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # bytes=-500 - последние 500 байт
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _range_applies(request, etag, mtime):
+    """If-Range: докачка допустима, только если файл не изменился"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    modified_since = parse_http_date_safe(if_range)
+    return modified_since is not None and int(mtime) <= modified_since
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(STREAM_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+async def _aread_range(path, start, length):
+    """
+    То же для ASGI. Синхронный итератор Django под ASGI сначала читает
+    целиком в список, поэтому здесь асинхронный: чтение - в пуле потоков
+    """
+    blocks = _read_range(path, start, length)
+    try:
+        while (block := await offload(next, blocks, None)) is not None:
+            yield block
+    finally:
+        await offload(blocks.close)
+
+
+def _accepts(request, mime_type):
+    """Клиент явно принимает mime_type (без q=0)"""
+    for item in request.headers.get('Accept', '').split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        if media_type == mime_type:
+            return not any(param.replace(' ', '') in ('q=0', 'q=0.0') for param in params)
+    return False
+
+
+def _negotiate(request, path, full_path, st):
+    """Лучший формат, который принимает клиент: (path, full_path, stat) варианта или исходника"""
+    base = os.path.splitext(path)[0]
+    full_base = os.path.splitext(full_path)[0]
+    for ext in settings.IMAGE_MODERN_FORMATS:
+        if not _accepts(request, f'image/{ext}'):
+            continue
+        try:
+            variant_st = os.stat(f'{full_base}.{ext}')
+        except OSError:
+            continue
+        return f'{base}.{ext}', f'{full_base}.{ext}', variant_st
+    return path, full_path, st
+
+
+def _offload(response, path, full_path):
+    if settings.MEDIA_ACCEL_REDIRECT == 'x-accel':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + path
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Отдаёт файл из MEDIA_ROOT с условными запросами, Range и кешированием"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(full_path)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404('Файл не найден')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('Файл не найден')
+
+    negotiable = path.lower().endswith(NEGOTIABLE_EXTENSIONS)
+    if negotiable:
+        path, full_path, st = _negotiate(request, path, full_path, st)
+
+    size = st.st_size
+    etag = quote_etag(f'{st.st_mtime_ns:x}-{size:x}')
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': _cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+    if negotiable:
+        # Содержимое по одному URL зависит от Accept - кеши должны это учитывать
+        headers['Vary'] = 'Accept'
+
+    # 304, если у клиента актуальная копия
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if settings.MEDIA_ACCEL_REDIRECT:
+        # Файл отдаёт прокси (nginx/apache), он же обрабатывает Range
+        response = HttpResponse(content_type=content_type, headers=headers)
+        return _offload(response, path, full_path)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and _range_applies(request, etag, st.st_mtime):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    asgi = isinstance(request, ASGIRequest)
+    if byte_range is None:
+        if not asgi:
+            # Под WSGI FileResponse отдаётся через wsgi.file_wrapper (sendfile)
+            return FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
+        response = StreamingHttpResponse(
+            _aread_range(full_path, 0, size), content_type=content_type, headers=headers
+        )
+        response['Content-Length'] = str(size)
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    blocks = (_aread_range if asgi else _read_range)(full_path, start, length)
+    response = StreamingHttpResponse(blocks, status=206, content_type=content_type, headers=headers)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    return response
@@ -0,0 +1,297 @@
+"""
+Метрики запросов и обработки фото.
+
+TimingMiddleware измеряет каждый запрос: общее время, запросы к БД и их время
+(install_db_timer), время рендеринга шаблонов (через TimedDjangoTemplates)
+и этапы загрузки фото. Работает и под WSGI, и под ASGI.
+Итог уходит клиенту в заголовке Server-Timing и копится в Collector.
+
+Воркеров gunicorn несколько, поэтому каждый процесс (и process_photos тоже)
+периодически сбрасывает свои счётчики в файл METRICS_DIR/metrics-<pid>.json,
+а /metrics суммирует все файлы и отдаёт их в текстовом формате Prometheus.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Имя метрики -> (тип, описание)
+METRICS = {
+    'fotos_http_requests_total': ('counter', 'Запросы по view, методу и статусу'),
+    'fotos_http_request_duration_seconds': ('histogram', 'Время ответа по view'),
+    'fotos_db_queries_total': ('counter', 'Запросы к БД по view'),
+    'fotos_db_duration_seconds_total': ('counter', 'Время запросов к БД по view'),
+    'fotos_template_duration_seconds_total': ('counter', 'Время рендеринга шаблонов по view'),
+    'fotos_upload_stage_seconds': ('histogram', 'Этапы загрузки и обработки фото'),
+}
+
+# Время этапов текущего запроса: {'db': сек, 'db_queries': N, 'tpl': сек, ...}
+_request_timings = ContextVar('fotos_request_timings', default=None)
+
+
+class Collector:
+    """Счётчики и гистограммы одного процесса с периодическим сбросом в файл"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def _check_fork(self):
+        # После fork (пул процессов) дочерний процесс не должен повторно
+        # сбросить унаследованные счётчики родителя под своим pid
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            self.counters[key] += value
+        self.maybe_flush()
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms.setdefault(
+                key, {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            )
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Записывает снимок процесса в METRICS_DIR (атомарно, через rename)"""
+        with self.lock:
+            self._check_fork()
+            if not self.counters and not self.histograms:
+                return
+            snapshot = {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, data] for (name, labels), data in self.histograms.items()],
+            }
+            self.flushed_at = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, f'metrics-{self.pid}.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(f'{path}.tmp', path)
+
+
+collector = Collector()
+atexit.register(collector.flush)
+
+
+def _add(name, value):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + value
+
+
+def record_stage(stage, seconds):
+    """Этап загрузки фото: в Server-Timing текущего запроса и в гистограмму"""
+    _add(stage, seconds)
+    collector.observe('fotos_upload_stage_seconds', {'stage': stage}, seconds, STAGE_BUCKETS)
+
+
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    if _request_timings.get() is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _add('db', time.perf_counter() - started)
+        _add('db_queries', 1)
+
+
+def install_db_timer(sender, connection, **kwargs):
+    """
+    Обработчик connection_created: замер запросов на каждом соединении.
+    Асинхронные view ходят в БД из потоков sync_to_async со своими соединениями,
+    поэтому обёртка ставится на соединение, а запрос находится через contextvars
+    """
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+class TimedTemplate:
+    """Шаблон, время рендеринга которого попадает в метрики запроса"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            _add('tpl', time.perf_counter() - started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Обычный движок шаблонов Django с замером времени рендеринга"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def _server_timing(timings, total):
+    entries = []
+    if timings.get('db_queries'):
+        entries.append(f'db;dur={timings["db"] * 1000:.1f};desc="{timings["db_queries"]} queries"')
+    if timings.get('tpl'):
+        entries.append(f'tpl;dur={timings["tpl"] * 1000:.1f};desc="templates"')
+    for stage, seconds in timings.items():
+        if stage not in ('db', 'db_queries', 'tpl'):
+            entries.append(f'{stage};dur={seconds * 1000:.1f}')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class TimingMiddleware:
+    """Время запроса, БД и шаблонов: заголовок Server-Timing и метрики для /metrics"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        response['Server-Timing'] = _server_timing(timings, total)
+        self.record(request, response, timings, total)
+        return response
+
+    def record(self, request, response, timings, total):
+        match = request.resolver_match
+        view = (match.view_name or match.func.__name__) if match else 'unresolved'
+        labels = {'view': view}
+        collector.inc('fotos_http_requests_total', {
+            'view': view, 'method': request.method, 'status': str(response.status_code),
+        })
+        collector.observe('fotos_http_request_duration_seconds', labels, total)
+        collector.inc('fotos_db_queries_total', labels, timings.get('db_queries', 0))
+        collector.inc('fotos_db_duration_seconds_total', labels, timings.get('db', 0.0))
+        collector.inc('fotos_template_duration_seconds_total', labels, timings.get('tpl', 0.0))
+
+
+def _format_labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in items
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Сумма снимков всех процессов в текстовом формате Prometheus"""
+    collector.flush()
+
+    counters = defaultdict(float)
+    histograms = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics-*.json')):
+        try:
+            with open(path, encoding='utf-8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot['counters']:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, data in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(
+                key, {'buckets': data['buckets'], 'counts': [0] * len(data['buckets']), 'sum': 0.0, 'count': 0}
+            )
+            if total['buckets'] != data['buckets']:
+                continue
+            total['counts'] = [a + b for a, b in zip(total['counts'], data['counts'])]
+            total['sum'] += data['sum']
+            total['count'] += data['count']
+
+    lines = []
+    for metric, (metric_type, help_text) in METRICS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{_format_labels(labels)} {_format_number(value)}')
+        for (name, labels), data in sorted(histograms.items()):
+            if name != metric:
+                continue
+            for bound, count in zip(data['buckets'], data['counts']):
+                lines.append(f'{metric}_bucket{_format_labels(labels, le=bound)} {count}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, le="+Inf")} {data["count"]}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {_format_number(data["sum"])}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {data["count"]}')
+    return '\n'.join(lines) + '\n'
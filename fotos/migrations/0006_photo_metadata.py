@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fotos', '0005_photo_status_photojob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='dominant_color',
+            field=models.CharField(blank=True, max_length=7, verbose_name='Основной цвет'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='file_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Размер файла, байт'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='format',
+            field=models.CharField(blank=True, max_length=10, verbose_name='Исходный формат'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Высота'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='placeholder',
+            field=models.TextField(blank=True, verbose_name='Заглушка'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ширина'),
+        ),
+    ]
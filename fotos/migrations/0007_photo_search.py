@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-18 13:10
+
+from django.db import migrations
+
+# SQL на момент миграции: fotos.search может меняться, миграция - нет
+
+def _normalize(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+CREATE_INDEX = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS fotos_photo_fts USING fts5(
+        title, description,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '3'
+    )
+    ''',
+    "INSERT INTO fotos_photo_fts(fotos_photo_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    'DELETE FROM fotos_photo_fts',
+    f'''
+    INSERT INTO fotos_photo_fts(rowid, title, description)
+    SELECT id, {_normalize('title')}, {_normalize('description')} FROM fotos_photo
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS fotos_photo_fts_insert AFTER INSERT ON fotos_photo BEGIN
+        INSERT INTO fotos_photo_fts(rowid, title, description)
+        VALUES (new.id, {_normalize('new.title')}, {_normalize('new.description')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS fotos_photo_fts_update AFTER UPDATE OF title, description ON fotos_photo BEGIN
+        UPDATE fotos_photo_fts
+        SET title = {_normalize('new.title')}, description = {_normalize('new.description')}
+        WHERE rowid = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS fotos_photo_fts_delete AFTER DELETE ON fotos_photo BEGIN
+        DELETE FROM fotos_photo_fts WHERE rowid = old.id;
+    END
+    ''',
+]
+
+DROP_INDEX = [
+    'DROP TRIGGER IF EXISTS fotos_photo_fts_insert',
+    'DROP TRIGGER IF EXISTS fotos_photo_fts_update',
+    'DROP TRIGGER IF EXISTS fotos_photo_fts_delete',
+    'DROP TABLE IF EXISTS fotos_photo_fts',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fotos', '0006_photo_metadata'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
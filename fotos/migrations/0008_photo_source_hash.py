@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fotos', '0007_photo_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='source_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='SHA-256 исходника'),
+        ),
+    ]
@@ -1,11 +1,20 @@
 from django.db import models
-import os
+from django.utils import timezone
 import uuid  
 from PIL import Image
 from django.core.exceptions import ValidationError
+from .images import check_image_dimensions
+from .renditions import RENDITION_SIZES, processed_key
+from .storage import sharded_name, source_file_name
 
 def photo_upload_path(instance, filename):
     """Генерирует путь для сохранения файла с оптимизированным именем"""
+    if instance.source_hash:
+        # Имя по хешу исходника и версии обработки: повтор того же файла
+        # получает то же имя и не занимает места второй раз
+        # (fotos.storage.ContentAddressedStorage)
+        return source_file_name(processed_key(instance.source_hash))
+
     # Получаем расширение файла
     ext = filename.split('.')[-1].lower()
     
@@ -21,7 +30,7 @@ def photo_upload_path(instance, filename):
         filename_base = f"temp_{uuid.uuid4().hex[:8]}"
     
     # Возвращаем путь с оптимизированным именем
-    return os.path.join('photos/', f"{filename_base}.jpg")
+    return sharded_name(f"photos/{filename_base}.jpg")
 
 def validate_image_size(image):
     """Валидация размера изображения"""
@@ -32,21 +41,25 @@ def validate_image_size(image):
 def validate_image_dimensions(image):
     """Валидация размеров изображения"""
     try:
+        # Читается только заголовок - без декодирования
         img = Image.open(image)
-        width, height = img.size
-        
-        # Проверяем максимальные размеры
-        if width > 8000 or height > 8000:
-            raise ValidationError('Размер изображения не должен превышать 8000x8000 пикселей')
-        
-        # Проверяем минимальные размеры
-        if width < 100 or height < 100:
-            raise ValidationError('Размер изображения должен быть не менее 100x100 пикселей')
-            
+        check_image_dimensions(*img.size)
+    except ValidationError:
+        raise
     except Exception:
         raise ValidationError('Неподдерживаемый формат изображения')
 
+class PhotoQuerySet(models.QuerySet):
+    def ready(self):
+        """Только обработанные фото, которые можно показывать"""
+        return self.filter(status=Photo.Status.READY)
+
 class Photo(models.Model):
+    class Status(models.TextChoices):
+        PROCESSING = 'processing', 'Обрабатывается'
+        READY = 'ready', 'Готово'
+        FAILED = 'failed', 'Ошибка обработки'
+
     title = models.CharField('Название', max_length=200, blank=True)
     description = models.TextField('Описание', blank=True)
     image = models.ImageField(
@@ -57,7 +70,30 @@ class Photo(models.Model):
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     
     # Поле для превью (опционально)
-    thumbnail = models.ImageField('Превью', upload_to='thumbnail/', blank=True, null=True)
+    thumbnail = models.ImageField('Превью', upload_to='thumbnails/', blank=True, null=True)
+
+    # Варианты размеров: {'thumbnail': {'name': ..., 'width': ..., 'height': ...}, ...}
+    renditions = models.JSONField('Размеры', default=dict, blank=True)
+
+    # Пока фоновая обработка не закончена, image указывает на исходный файл
+    status = models.CharField(
+        'Статус', max_length=20, choices=Status.choices, default=Status.READY, db_index=True
+    )
+
+    # Метаданные заполняются при обработке, чтобы не открывать файл ради них
+    width = models.PositiveIntegerField('Ширина', blank=True, null=True)
+    height = models.PositiveIntegerField('Высота', blank=True, null=True)
+    file_size = models.PositiveIntegerField('Размер файла, байт', blank=True, null=True)
+    format = models.CharField('Исходный формат', max_length=10, blank=True)
+    dominant_color = models.CharField('Основной цвет', max_length=7, blank=True)
+    # Размытая заглушка 16px (data URI), видна до загрузки превью
+    placeholder = models.TextField('Заглушка', blank=True)
+    # Хеш исходного файла: повторно загруженные и импортированные файлы узнаются по нему
+    source_hash = models.CharField('SHA-256 исходника', max_length=64, blank=True, db_index=True)
+    # dHash для поиска похожих (fotos.similar), 64 бита в hex
+    phash = models.CharField('Перцептивный хеш', max_length=16, blank=True)
+
+    objects = PhotoQuerySet.as_manager()
 
     class Meta:
         ordering = ['id'] 
@@ -67,22 +103,105 @@ class Photo(models.Model):
     def __str__(self):
         return self.title or f'Фото #{self.pk}'
     
+    def get_rendition_url(self, size):
+        """URL наименьшего варианта не меньше size (или оригинала)"""
+        for name in RENDITION_SIZES[RENDITION_SIZES.index(size):]:
+            rendition = self.renditions.get(name)
+            if rendition:
+                return self.image.storage.url(rendition['name'])
+        return self.image.url
+
+    @property
+    def thumbnail_url(self):
+        return self.get_rendition_url('thumbnail')
+
+    @property
+    def medium_url(self):
+        return self.get_rendition_url('medium')
+
+    @property
+    def large_url(self):
+        return self.get_rendition_url('large')
+
+    @property
+    def srcset(self):
+        """srcset из всех сохранённых размеров ('url 300w, url 800w, ...')"""
+        candidates = {}
+        for size in RENDITION_SIZES:
+            rendition = self.renditions.get(size)
+            if rendition:
+                # Совпадающие размеры хранятся одним файлом - берём его один раз
+                candidates[rendition['name']] = rendition['width']
+        return ', '.join(
+            f'{self.image.storage.url(name)} {width}w' for name, width in candidates.items()
+        )
+
+    def get_rendition_size(self, size):
+        """(ширина, высота) варианта size из renditions, без чтения файла"""
+        rendition = self.renditions.get(size)
+        if rendition:
+            return rendition['width'], rendition['height']
+        return self.get_image_size()
+
+    @property
+    def placeholder_style(self):
+        """Inline-стиль: основной цвет и размытая заглушка до загрузки картинки"""
+        style = []
+        if self.dominant_color:
+            style.append(f'background-color: {self.dominant_color}')
+        if self.placeholder:
+            style.append(f"background-image: url('{self.placeholder}')")
+        return '; '.join(style)
+
     def get_image_size(self):
         """Возвращает размеры изображения"""
-        try:
-            if self.image:
-                img = Image.open(self.image.path)
-                return img.size
-        except:
-            pass
+        if self.width and self.height:
+            return self.width, self.height
         return None
     
     def get_file_size_mb(self):
         """Возвращает размер файла в МБ"""
-        try:
-            if self.image:
-                size_bytes = self.image.size
-                return round(size_bytes / (1024 * 1024), 2)
-        except:
-            pass
-        return None
\ No newline at end of file
+        if self.file_size is not None:
+            return round(self.file_size / (1024 * 1024), 2)
+        return None
+
+class PhotoJob(models.Model):
+    """Задание фоновой обработки фото (очередь в SQLite)"""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name='jobs', verbose_name='Фото')
+    status = models.CharField('Статус', max_length=20, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    run_after = models.DateTimeField('Не раньше', default=timezone.now)
+    locked_at = models.DateTimeField('Взято в работу', blank=True, null=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+        verbose_name = 'Задание обработки'
+        verbose_name_plural = 'Задания обработки'
+
+    def __str__(self):
+        return f'Задание #{self.pk} ({self.get_status_display()})'
+
+
+class MediaDeletion(models.Model):
+    """Файл удалённого фото, который ещё нужно удалить из storage (очередь в SQLite)"""
+    name = models.CharField('Файл', max_length=255)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Файл к удалению'
+        verbose_name_plural = 'Файлы к удалению'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,105 @@
+"""
+Обработка загруженного фото за одно декодирование.
+
+Исходник декодируется один раз; проверка размеров, поворот, уменьшение,
+все варианты размеров (JPEG и современные форматы) и метаданные получаются
+из этого изображения в памяти.
+Время каждого этапа сохраняется в IngestResult.timings.
+"""
+import hashlib
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from django.conf import settings
+from PIL import Image
+
+from .images import check_image_dimensions, decode_image, describe_image, encode_jpeg, fit_image
+from .renditions import encode_variants, render_renditions
+
+# Порядок этапов (для отчётов)
+STAGES = ('open', 'validate', 'decode', 'resize', 'encode', 'renditions', 'metadata')
+
+
+class IngestResult(NamedTuple):
+    compressed: bytes
+    variants: dict
+    size: tuple
+    renditions: dict
+    metadata: dict
+    timings: dict
+
+
+class IngestPipeline:
+    """
+    Один проход по загруженному фото. Не обращается к БД и storage,
+    поэтому может выполняться в пуле процессов
+    """
+
+    def __init__(self, image_file, max_width=None, max_height=None, quality=None, fast=None):
+        self.image_file = image_file
+        self.max_width = max_width or settings.MAX_IMAGE_WIDTH
+        self.max_height = max_height or settings.MAX_IMAGE_HEIGHT
+        self.quality = quality or settings.DEFAULT_IMAGE_QUALITY
+        self.fast = settings.IMAGE_FAST_DECODE if fast is None else fast
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def run(self):
+        with self.stage('open'):
+            # Только заголовок: формат и размеры без декодирования
+            img = Image.open(self.image_file)
+            source_format = img.format or ''
+
+        with self.stage('validate'):
+            check_image_dimensions(*img.size)
+
+        with self.stage('decode'):
+            img = decode_image(img, self.max_width, self.max_height, self.fast)
+            img.load()
+
+        with self.stage('resize'):
+            img = fit_image(img, self.max_width, self.max_height, self.fast)
+
+        with self.stage('encode'):
+            compressed = encode_jpeg(img, self.quality).getvalue()
+            variants = encode_variants(img)
+
+        with self.stage('renditions'):
+            # Из того же изображения в памяти, а не из только что сжатого JPEG
+            renditions = render_renditions(img)
+
+        with self.stage('metadata'):
+            metadata = describe_image(img)
+            metadata.update(
+                width=img.width, height=img.height,
+                file_size=len(compressed), format=source_format,
+            )
+
+        return IngestResult(compressed, variants, img.size, renditions, metadata, self.timings)
+
+
+def file_hash(image_file):
+    """SHA-256 исходного файла (hex)"""
+    return hashlib.file_digest(image_file, 'sha256').hexdigest()
+
+
+def prepare_photo(image_path, source_hash=None):
+    """
+    Вся тяжёлая работа над одним фото: сжатие, размеры и метаданные
+    (вместе с хешем исходника; source_hash - если он уже посчитан)
+    """
+    with open(image_path, 'rb') as image_file:
+        if source_hash is None:
+            source_hash = file_hash(image_file)
+            image_file.seek(0)
+        result = IngestPipeline(image_file).run()
+    result.metadata['source_hash'] = source_hash
+    return result
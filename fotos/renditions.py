@@ -0,0 +1,186 @@
+import hashlib
+import io
+import os
+
+import PIL
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, features
+
+from .storage import content_hash, content_key, is_content_addressed, sharded_name, source_file_name
+
+# Размеры из settings.IMAGE_SIZES, от меньшего к большему
+RENDITION_SIZES = ('thumbnail', 'medium', 'large')
+
+# Параметры кодеров современных форматов: скорость важнее последних процентов
+MODERN_FORMAT_PARAMS = {
+    'avif': {'format': 'AVIF', 'speed': 8},
+    'webp': {'format': 'WEBP', 'method': 4},
+}
+
+# Увеличить при изменении кода сжатия, которое не видно по настройкам ниже
+PROCESSING_REVISION = 1
+
+
+def processing_version():
+    """
+    Версия обработки для имён файлов (fotos.storage): короткий хеш всего, что
+    влияет на байты результата - настроек сжатия и размеров, кодеров и Pillow
+    """
+    params = (
+        PROCESSING_REVISION, PIL.__version__,
+        settings.MAX_IMAGE_WIDTH, settings.MAX_IMAGE_HEIGHT, settings.DEFAULT_IMAGE_QUALITY,
+        settings.IMAGE_FAST_DECODE, settings.IMAGE_REDUCING_GAP,
+        settings.IMAGE_SIZES, settings.IMAGE_QUALITY,
+        modern_formats(), settings.IMAGE_MODERN_QUALITY, MODERN_FORMAT_PARAMS,
+    )
+    return hashlib.md5(repr(params).encode()).hexdigest()[:8]
+
+
+def processed_key(source_hash):
+    """Ключ имён файлов фото, обработанного текущими параметрами"""
+    return f'{source_hash}-{processing_version()}'
+
+
+def rendition_path(image_name, size):
+    """Путь для сохранения варианта изображения нужного размера"""
+    source_hash = content_hash(image_name)
+    if source_hash is not None:
+        # Размер кодируется текущими параметрами - и имя с текущей версией
+        base = processed_key(source_hash)
+    else:
+        base = os.path.splitext(os.path.basename(image_name))[0]
+    folder = 'thumbnails' if size == 'thumbnail' else 'renditions'
+    return sharded_name(f"{folder}/{base}_{size}.jpg")
+
+
+def modern_formats():
+    """Форматы из settings.IMAGE_MODERN_FORMATS, которые умеет кодировать Pillow"""
+    return [ext for ext in settings.IMAGE_MODERN_FORMATS if ext in MODERN_FORMAT_PARAMS and features.check(ext)]
+
+
+def variant_path(name, ext):
+    """Файл того же изображения в другом формате: photos/1.jpg -> photos/1.webp"""
+    return f"{os.path.splitext(name)[0]}.{ext}"
+
+
+def photo_file_names(photo):
+    """Все файлы фото в storage: изображение, размеры и их современные форматы"""
+    names = {photo.image.name, photo.thumbnail.name}
+    names.update(rendition['name'] for rendition in photo.renditions.values())
+    names.discard('')
+    names.discard(None)
+    for name in list(names):
+        names.update(variant_path(name, ext) for ext in settings.IMAGE_MODERN_FORMATS)
+    return names
+
+
+def encode_variants(img):
+    """Кодирует изображение во все современные форматы: {ext: bytes}"""
+    variants = {}
+    for ext in modern_formats():
+        img_io = io.BytesIO()
+        img.save(img_io, quality=settings.IMAGE_MODERN_QUALITY[ext], **MODERN_FORMAT_PARAMS[ext])
+        variants[ext] = img_io.getvalue()
+    return variants
+
+
+def save_variants(name, variants):
+    """Сохраняет варианты рядом с JPEG name - точно под тем же именем"""
+    for ext, content in variants.items():
+        path = variant_path(name, ext)
+        # Имя JPEG только что оказалось свободным, значит файл с таким именем -
+        # осиротевший остаток; без удаления storage выбрал бы другое имя.
+        # Файл с именем по хешу - то же содержимое другого фото, его не трогаем
+        if default_storage.exists(path) and not is_content_addressed(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(content))
+
+
+def render_size(img, size):
+    """Уменьшает копию изображения до размера size и кодирует её в JPEG"""
+    copy = img.copy()
+    copy.thumbnail(settings.IMAGE_SIZES[size], Image.Resampling.LANCZOS)
+
+    img_io = io.BytesIO()
+    copy.save(
+        img_io,
+        format='JPEG',
+        quality=settings.IMAGE_QUALITY[size],
+        optimize=True,
+        progressive=True
+    )
+    img_io.seek(0)
+    return img_io, copy
+
+
+def open_rgb(source):
+    img = Image.open(source)
+    img.load()
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def render_renditions(img):
+    """
+    Кодирует все размеры из уже декодированного RGB-изображения.
+    Возвращает {size: (bytes или None, width, height, {ext: bytes})}; None
+    означает, что размер совпадает с предыдущим (большим) и отдельный файл не нужен
+    """
+    built = {}
+    # Идём от большего к меньшему: каждый размер уменьшаем из предыдущего
+    for size in reversed(RENDITION_SIZES):
+        max_width, max_height = settings.IMAGE_SIZES[size]
+        if img.width <= max_width and img.height <= max_height:
+            # Изображение уже помещается - повторно не кодируем
+            built[size] = (None, img.width, img.height, None)
+        else:
+            img_io, img = render_size(img, size)
+            built[size] = (img_io.getvalue(), img.width, img.height, encode_variants(img))
+    return built
+
+
+def store_renditions(photo, built):
+    """Сохраняет закодированные размеры в storage и записывает их в photo"""
+    renditions = {}
+    name = photo.image.name
+    for size in reversed(RENDITION_SIZES):
+        content, width, height, variants = built[size]
+        if content is not None:
+            name = default_storage.save(rendition_path(photo.image.name, size), ContentFile(content))
+            save_variants(name, variants)
+        renditions[size] = {'name': name, 'width': width, 'height': height}
+
+    photo.renditions = renditions
+    photo.thumbnail.name = renditions['thumbnail']['name']
+    return renditions
+
+
+def generate_renditions(photo, source=None, save=True):
+    """
+    Создаёт все варианты размеров для фото и сохраняет их в photo.renditions.
+    source - уже сжатое изображение (BytesIO), иначе читается photo.image.
+    Современные форматы создаются и для самого photo.image
+    """
+    if source is None:
+        with photo.image.open('rb') as image_file:
+            source = io.BytesIO(image_file.read())
+    img = open_rgb(source)
+
+    source_hash = content_hash(photo.image.name)
+    if source_hash is not None and content_key(photo.image.name) != processed_key(source_hash):
+        # Параметры обработки сменились. Основной JPEG без исходника не
+        # пересжать - он переходит под имя текущей версии как есть, а AVIF/WebP
+        # рядом с ним и размеры кодируются заново под новыми именами
+        source.seek(0)
+        photo.image.name = default_storage.save(
+            source_file_name(processed_key(source_hash)), ContentFile(source.read())
+        )
+
+    renditions = store_renditions(photo, render_renditions(img))
+    save_variants(photo.image.name, encode_variants(img))
+    if save:
+        photo.save(update_fields=['image', 'renditions', 'thumbnail'])
+    return renditions
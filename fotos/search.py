@@ -0,0 +1,150 @@
+"""
+Полнотекстовый поиск по названиям и описаниям фото (SQLite FTS5).
+
+Индекс - отдельная FTS5-таблица fotos_photo_fts с rowid = id фото. Её
+поддерживают триггеры на fotos_photo, поэтому в индекс попадает любое
+изменение: save() в edit_photo, bulk_create при загрузке, удаление.
+
+Токенизатор unicode61 приводит кириллицу к нижнему регистру, но не
+сворачивает "ё" в "е" - это делают триггеры (normalize в SQL) и запрос.
+Русских стеммеров в FTS5 нет, поэтому слова запроса ищутся по префиксу
+без окончания: "моря" находит "море", "морем", "морской".
+
+Таблицу создаёт миграция 0007, там же rank = bm25(10.0, 1.0): название
+весит больше описания.
+"""
+import re
+
+from django.db import connections
+
+from .models import Photo
+
+FTS_TABLE = 'fotos_photo_fts'
+
+# bm25 считается для каждого совпадения (~2 мкс на строку): слово, которое
+# есть почти в каждом из 100k описаний, ранжировалось бы 250 мс. Поэтому
+# по bm25 упорядочиваются только RANK_WINDOW самых новых совпадений, а более
+# старые идут после них от новых к старым - редкие слова (меньше совпадений,
+# чем окно) ранжируются полностью
+RANK_WINDOW = 2000
+
+# Частые окончания существительных и прилагательных; у слова запроса
+# отбрасывается самое длинное, если остаётся хотя бы MIN_STEM_LENGTH букв
+ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ах', 'ях', 'ам', 'ям', 'ом', 'ем', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ов', 'ев', 'ую', 'юю',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'й', 'ь',
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+WORD_RE = re.compile(r'\w+')
+
+
+def _normalize_sql(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+SEARCH_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON fotos_photo BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, description)
+            VALUES (new.id, {_normalize_sql('new.title')}, {_normalize_sql('new.description')});
+        END
+    ''',
+    f'{FTS_TABLE}_update': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, description ON fotos_photo BEGIN
+            UPDATE {FTS_TABLE}
+            SET title = {_normalize_sql('new.title')}, description = {_normalize_sql('new.description')}
+            WHERE rowid = new.id;
+        END
+    ''',
+    f'{FTS_TABLE}_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON fotos_photo BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        END
+    ''',
+}
+
+
+def install_search_triggers(connection):
+    """
+    Ставит недостающие триггеры. Миграции SQLite, пересоздающие fotos_photo
+    (изменение поля), удаляют её триггеры - поэтому вызывается и после migrate
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM sqlite_master WHERE type = %s AND name = %s', ['table', FTS_TABLE])
+        if cursor.fetchone() is None:
+            return
+        for sql in SEARCH_TRIGGERS.values():
+            cursor.execute(sql)
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    """Обработчик post_migrate"""
+    install_search_triggers(connections[using])
+
+
+def search_terms(query):
+    """Слова запроса без окончаний (для поиска по префиксу)"""
+    return [_stem(word) for word in WORD_RE.findall(query.lower().replace('ё', 'е'))]
+
+
+def _stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def match_expression(query):
+    """Выражение MATCH: все слова, каждое по префиксу ('' - искать нечего)"""
+    # Кавычки: слова запроса не разбираются как операторы FTS5 (AND, NEAR, ...)
+    return ' '.join(f'"{term}"*' for term in search_terms(query))
+
+
+def search_photos(query, page=1, per_page=24, fields=('id',)):
+    """
+    Готовые фото по запросу: сначала окно новых совпадений по bm25, затем
+    более старые совпадения от новых к старым.
+    Возвращает (фото страницы, есть_следующая)
+    """
+    expression = match_expression(query)
+    if not expression:
+        return [], False
+    columns = ', '.join(f'p.{field}' for field in fields)
+    limit, offset = per_page + 1, (page - 1) * per_page
+    # Старые совпадения идут в rowid DESC - порядке индекса, поэтому их
+    # достаточно прочитать до конца страницы, а не все
+    photos = list(Photo.objects.raw(
+        f'''
+        WITH window_edge AS (
+            SELECT min(rowid) AS rowid FROM (
+                SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s
+            )
+        )
+        SELECT * FROM (
+            SELECT {columns}, 0 AS search_part, {FTS_TABLE}.rank AS search_order
+            FROM {FTS_TABLE} JOIN fotos_photo p ON p.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND p.status = %s
+                AND {FTS_TABLE}.rowid >= (SELECT rowid FROM window_edge)
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT {columns}, 1, -{FTS_TABLE}.rowid
+            FROM {FTS_TABLE} JOIN fotos_photo p ON p.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND p.status = %s
+                AND {FTS_TABLE}.rowid < (SELECT rowid FROM window_edge)
+            ORDER BY {FTS_TABLE}.rowid DESC
+            LIMIT %s
+        )
+        ORDER BY search_part, search_order
+        LIMIT %s OFFSET %s
+        ''',
+        [
+            expression, RANK_WINDOW,
+            expression, Photo.Status.READY,
+            expression, Photo.Status.READY, offset + limit,
+            limit, offset,
+        ],
+    ))
+    return photos[:per_page], len(photos) > per_page
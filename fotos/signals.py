@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_album_version
+from .cleanup import drain_deletion_queue, queue_photo_files
+from .models import Photo
+
+
+@receiver(post_save, sender=Photo, dispatch_uid='fotos_photo_saved')
+@receiver(post_delete, sender=Photo, dispatch_uid='fotos_photo_deleted')
+def invalidate_album_cache(sender, **kwargs):
+    # После коммита: иначе другой процесс может закешировать старые данные
+    # между сменой версии и фиксацией транзакции
+    transaction.on_commit(bump_album_version)
+
+
+@receiver(post_delete, sender=Photo, dispatch_uid='fotos_photo_files_deleted')
+def queue_deleted_photo_files(sender, instance, **kwargs):
+    # В той же транзакции, что и удаление строки: откат вернёт и фото, и файлы
+    queue_photo_files([instance])
+    if settings.PHOTO_QUEUE_EAGER:
+        # Без воркера: удаляем сразу после коммита, как и обрабатываем фото
+        transaction.on_commit(drain_deletion_queue)
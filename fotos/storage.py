@@ -0,0 +1,97 @@
+"""
+Хранилище медиа с адресацией по содержимому.
+
+Обработанные фото называются по SHA-256 исходника и версии обработки:
+photos/ab/cd/<hash>-<версия>.jpg, renditions/ab/cd/<hash>-<версия>_medium.jpg,
+photos/ab/cd/<hash>-<версия>.webp и т.д. Одно имя - всегда одни и те же
+байты, поэтому повторная загрузка того же файла не создаёт копию на диске,
+а имена можно кешировать навсегда.
+
+Версия - короткий хеш параметров сжатия (fotos.renditions.processing_version):
+после смены качества, размеров или кодеров новые файлы получают новые имена,
+а не остаются старыми файлами, закешированными как immutable.
+
+Файлы разложены по двум уровням подпапок (ab/cd - первые символы хеша),
+чтобы в одной папке не было десятков тысяч файлов: поиск в папке, ls и
+бэкап тома не замедляются с ростом альбома. Старые файлы переносит
+manage.py shard_media.
+
+Остальные имена (incoming/, старые photos/<id>.jpg) хранятся как в
+обычном FileSystemStorage.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+# <sha256>-<версия>.jpg, <sha256>-<версия>_medium.jpg, <sha256>-<версия>.webp
+# (без версии - файлы, записанные до её появления)
+CONTENT_ADDRESSED_RE = re.compile(r'^([0-9a-f]{64})(-[0-9a-f]{8})?(_[a-z]+)?\.[a-z0-9]+$')
+
+
+def content_hash(name):
+    """SHA-256 исходника из имени файла по хешу (None для остальных имён)"""
+    match = CONTENT_ADDRESSED_RE.match(os.path.basename(name))
+    return match.group(1) if match else None
+
+
+def content_key(name):
+    """Хеш исходника с версией обработки - общий для всех файлов одной обработки"""
+    match = CONTENT_ADDRESSED_RE.match(os.path.basename(name))
+    return match.group(1) + (match.group(2) or '') if match else None
+
+
+def is_content_addressed(name):
+    return content_hash(name) is not None
+
+
+def sharded_name(name):
+    """
+    folder/ab/cd/<файл> для folder/<файл> (уже разложенное имя не меняется).
+    ab/cd - из хеша исходника для имён по хешу, иначе из md5 имени файла без
+    расширения: AVIF/WebP попадают в ту же папку, что и JPEG
+    """
+    folder, filename = name.split('/', 1)[0], os.path.basename(name)
+    key = content_hash(filename) or hashlib.md5(os.path.splitext(filename)[0].encode()).hexdigest()
+    return f'{folder}/{key[:2]}/{key[2:4]}/{filename}'
+
+
+def is_sharded(name):
+    return sharded_name(name) == name
+
+
+def source_file_name(source_key, folder='photos', ext='jpg'):
+    """Имя файла по хешу исходника (с версией обработки: source_key из processed_key)"""
+    return sharded_name(f'{folder}/{source_key}.{ext}')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который не перезаписывает и не переименовывает файлы с именем по хешу"""
+
+    def get_available_name(self, name, max_length=None):
+        if is_content_addressed(name):
+            # Файл с таким именем - то же содержимое: суффикс не нужен
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_content_addressed(name):
+            return super()._save(name, content)
+        if self.exists(name):
+            # Файл снова нужен: свежий mtime защищает его от gc_media,
+            # если прежнее фото с ним уже удалено
+            os.utime(self.path(name))
+            return name
+        # Пишем во временный файл и ставим его под настоящим именем атомарно:
+        # недописанный файл никто не увидит, а параллельная запись того же
+        # содержимого просто проигрывает гонку
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(self.path(temporary))
+        return name
@@ -0,0 +1,355 @@
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cleanup import queue_photo_files
+from .db import retry_if_locked
+from .metrics import record_stage, stage_timer
+from .models import Photo, PhotoJob
+from .pipeline import STAGES, file_hash, prepare_photo
+from .renditions import processed_key, save_variants, store_renditions
+from .storage import sharded_name, source_file_name
+
+logger = logging.getLogger(__name__)
+
+
+def store_incoming(image_file, filename):
+    """Сохраняет исходный файл как есть, до обработки"""
+    ext = os.path.splitext(filename)[1].lower() or '.jpg'
+    return default_storage.save(sharded_name(f"incoming/{uuid.uuid4().hex}{ext}"), image_file)
+
+
+def new_processing_photo(image_file, filename, title='', description=''):
+    """Сохраняет исходный файл и возвращает ещё не записанное в БД фото"""
+    # Хеш сразу при загрузке: по нему обработка найдёт уже готовый повтор
+    source_hash = file_hash(image_file)
+    image_file.seek(0)
+    photo = Photo(
+        title=title, description=description, status=Photo.Status.PROCESSING, source_hash=source_hash
+    )
+    photo.image.name = store_incoming(image_file, filename)
+    return photo
+
+
+@retry_if_locked
+def _enqueue(photos):
+    with transaction.atomic():
+        photos = Photo.objects.bulk_create(photos)
+        jobs = PhotoJob.objects.bulk_create([PhotoJob(photo=photo) for photo in photos])
+    return photos, jobs
+
+
+def add_processing_photos(photos):
+    """Записывает пачку фото и их задания в очередь одной транзакцией"""
+    photos, jobs = _enqueue(photos)
+
+    if settings.PHOTO_QUEUE_EAGER:
+        # Без воркера: обрабатываем сразу, в этом же запросе
+        claimed = [job for job in (claim_job(job.pk) for job in jobs) if job]
+        run_jobs(claimed, get_executor())
+        for photo in photos:
+            photo.refresh_from_db()
+    return photos
+
+
+# Что повтор исходника получает от уже обработанного фото (имена файлов одни и те же)
+REUSED_FIELDS = (
+    'image', 'thumbnail', 'renditions', 'width', 'height', 'file_size', 'format',
+    'dominant_color', 'placeholder', 'source_hash', 'phash',
+)
+
+
+def save_prepared(photo, prepared):
+    """Сохраняет результат prepare_photo (IngestResult) в storage и в поля фото"""
+    with stage_timer('save'):
+        # Сначала метаданные: имя файла строится по source_hash
+        for field, value in prepared.metadata.items():
+            setattr(photo, field, value)
+        photo.image.save('photo.jpg', ContentFile(prepared.compressed), save=False)
+        save_variants(photo.image.name, prepared.variants)
+        store_renditions(photo, prepared.renditions)
+        photo.status = Photo.Status.READY
+        photo.save(update_fields=['image', 'renditions', 'thumbnail', 'status', *prepared.metadata])
+    # Этапы конвейера могли выполняться в пуле процессов - учитываем их здесь
+    for stage, seconds in prepared.timings.items():
+        record_stage(stage, seconds)
+    logger.info(
+        'Фото #%s обработано: %s', photo.pk,
+        ', '.join(f'{stage} {prepared.timings[stage] * 1000:.0f} мс' for stage in STAGES if stage in prepared.timings)
+    )
+
+
+def find_processed(source_hash):
+    """
+    Готовое фото с тем же исходником (по индексу source_hash), обработанное
+    текущими параметрами, или None
+    """
+    if not source_hash:
+        return None
+    image = source_file_name(processed_key(source_hash))
+    return Photo.objects.ready().filter(source_hash=source_hash, image=image).only(*REUSED_FIELDS).first()
+
+
+def reuse_processed(photo, original):
+    """Повтор исходника: берёт файлы и метаданные готового фото без сжатия"""
+    with stage_timer('save'):
+        for field in REUSED_FIELDS:
+            setattr(photo, field, getattr(original, field))
+        photo.status = Photo.Status.READY
+        photo.save(update_fields=[*REUSED_FIELDS, 'status'])
+    logger.info('Фото #%s - повтор фото #%s, файлы общие', photo.pk, original.pk)
+
+
+_executor = None
+
+
+def get_executor(processes=None):
+    """Общий ограниченный пул процессов для сжатия (None - считать в текущем процессе)"""
+    global _executor
+    processes = processes or settings.PHOTO_WORKER_PROCESSES
+    if processes <= 1:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=processes)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _stale_before():
+    return timezone.now() - timedelta(seconds=settings.PHOTO_JOB_LOCK_TIMEOUT)
+
+
+def _claimable():
+    """Задания, которые можно взять: ждущие в очереди и зависшие после падения"""
+    return (
+        Q(status=PhotoJob.Status.QUEUED, run_after__lte=timezone.now())
+        | Q(
+            status=PhotoJob.Status.RUNNING,
+            locked_at__lt=_stale_before(),
+            attempts__lt=settings.PHOTO_JOB_MAX_ATTEMPTS,
+        )
+    )
+
+
+def _fail_interrupted(jobs):
+    """Прерванные задания без оставшихся попыток помечает проваленными"""
+    exhausted = jobs.filter(attempts__gte=settings.PHOTO_JOB_MAX_ATTEMPTS)
+    photo_ids = list(exhausted.values_list('photo_id', flat=True))
+    if photo_ids:
+        exhausted.update(status=PhotoJob.Status.FAILED, last_error='Обработка прервана', locked_at=None)
+        Photo.objects.filter(pk__in=photo_ids).update(status=Photo.Status.FAILED)
+    return len(photo_ids)
+
+
+def fail_exhausted_jobs():
+    """Зависшие задания без оставшихся попыток помечает проваленными"""
+    return _fail_interrupted(PhotoJob.objects.filter(status=PhotoJob.Status.RUNNING, locked_at__lt=_stale_before()))
+
+
+@retry_if_locked
+def claim_job(pk):
+    """Атомарно забирает задание; возвращает None, если его уже взял другой процесс"""
+    claimed = PhotoJob.objects.filter(_claimable(), pk=pk).update(
+        status=PhotoJob.Status.RUNNING,
+        locked_at=timezone.now(),
+        attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return None
+    return PhotoJob.objects.select_related('photo').get(pk=pk)
+
+
+def claim_jobs(limit=1):
+    """Берёт из очереди до limit заданий"""
+    fail_exhausted_jobs()
+    jobs = []
+    candidates = PhotoJob.objects.filter(_claimable()).values_list('pk', flat=True)[:limit * 2]
+    for pk in candidates:
+        job = claim_job(pk)
+        if job:
+            jobs.append(job)
+            if len(jobs) >= limit:
+                break
+    return jobs
+
+
+@retry_if_locked
+def _fail_job(job, error):
+    """
+    Откладывает повтор задания или помечает его проваленным.
+    Задания уже может не быть: фото удалили во время обработки
+    """
+    logger.error('Ошибка обработки фото #%s: %s', job.photo_id, error)
+    job.last_error = str(error)
+    job.locked_at = None
+    if job.attempts >= settings.PHOTO_JOB_MAX_ATTEMPTS:
+        job.status = PhotoJob.Status.FAILED
+        Photo.objects.filter(pk=job.photo_id).update(status=Photo.Status.FAILED)
+    else:
+        delay = settings.PHOTO_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.status = PhotoJob.Status.QUEUED
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    # update, а не save: save удалённое задание создал бы заново
+    PhotoJob.objects.filter(pk=job.pk).update(
+        status=job.status, last_error=job.last_error, locked_at=None, run_after=job.run_after,
+    )
+
+
+def _finish_job(job):
+    job.status = PhotoJob.Status.DONE
+    job.last_error = ''
+    job.locked_at = None
+    job.save()
+
+
+def _prepare_all(jobs, executor):
+    """Выдаёт (задание, результат prepare_photo, ошибка) по мере готовности"""
+    global _executor
+    if executor is None:
+        for job in jobs:
+            try:
+                yield job, prepare_photo(job.photo.image.path, job.photo.source_hash or None), None
+            except Exception as e:
+                yield job, None, e
+        return
+
+    futures = {
+        executor.submit(prepare_photo, job.photo.image.path, job.photo.source_hash or None): job for job in jobs
+    }
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except BrokenProcessPool as e:
+            # Процесс пула убит (например, OOM) - следующая пачка получит новый пул
+            if executor is _executor:
+                _executor = None
+            yield futures[future], None, e
+        except Exception as e:
+            yield futures[future], None, e
+
+
+class PhotoDeleted(Exception):
+    """Фото удалили, пока оно обрабатывалось; задание удалено вместе с ним"""
+
+
+def run_jobs(jobs, executor=None):
+    """
+    Выполняет пачку заданий: сжатие параллельно в пуле процессов (executor=None -
+    в текущем процессе), запись всех готовых фото в БД одной транзакцией
+    (ошибка одного фото не откатывает остальные; удалённые фото пропускаются).
+    Возвращает {job: None или текст ошибки}
+    """
+    results = {}
+    prepared = []
+    # Повторы уже обработанных исходников не сжимаются вовсе
+    reused = []
+    for job in jobs:
+        original = find_processed(job.photo.source_hash)
+        if original is not None:
+            reused.append((job, original))
+    reused_jobs = {job for job, original in reused}
+    jobs = [job for job in jobs if job not in reused_jobs]
+
+    for job, result, error in _prepare_all(jobs, executor):
+        if error is None:
+            prepared.append((job, result))
+        else:
+            _fail_job(job, error)
+            results[job] = str(error)
+
+    sources = {job: job.photo.image.name for job, result in prepared}
+    try:
+        incoming, errors = _save_batch(prepared, reused)
+    except Exception as e:
+        # Транзакция откатилась целиком - все задания пачки уходят на повтор,
+        # а уже записанные файлы - в очередь на удаление (исходники остаются)
+        _queue_written([job.photo for job, result in prepared if job.photo.image.name != sources[job]])
+        for job, result in [*prepared, *reused]:
+            _fail_job(job, e)
+            results[job] = str(e)
+        return results
+
+    for job, result in [*prepared, *reused]:
+        error = errors.get(job)
+        if isinstance(error, PhotoDeleted):
+            results[job] = str(error)
+        elif error is not None:
+            _fail_job(job, error)
+            results[job] = str(error)
+        else:
+            results[job] = None
+    for name in incoming:
+        default_storage.delete(name)
+    return results
+
+
+@retry_if_locked
+def _queue_written(photos):
+    """Файлы фото, запись которых откатилась, - в очередь на удаление"""
+    with transaction.atomic():
+        queue_photo_files(photos)
+
+
+@retry_if_locked
+def _save_batch(prepared, reused=()):
+    """
+    Записывает готовые фото пачки одной транзакцией, каждое - в своей точке
+    сохранения: ошибка одного фото не откатывает остальные.
+    Возвращает (исходники к удалению, {задание: ошибка})
+    """
+    incoming = []
+    errors = {}
+    with transaction.atomic():
+        # Под блокировкой записи фото уже не удалят до конца транзакции
+        existing = set(Photo.objects.filter(
+            pk__in=[job.photo_id for job, result in [*prepared, *reused]]
+        ).values_list('pk', flat=True))
+        for job, result in [*prepared, *reused]:
+            if job.photo_id not in existing:
+                errors[job] = PhotoDeleted('Фото удалено во время обработки')
+                continue
+            incoming_name = job.photo.image.name
+            try:
+                with transaction.atomic():
+                    if isinstance(result, Photo):
+                        reuse_processed(job.photo, result)
+                    else:
+                        save_prepared(job.photo, result)
+                    _finish_job(job)
+            except Exception as e:
+                errors[job] = e
+                if not isinstance(result, Photo) and job.photo.image.name != incoming_name:
+                    # Файлы уже записаны, а фото на них не ссылается; исходник
+                    # остаётся для повтора
+                    queue_photo_files([job.photo])
+                continue
+            if incoming_name != job.photo.image.name:
+                incoming.append(incoming_name)
+    return incoming, errors
+
+
+def recover_jobs():
+    """
+    Возвращает в очередь задания, оставшиеся "в работе" после падения воркера.
+    Задания без оставшихся попыток проваливаются: возможно, воркер падал
+    именно на них, и перезапуск не должен браться за них снова
+    """
+    running = PhotoJob.objects.filter(status=PhotoJob.Status.RUNNING)
+    _fail_interrupted(running)
+    return running.update(status=PhotoJob.Status.QUEUED, locked_at=None)
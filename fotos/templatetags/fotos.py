@@ -0,0 +1,37 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def photo_img(photo, size='large', sizes=None, **attrs):
+    """
+    <img> для фото: src варианта size, srcset из всех сохранённых размеров,
+    sizes, width/height (без сдвига вёрстки) и размытая заглушка.
+    Прочие аргументы становятся атрибутами: data_full="..." -> data-full="..."
+
+        {% photo_img photo 'thumbnail' sizes=tile_sizes loading='lazy' %}
+    """
+    attrs = {name.replace('_', '-'): value for name, value in attrs.items()}
+    attrs.setdefault('alt', photo.title or 'Фото')
+    attrs['src'] = photo.get_rendition_url(size)
+
+    srcset = photo.srcset
+    if srcset:
+        attrs['srcset'] = srcset
+        if sizes:
+            attrs['sizes'] = sizes
+
+    dimensions = photo.get_rendition_size(size)
+    if dimensions:
+        attrs['width'], attrs['height'] = dimensions
+
+    if photo.placeholder_style:
+        attrs['class'] = f"{attrs.get('class', '')} lqip".strip()
+        attrs['style'] = photo.placeholder_style
+
+    return format_html(
+        '<img {}>',
+        format_html_join(' ', '{}="{}"', ((name, value) for name, value in attrs.items() if value is not None)),
+    )
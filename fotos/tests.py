@@ -1,3 +1,1467 @@
-from django.test import TestCase
+import base64
+import csv
+import fcntl
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.shortcuts import render
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageFile
+
+from main.staticfiles import ASGIStaticFiles
+
+from . import metrics, tasks
+from .cache import album_version
+from .cleanup import MediaReferences, delete_queued_files
+from .images import compress_image
+from .media import serve_media
+from .models import MediaDeletion, Photo, PhotoJob
+from .renditions import photo_file_names, processed_key, variant_path
+from .benchmarks import bench_decode, bench_views, json_safe, run_sqlite_load, sqlite_profiles, synthetic_source
+from .pipeline import STAGES, IngestPipeline, prepare_photo
+from .search import search_photos
+from .similar import MultiIndexHash, find_similar, hamming_distance, similar_index
+from .storage import is_sharded, sharded_name, source_file_name
+from .tasks import (
+    add_processing_photos, claim_job, claim_jobs, get_executor, new_processing_photo, run_jobs, shutdown_executor,
+)
+from .views import (
+    CONCLUSION_PER_PAGE, DETAIL_IMAGE_SIZES, GALLERY_PER_PAGE, GALLERY_TILE_SIZES, conclusion_page, gallery_page,
+)
+
+
+def make_image(width, height, format='JPEG', mode='RGB', orientation=None):
+    img = Image.new(mode, (width, height), 'orange' if mode != 'P' else None)
+    params = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        params['exif'] = exif
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **params)
+    buffer.seek(0)
+    return buffer
+
+
+def upload_photo(image_file, filename, title='', description=''):
+    """Фото в очередь обработки - так же, как это делают view загрузки"""
+    return add_processing_photos([new_processing_photo(image_file, filename, title, description)])[0]
+
+
+class TempMediaMixin:
+    """Временная MEDIA_ROOT на каждый тест: файлы не попадают в настоящую папку медиа"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def media_names(self, *folders):
+        """Файлы MEDIA_ROOT (или только папок folders) по именам storage"""
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for folder in folders or ('',)
+            for root, dirs, files in os.walk(os.path.join(self.media_root, folder)) for name in files
+        )
+
+    def read(self, name):
+        with default_storage.open(name) as media_file:
+            return media_file.read()
+
+
+class CountDecodes:
+    """Считает полные декодирования файлов (ImageFile.load с непустым tile) и их размеры"""
+
+    def __enter__(self):
+        self.count = 0
+        self.sizes = []
+        original_load = ImageFile.ImageFile.load
+
+        def load(image):
+            if image.tile:
+                self.count += 1
+                self.sizes.append(image.size)
+            return original_load(image)
+
+        self.patcher = mock.patch.object(ImageFile.ImageFile, 'load', load)
+        self.patcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.patcher.stop()
+
+
+class IngestPipelineTests(SimpleTestCase):
+    def test_jpeg_is_decoded_once(self):
+        source = make_image(4000, 3000, orientation=6)
+        with CountDecodes() as decodes:
+            result = IngestPipeline(source).run()
+        self.assertEqual(decodes.count, 1)
+        # Поворот по EXIF применён: портретная ориентация
+        self.assertEqual(result.size, (810, 1080))
+        self.assertEqual(result.metadata['format'], 'JPEG')
+        self.assertEqual(set(result.renditions), {'thumbnail', 'medium', 'large'})
+
+    def test_png_with_palette_is_decoded_once(self):
+        source = make_image(2400, 1600, format='PNG', mode='P')
+        with CountDecodes() as decodes:
+            result = IngestPipeline(source).run()
+        self.assertEqual(decodes.count, 1)
+        self.assertEqual(result.metadata['format'], 'PNG')
+        self.assertEqual(result.metadata['file_size'], len(result.compressed))
+
+    def test_prepare_photo_from_file_is_decoded_once(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+            f.write(make_image(3000, 2000).getvalue())
+        self.addCleanup(os.remove, f.name)
+        with CountDecodes() as decodes:
+            result = prepare_photo(f.name)
+        self.assertEqual(decodes.count, 1)
+        self.assertEqual(set(result.timings), set(STAGES))
+
+    def test_dimensions_are_validated_before_decoding(self):
+        with CountDecodes() as decodes:
+            with self.assertRaises(ValidationError):
+                IngestPipeline(make_image(50, 50)).run()
+        self.assertEqual(decodes.count, 0)
+
+
+class CompressImageTests(SimpleTestCase):
+    def decode(self, source, fast):
+        """(размер результата, размеры, в которых Pillow декодировал исходник)"""
+        with CountDecodes() as decodes:
+            compressed, size = compress_image(source, fast=fast)
+        return size, decodes.sizes
+
+    def test_fast_decode_uses_jpeg_scaling(self):
+        # Портрет по EXIF: цель 1080x1920 после поворота, масштаб декодера 1/2
+        portrait = make_image(4000, 3000, orientation=6).getvalue()
+        self.assertEqual(self.decode(io.BytesIO(portrait), fast=True), ((810, 1080), [(2000, 1500)]))
+        self.assertEqual(self.decode(io.BytesIO(portrait), fast=False), ((810, 1080), [(4000, 3000)]))
+        # Не JPEG и JPEG меньше цели декодируются как есть
+        self.assertEqual(self.decode(make_image(2400, 1600, format='PNG'), fast=True), ((1620, 1080), [(2400, 1600)]))
+        self.assertEqual(self.decode(make_image(1000, 800), fast=True), ((1000, 800), [(1000, 800)]))
+
+    def test_decode_benchmark_compares_modes(self):
+        exact, fast = bench_decode([(4000, 3000)], repeat=1)
+        self.assertEqual((exact['mode'], fast['mode']), ('exact', 'fast'))
+        self.assertLess(fast['peak_rss_delta_mb'], exact['peak_rss_delta_mb'])
+        # Быстрый режим визуально почти не отличается от эталонного
+        self.assertGreater(fast['psnr_vs_exact'], 30)
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    """Читатели и писатели одновременно: профиль по умолчанию против production"""
+
+    def test_tuned_profile_under_concurrent_load(self):
+        profiles = sqlite_profiles()
+        before = run_sqlite_load(profiles['default'], duration=1.0)
+        after = run_sqlite_load(profiles['tuned'], duration=1.0)
+
+        # BEGIN IMMEDIATE: писатели ждут друг друга, а не падают с "database is locked"
+        self.assertGreater(before['write_errors'], 0)
+        self.assertEqual(after['write_errors'], 0)
+        self.assertEqual(after['read_errors'], 0)
+        # WAL: читатели не ждут писателей
+        self.assertGreater(after['reads_per_second'], before['reads_per_second'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BenchmarkTests(TestCase):
+    def test_views_suite(self):
+        rows = bench_views(row_counts=(30,), repeat=2)
+        self.assertEqual({row['mode'] for row in rows}, {'cold', 'cached'})
+        for row in rows:
+            # Страница - один запрос к базе, повторный визит - ни одного (кроме поиска)
+            expected = 1 if row['mode'] == 'cold' or row['case'].startswith('search') else 0
+            self.assertEqual(row['queries'], expected, row['case'])
+        json.dumps(json_safe(rows), allow_nan=False)
+
+    def test_synthetic_sources(self):
+        for mode, expected in (('RGBA', 'RGBA'), ('P', 'P'), ('CMYK', 'CMYK'), ('EXIF-rotated', 'RGB')):
+            with Image.open(io.BytesIO(synthetic_source(200, 150, mode))) as img:
+                self.assertEqual(img.mode, expected)
+        with Image.open(io.BytesIO(synthetic_source(200, 150, 'EXIF-rotated'))) as img:
+            self.assertEqual(img.getexif()[0x0112], 6)
+
+    def test_json_safe_replaces_infinity(self):
+        self.assertEqual(json_safe({'psnr': [math.inf, 1.5]}), {'psnr': [None, 1.5]})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PageCacheTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.photo = Photo.objects.create(title='Море', image='photos/1.jpg')
+        self.admin = User.objects.create_user('admin', password='pw', is_superuser=True)
+
+    def get(self, url):
+        """(содержимое страницы, сколько раз view рендерил шаблон)"""
+        with mock.patch('fotos.views.render', wraps=render) as rendered:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), rendered.call_count
+
+    def test_anonymous_pages_are_cached(self):
+        for url in ('/', '/fotos/', f'/fotos/{self.photo.pk}/'):
+            self.assertEqual(self.get(url)[1], 1, url)
+            self.assertEqual(self.get(url)[1], 0, url)
+        # Параметры курсора - часть ключа
+        self.assertEqual(self.get(f'/fotos/?after={self.photo.pk}')[1], 1)
+
+    def test_superuser_and_pending_messages_bypass_cache(self):
+        self.get('/')
+        self.client.force_login(self.admin)
+        self.assertEqual(self.get('/')[1], 1)
+        self.assertEqual(self.get('/')[1], 1)
+        # После выхода ждёт сообщение "Вы успешно вышли" - страница не из кеша
+        self.client.get('/logout/')
+        self.assertEqual(self.get('/')[1], 1)
+
+    def test_photo_save_and_delete_invalidate_pages(self):
+        url = f'/fotos/{self.photo.pk}/'
+        self.get('/fotos/')
+        self.get(url)
+        # update() не вызывает сигналы: закешированные страницы остаются
+        Photo.objects.filter(pk=self.photo.pk).update(title='Горы')
+        self.assertIn('Море', self.get(url)[0])
+
+        self.photo.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.photo.save()
+        self.assertEqual(self.get(url), (mock.ANY, 1))
+        self.assertIn('Горы', self.get('/fotos/')[0])
+
+        version = album_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.photo.delete()
+        self.assertGreater(album_version(), version)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertNotIn('Горы', self.get('/fotos/')[0])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        override = override_settings(METRICS_DIR=metrics_dir, METRICS_TOKEN='secret')
+        override.enable()
+        self.addCleanup(override.disable)
+        self.metrics_dir = metrics_dir
+        # Счётчики процесса и кеш страниц - заново для каждого теста
+        metrics.collector.reset()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/fotos/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_metrics_of_all_processes_are_summed(self):
+        self.client.get('/fotos/')
+        # Снимок другого воркера gunicorn
+        with open(os.path.join(self.metrics_dir, 'metrics-1.json'), 'w') as snapshot:
+            json.dump({
+                'counters': [['fotos_http_requests_total', [['method', 'GET'], ['status', '200'], ['view', 'gallery']], 2]],
+                'histograms': [],
+            }, snapshot)
+
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'fotos_http_requests_total{method="GET",status="200",view="gallery"} 3.0',
+            response.content.decode(),
+        )
+
+    def test_upload_stages_are_observed(self):
+        with metrics.stage_timer('decode'):
+            pass
+        self.assertIn('fotos_upload_stage_seconds_count{stage="decode"}', metrics.render_metrics())
+
+
+@override_settings(PHOTO_QUEUE_EAGER=True, PHOTO_WORKER_PROCESSES=1)
+class AsyncViewsTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    async def test_ajax_upload_and_gallery(self):
+        user = await User.objects.acreate_user('admin', password='pw', is_superuser=True)
+        await self.async_client.aforce_login(user)
+        image = base64.b64encode(make_image(2000, 1500).getvalue()).decode()
+        response = await self.async_client.post(
+            '/fotos/upload/', {'image': f'data:image/jpeg;base64,{image}', 'title': 'Море'},
+            content_type='application/json', headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+        data = response.json()
+        self.assertTrue(data['success'], data)
+        photo = await Photo.objects.aget(pk=data['photo_id'])
+        self.assertEqual(photo.status, Photo.Status.READY)
+
+        await self.async_client.alogout()
+        response = await self.async_client.get('/fotos/')
+        self.assertContains(response, 'Море')
+        response = await self.async_client.get(f'/fotos/{photo.pk}/')
+        self.assertEqual(response.status_code, 200)
+        feed = (await self.async_client.get('/fotos/feed/')).json()
+        self.assertEqual([item['id'] for item in feed['photos']], [photo.pk])
+
+
+@override_settings(PHOTO_QUEUE_EAGER=False, PHOTO_JOB_MAX_ATTEMPTS=3, PHOTO_JOB_RETRY_DELAY=30)
+class PhotoQueueTests(TempMediaMixin, TestCase):
+    def enqueue(self, content):
+        photo = upload_photo(ContentFile(content), 'a.jpg')
+        return photo, PhotoJob.objects.get(photo=photo)
+
+    def test_failed_job_backs_off_then_fails(self):
+        photo, job = self.enqueue(b'not an image')
+        for attempt, delay in ((1, 30), (2, 60)):
+            before = timezone.now()
+            with self.assertLogs('fotos.tasks', 'ERROR'):
+                results = run_jobs(claim_jobs())
+            self.assertEqual([job.pk for job in results], [job.pk])
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (PhotoJob.Status.QUEUED, attempt))
+            self.assertTrue(job.last_error)
+            self.assertGreaterEqual(job.run_after, before + timedelta(seconds=delay))
+            # До run_after задание не берётся
+            self.assertEqual(claim_jobs(), [])
+            PhotoJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+        with self.assertLogs('fotos.tasks', 'ERROR'):
+            run_jobs(claim_jobs())
+        job.refresh_from_db()
+        photo.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (PhotoJob.Status.FAILED, 3))
+        self.assertEqual(photo.status, Photo.Status.FAILED)
+        self.assertEqual(claim_jobs(), [])
+
+    def test_stale_lock_is_reclaimed(self):
+        photo, job = self.enqueue(make_image(400, 300).getvalue())
+        self.assertIsNotNone(claim_job(job.pk))
+        # Воркер "упал" с заданием: пока блокировка свежая, его никто не берёт
+        self.assertEqual(claim_jobs(), [])
+        stale = timezone.now() - timedelta(seconds=settings.PHOTO_JOB_LOCK_TIMEOUT + 1)
+        PhotoJob.objects.filter(pk=job.pk).update(locked_at=stale)
+        [reclaimed] = claim_jobs()
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (job.pk, 2))
+
+        # Последняя попытка тоже зависла - задание проваливается
+        PhotoJob.objects.filter(pk=job.pk).update(locked_at=stale, attempts=3)
+        self.assertEqual(claim_jobs(), [])
+        photo.refresh_from_db()
+        self.assertEqual(photo.status, Photo.Status.FAILED)
+
+    def test_recover_requeues_interrupted_jobs(self):
+        photo, job = self.enqueue(make_image(400, 300).getvalue())
+        crashing, crashing_job = self.enqueue(make_image(300, 400).getvalue())
+        claim_job(job.pk)
+        claim_job(crashing_job.pk)
+        PhotoJob.objects.filter(pk=crashing_job.pk).update(attempts=3)
+
+        stdout = io.StringIO()
+        # Команда ставит обработчики SIGTERM/SIGINT - не меняем их у процесса тестов
+        with mock.patch('signal.signal'):
+            call_command('process_photos', '--recover', '--once', '--processes', '1', stdout=stdout)
+        self.assertIn('Возвращено в очередь заданий: 1', stdout.getvalue())
+        photo.refresh_from_db()
+        crashing.refresh_from_db()
+        self.assertEqual(photo.status, Photo.Status.READY)
+        # Исчерпавшее попытки задание (возможно, роняло воркер) не берётся снова
+        self.assertEqual(crashing.status, Photo.Status.FAILED)
+        self.assertEqual(PhotoJob.objects.get(pk=crashing_job.pk).status, PhotoJob.Status.FAILED)
+
+
+    def test_form_batch_is_compressed_in_pool(self):
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_superuser=True))
+        files = [
+            SimpleUploadedFile('a.jpg', make_image(2400, 1600).getvalue(), 'image/jpeg'),
+            SimpleUploadedFile('notes.txt', b'text', 'text/plain'),
+            SimpleUploadedFile('tiny.jpg', make_image(50, 50).getvalue(), 'image/jpeg'),
+            SimpleUploadedFile('b.png', make_image(1200, 900, format='PNG').getvalue(), 'image/png'),
+        ]
+        response = self.client.post('/fotos/upload/', {'images': files}, follow=True)
+        # Результат - по каждому файлу
+        reported = [str(message) for message in response.context['messages']]
+        self.assertIn('Файл notes.txt не является изображением', reported)
+        self.assertTrue(any(message.startswith('Файл tiny.jpg:') for message in reported))
+        self.assertIn('Загружено 2 фото, они появятся в галерее после обработки', reported)
+        good = list(Photo.objects.order_by('id'))
+        broken, broken_job = self.enqueue(b'not an image')
+
+        self.addCleanup(shutdown_executor)
+        with self.assertLogs('fotos.tasks', 'ERROR'):
+            results = run_jobs(claim_jobs(limit=3), get_executor(2))
+        self.assertEqual(sorted(error is None for error in results.values()), [False, True, True])
+        for photo in good:
+            photo.refresh_from_db()
+            self.assertEqual(photo.status, Photo.Status.READY)
+            self.assertEqual(set(photo.renditions), {'thumbnail', 'medium', 'large'})
+        self.assertEqual((good[0].width, good[1].width), (1620, 1200))
+        broken_job.refresh_from_db()
+        self.assertEqual(broken_job.status, PhotoJob.Status.QUEUED)
+
+    def test_failed_photo_does_not_roll_back_batch(self):
+        photos = [self.enqueue(make_image(400, 300 + i).getvalue())[0] for i in range(2)]
+        calls = []
+        original_save_prepared = tasks.save_prepared
+
+        def save_prepared(photo, prepared):
+            calls.append(photo.pk)
+            original_save_prepared(photo, prepared)
+            if len(calls) == 2:
+                raise OSError('No space left on device')
+
+        with mock.patch('fotos.tasks.save_prepared', save_prepared), self.assertLogs('fotos.tasks', 'ERROR'):
+            results = run_jobs(claim_jobs(limit=2))
+        self.assertEqual(list(results.values()), [None, 'No space left on device'])
+        saved, failed = photos
+        saved.refresh_from_db()
+        self.assertEqual(saved.status, Photo.Status.READY)
+        # Второе фото откатилось к исходнику и вернулось в очередь, а уже
+        # записанные для него файлы ждут удаления
+        incoming = failed.image.name
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.image.name), (Photo.Status.PROCESSING, incoming))
+        self.assertEqual(PhotoJob.objects.get(photo=failed).status, PhotoJob.Status.QUEUED)
+        queued = set(MediaDeletion.objects.values_list('name', flat=True))
+        self.assertTrue(queued)
+        self.assertNotIn(incoming, queued)
+        self.assertTrue(all(name.startswith(('photos/', 'renditions/', 'thumbnails/')) for name in queued))
+
+    def test_photo_deleted_while_running_is_skipped(self):
+        photos = [self.enqueue(make_image(400, 300 + i).getvalue())[0] for i in range(2)]
+        jobs = claim_jobs(limit=2)
+        deleted, kept = photos
+        with self.captureOnCommitCallbacks(execute=True):
+            Photo.objects.filter(pk=deleted.pk).delete()
+
+        results = run_jobs(jobs)
+        self.assertEqual(list(results.values()), ['Фото удалено во время обработки', None])
+        kept.refresh_from_db()
+        self.assertEqual(kept.status, Photo.Status.READY)
+        self.assertEqual(list(PhotoJob.objects.values_list('photo_id', 'status')), [(kept.pk, PhotoJob.Status.DONE)])
+
+
+class ServeMediaTests(TempMediaMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        for name, content in (
+            ('photos/ab/cd/a.jpg', b'0123456789'),
+            ('photos/ab/cd/a.avif', b'avif'),
+            ('photos/ab/cd/a.webp', b'webp'),
+            ('incoming/b.png', b'png'),
+        ):
+            default_storage.save(name, ContentFile(content))
+
+    def get(self, path, **headers):
+        response = serve_media(self.factory.get(f'/media/{path}', headers=headers), path)
+        self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_conditional_requests_and_caching(self):
+        response = self.get('photos/ab/cd/a.jpg')
+        self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        not_modified = self.get('photos/ab/cd/a.jpg', if_none_match=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual((not_modified['ETag'], not_modified['Vary']), (response['ETag'], 'Accept'))
+        not_modified = self.get('photos/ab/cd/a.jpg', if_modified_since=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        # Не из неизменяемых папок - короткое кеширование, без Vary у не-JPEG
+        response = self.get('incoming/b.png')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}')
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_ranges(self):
+        etag = self.get('photos/ab/cd/a.jpg')['ETag']
+        for header, content, content_range in (
+            ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', b'789', 'bytes 7-9/10'),
+            ('bytes=8-100', b'89', 'bytes 8-9/10'),
+            ('bytes=-3', b'789', 'bytes 7-9/10'),
+        ):
+            response = self.get('photos/ab/cd/a.jpg', range=header)
+            self.assertEqual((response.status_code, self.content(response)), (206, content), header)
+            self.assertEqual(response['Content-Range'], content_range)
+            self.assertEqual(response['Content-Length'], str(len(content)))
+
+        for header in ('bytes=10-', 'bytes=5-2'):
+            response = self.get('photos/ab/cd/a.jpg', range=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'), header)
+        # Несколько диапазонов не поддерживаются - весь файл
+        self.assertEqual(self.get('photos/ab/cd/a.jpg', range='bytes=0-1,4-5').status_code, 200)
+
+        # If-Range: докачка только неизменившегося файла
+        self.assertEqual(self.get('photos/ab/cd/a.jpg', range='bytes=2-5', if_range=etag).status_code, 206)
+        response = self.get('photos/ab/cd/a.jpg', range='bytes=2-5', if_range='"old"')
+        self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+        response = self.get('photos/ab/cd/a.jpg', range='bytes=2-5', if_range='Thu, 01 Jan 1970 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_asgi_reads_file_in_blocks(self):
+        factory = AsyncRequestFactory()
+        for headers, status, content in (({}, 200, b'0123456789'), ({'range': 'bytes=2-5'}, 206, b'2345')):
+            response = serve_media(factory.get('/media/photos/ab/cd/a.jpg', headers=headers), 'photos/ab/cd/a.jpg')
+            # Под ASGI - асинхронный итератор: Django не соберёт файл в список целиком
+            self.assertTrue(response.is_async)
+
+            async def read():
+                return b''.join([chunk async for chunk in response.streaming_content])
+
+            self.assertEqual((response.status_code, async_to_sync(read)()), (status, content))
+            self.assertEqual(response['Content-Length'], str(len(content)))
+
+    def test_accept_negotiation(self):
+        for accept, content in (
+            ('image/avif,image/webp,*/*', b'avif'),
+            ('image/webp,*/*', b'webp'),
+            ('image/avif;q=0, image/webp', b'webp'),
+            ('*/*', b'0123456789'),
+            ('', b'0123456789'),
+        ):
+            response = self.get('photos/ab/cd/a.jpg', accept=accept)
+            self.assertEqual(self.content(response), content, accept)
+            self.assertEqual(response['Vary'], 'Accept')
+        self.assertEqual(self.get('photos/ab/cd/a.jpg', accept='image/webp')['Content-Type'], 'image/webp')
+
+        # Без варианта на диске - JPEG
+        os.remove(os.path.join(self.media_root, 'photos/ab/cd/a.avif'))
+        self.assertEqual(self.content(self.get('photos/ab/cd/a.jpg', accept='image/avif')), b'0123456789')
+
+    def test_offload_to_proxy(self):
+        with override_settings(MEDIA_ACCEL_REDIRECT='x-accel', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.get('photos/ab/cd/a.jpg', accept='image/webp', range='bytes=2-5')
+            # Range обрабатывает прокси
+            self.assertEqual((response.status_code, response.content), (200, b''))
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photos/ab/cd/a.webp')
+            self.assertEqual(response['Content-Type'], 'image/webp')
+        with override_settings(MEDIA_ACCEL_REDIRECT='x-sendfile'):
+            response = self.get('photos/ab/cd/a.jpg')
+            self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, 'photos/ab/cd/a.jpg'))
+
+    def test_missing_files_and_traversal(self):
+        outside = os.path.join(os.path.dirname(self.media_root), f'{os.path.basename(self.media_root)}-secret')
+        with open(outside, 'w') as f:
+            f.write('secret')
+        self.addCleanup(os.remove, outside)
+        for path in (
+            'photos/ab/cd/missing.jpg',
+            'photos/ab/cd',
+            f'../{os.path.basename(outside)}',
+            'photos/../../etc/passwd',
+            outside,
+        ):
+            with self.assertRaises(Http404, msg=path):
+                self.get(path)
+        response = serve_media(self.factory.post('/media/photos/ab/cd/a.jpg'), 'photos/ab/cd/a.jpg')
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GalleryPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        photos = [Photo(title=f'Фото {i}', description='x' * 1000, image=f'photos/{i}.jpg') for i in range(15)]
+        photos[7].status = Photo.Status.PROCESSING
+        self.ids = [photo.pk for photo in Photo.objects.bulk_create(photos) if photo.status == Photo.Status.READY]
+
+    def page(self, query=''):
+        response = self.client.get(f'/fotos/{query}')
+        return [photo.pk for photo in response.context['photos']], response.content.decode()
+
+    def test_gallery_pages_by_cursor(self):
+        first, html = self.page()
+        self.assertEqual(first, self.ids[:6])
+        self.assertIn(f'href="?after={self.ids[5]}"', html)
+        self.assertNotIn('?before=', html)
+        # Фото в обработке пропускается, курсор - id, а не номер страницы
+        second, html = self.page(f'?after={self.ids[5]}')
+        self.assertEqual(second, self.ids[6:12])
+        self.assertIn(f'href="?before={self.ids[6]}"', html)
+        last, html = self.page(f'?after={self.ids[11]}')
+        self.assertEqual(last, self.ids[12:])
+        self.assertNotIn('?after=', html)
+        self.assertIn('"nextCursor": null', html)
+        self.assertEqual(self.page(f'?before={self.ids[6]}')[0], self.ids[:6])
+        self.assertEqual(self.page('?after=oops')[0], self.ids[:6])
+
+    def test_feed(self):
+        feed = self.client.get('/fotos/feed/', {'after': self.ids[2], 'limit': 5}).json()
+        self.assertEqual([tile['id'] for tile in feed['photos']], self.ids[3:8])
+        self.assertEqual(feed['next'], self.ids[7])
+        tile = feed['photos'][0]
+        self.assertEqual(tile['detail_url'], f'/fotos/{self.ids[3]}/')
+        self.assertEqual(tile['sizes'], GALLERY_TILE_SIZES)
+        feed = self.client.get('/fotos/feed/', {'after': self.ids[7], 'limit': 1000}).json()
+        self.assertEqual(([tile['id'] for tile in feed['photos']], feed['next']), (self.ids[8:], None))
+        feed = self.client.get('/fotos/feed/', {'limit': 'many'}).json()
+        self.assertEqual(len(feed['photos']), GALLERY_PER_PAGE)
+
+    def test_one_query_without_count_offset_or_description(self):
+        for after in (None, self.ids[0], self.ids[-2]):
+            with CaptureQueriesContext(connection) as queries:
+                gallery_page(after)
+            [query] = queries.captured_queries
+            sql = query['sql'].upper()
+            self.assertNotIn('COUNT(', sql)
+            self.assertNotIn('OFFSET', sql)
+            self.assertNotIn('"DESCRIPTION"', sql)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConclusionTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        photos = Photo.objects.bulk_create(
+            Photo(title=f'Фото {i}', description=f"Описание '{i}'", image=f'photos/{i}.jpg') for i in range(55)
+        )
+        self.ids = [photo.pk for photo in photos]
+        self.admin = User.objects.create_user('admin', password='pw', is_superuser=True)
+
+    def get(self, query=''):
+        """(страница, сколько раз строился список фото)"""
+        with mock.patch('fotos.views.conclusion_page', wraps=conclusion_page) as built:
+            html = self.client.get(f'/fotos/conclusion/{query}').content.decode()
+        return html, built.call_count
+
+    def test_next_link_pages_through_album(self):
+        html, built = self.get()
+        self.assertEqual(html.count('class="photo-title-link"'), CONCLUSION_PER_PAGE)
+        self.assertIn(f'href="?after={self.ids[49]}"', html)
+        self.assertNotIn('?before=', html)
+
+        html, built = self.get(f'?after={self.ids[49]}')
+        self.assertEqual(html.count('class="photo-title-link"'), 5)
+        self.assertIn(f'/fotos/{self.ids[50]}/', html)
+        self.assertIn(f'href="?before={self.ids[50]}"', html)
+        self.assertNotIn('?after=', html)
+
+    def test_fragment_is_cached_per_user_kind_until_album_changes(self):
+        self.assertEqual(self.get()[1], 1)
+        self.assertEqual(self.get()[1], 0)
+
+        # Суперюзер получает свой фрагмент с кнопками редактирования
+        self.client.force_login(self.admin)
+        html, built = self.get()
+        self.assertEqual(built, 1)
+        self.assertIn('📤 Загрузить фото', html)
+        self.assertIn("showPhotoModal(%d, 'Фото 0', 'Описание \\u00270\\u0027')" % self.ids[0], html)
+        self.client.logout()
+        html, built = self.get()
+        self.assertEqual(built, 0)
+        self.assertNotIn('showPhotoModal(', html)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Photo.objects.get(pk=self.ids[0]).delete()
+        html, built = self.get()
+        self.assertEqual(built, 1)
+        self.assertNotIn(f'/fotos/{self.ids[0]}/', html)
+
+
+@override_settings(PHOTO_QUEUE_EAGER=False)
+class ChunkedUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        override = override_settings(FILE_UPLOAD_TEMP_DIR=temp_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.chunked_dir = os.path.join(temp_dir, 'chunked')
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_superuser=True))
+
+    def start(self, content, title='Море'):
+        session = self.client.post(
+            '/fotos/upload/chunked/', {'filename': 'sea.jpg', 'size': len(content), 'title': title},
+            content_type='application/json',
+        ).json()
+        self.assertTrue(session['success'])
+        return session['upload_url']
+
+    def put(self, url, offset, chunk):
+        return self.client.put(url, chunk, content_type='application/octet-stream', headers={'Upload-Offset': str(offset)})
+
+    def test_resume_and_finish(self):
+        content = make_image(400, 300).getvalue()
+        url = self.start(content)
+        self.assertEqual(self.put(url, 0, content[:1000]).json(), {'success': True, 'offset': 1000})
+
+        # Часть потерялась: сервер называет ожидаемое смещение, клиент докачивает с него
+        response = self.put(url, 2000, content[2000:3000])
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Ожидалось смещение 1000', response.json()['error'])
+        self.assertEqual(self.client.get(url).json()['offset'], 1000)
+        response = self.put(url, 1000, content[1000:] + b'extra')
+        self.assertEqual((response.status_code, response.json()['success']), (409, False))
+
+        response = self.client.post(url + 'finish/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.put(url, 1000, content[1000:]).json()['offset'], len(content))
+
+        result = self.client.post(url + 'finish/').json()
+        self.assertTrue(result['success'])
+        photo = Photo.objects.get(pk=result['photo_id'])
+        self.assertEqual((photo.title, photo.status), ('Море', Photo.Status.PROCESSING))
+        self.assertEqual(self.read(photo.image.name), content)
+        self.assertEqual(os.listdir(self.chunked_dir), [])
+
+    def test_concurrent_part_is_rejected(self):
+        content = make_image(400, 300).getvalue()
+        url = self.start(content)
+        [part_name] = [name for name in os.listdir(self.chunked_dir) if name.endswith('.part')]
+        # Первая часть ещё пишется (файл заблокирован) - повтор с тем же смещением получает 409
+        with open(os.path.join(self.chunked_dir, part_name), 'r+b') as part_file:
+            fcntl.flock(part_file, fcntl.LOCK_EX)
+            response = self.put(url, 0, content[:1000])
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('уже принимается', response.json()['error'])
+        self.assertEqual(self.client.get(url).json()['offset'], 0)
+        self.assertEqual(self.put(url, 0, content[:1000]).json()['offset'], 1000)
+
+    def test_unknown_upload(self):
+        for url in ('/fotos/upload/chunked/nope/', f'/fotos/upload/chunked/{"0" * 32}/'):
+            self.assertEqual(self.client.get(url).status_code, 409)
+            self.assertEqual(self.client.post(url + 'finish/').json()['success'], False)
+
+    def test_failed_finish_discards_upload(self):
+        small = make_image(50, 50).getvalue()
+        url = self.start(small)
+        self.put(url, 0, small)
+        response = self.client.post(url + 'finish/')
+        self.assertEqual((response.status_code, response.json()['success']), (400, False))
+        self.assertEqual(os.listdir(self.chunked_dir), [])
+
+        content = make_image(400, 300).getvalue()
+        url = self.start(content)
+        self.put(url, 0, content)
+        with mock.patch('fotos.views.new_processing_photo', side_effect=OSError('No space left on device')):
+            response = self.client.post(url + 'finish/')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'success': False, 'error': 'Ошибка при загрузке: No space left on device'})
+        self.assertEqual(os.listdir(self.chunked_dir), [])
+        self.assertFalse(Photo.objects.exists())
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.sea = Photo.objects.create(title='Море', description='Закат на берегу', image='photos/1.jpg')
+        self.tree = Photo.objects.create(title='Ёлка', description='Новый год у моря', image='photos/2.jpg')
+        self.hidden = Photo.objects.create(
+            title='Море ночью', image='photos/3.jpg', status=Photo.Status.PROCESSING
+        )
+
+    def found(self, query):
+        photos, has_next = search_photos(query)
+        return [photo.pk for photo in photos]
+
+    def test_russian_word_forms_and_yo(self):
+        # Название весит больше описания; необработанные фото не ищутся
+        self.assertEqual(self.found('морем'), [self.sea.pk, self.tree.pk])
+        self.assertEqual(self.found('елки'), [self.tree.pk])
+        self.assertEqual(self.found('ЗАКАТЫ берег'), [self.sea.pk])
+        self.assertEqual(self.found('"OR*'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.sea.title = 'Горы'
+        self.sea.save()
+        Photo.objects.filter(pk=self.tree.pk).update(description='Снег')
+        self.assertEqual(self.found('горы'), [self.sea.pk])
+        self.assertEqual(self.found('моря'), [])
+
+        self.sea.delete()
+        self.assertEqual(self.found('горы'), [])
+
+    def test_search_api_pagination(self):
+        for i in range(3):
+            Photo.objects.create(title=f'Закат {i}', image=f'photos/z{i}.jpg')
+        with mock.patch('fotos.views.SEARCH_PER_PAGE', 3):
+            first = self.client.get('/fotos/search/api/', {'q': 'закат'}).json()
+            second = self.client.get('/fotos/search/api/', {'q': 'закат', 'page': 2}).json()
+        self.assertEqual((len(first['photos']), first['next_page']), (3, 2))
+        # Совпадение только в описании - последним
+        self.assertEqual([photo['id'] for photo in second['photos']], [self.sea.pk])
+        self.assertIsNone(second['next_page'])
+
+        response = self.client.get('/fotos/search/', {'q': 'закат'})
+        self.assertContains(response, 'Закат 0')
+
+    def test_pages_continue_past_rank_window(self):
+        old = [Photo.objects.create(title=f'Закат {i}', image=f'photos/z{i}.jpg') for i in range(2)]
+        new = [Photo.objects.create(title=f'Закат {i}', image=f'photos/z{i}.jpg') for i in range(2, 4)]
+        Photo.objects.create(title='Закат 4', image='photos/z4.jpg', status=Photo.Status.PROCESSING)
+        pages = []
+        with mock.patch('fotos.search.RANK_WINDOW', 3):
+            for page in range(1, 4):
+                photos, has_next = search_photos('закат', page, per_page=2)
+                pages.append(([photo.pk for photo in photos], has_next))
+        # Окно (3 новых совпадения, одно в обработке) - по bm25, дальше от новых к старым
+        self.assertEqual({*pages[0][0]}, {photo.pk for photo in new})
+        self.assertEqual(pages[1:], [([old[1].pk, old[0].pk], True), ([self.sea.pk], False)])
+        self.assertTrue(pages[0][1])
+
+
+class MultiIndexHashTests(SimpleTestCase):
+    def test_search_matches_brute_force(self):
+        rng = random.Random(1)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        # Близкие соседи: несколько перевёрнутых бит
+        hashes += [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for value in hashes[:200]]
+        index = MultiIndexHash()
+        for key, value in enumerate(hashes):
+            index.add(key, value)
+
+        for query in hashes[:50] + [rng.getrandbits(64) for _ in range(10)]:
+            for max_distance in (0, 3, 10, 13):
+                expected = sorted(
+                    (hamming_distance(query, value), key) for key, value in enumerate(hashes)
+                    if hamming_distance(query, value) <= max_distance
+                )
+                self.assertEqual(index.search(query, max_distance), expected)
+
+
+@override_settings(PHOTO_QUEUE_EAGER=True, PHOTO_WORKER_PROCESSES=1, SIMILAR_UPLOAD_WARNING=True)
+class SimilarPhotosTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        similar_index.clear()
+        self.addCleanup(similar_index.clear)
+
+    def scene(self, width, height, shift=0):
+        """Градиент с пятнами: у пересохранённой копии dHash почти тот же"""
+        img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+        for i in range(4):
+            x, y = (i * 97 + shift) % width, (i * 61) % height
+            img.paste((200, 40 * i, 90), (x, y, x + width // 5, y + height // 6))
+        return img
+
+    def jpeg(self, img, quality=90):
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+
+    def test_resaved_copy_is_similar(self):
+        original = upload_photo(ContentFile(self.jpeg(self.scene(1600, 1200))), 'a.jpg', 'Оригинал')
+        other = upload_photo(
+            ContentFile(self.jpeg(self.scene(1200, 1600).rotate(90, expand=True))), 'b.jpg', 'Другое'
+        )
+        # Копия из мессенджера: меньше и сильнее сжата
+        copy = self.scene(1600, 1200).resize((640, 480))
+        user = User.objects.create_user('admin', password='pw', is_superuser=True)
+        self.client.force_login(user)
+        response = self.client.post(
+            '/fotos/upload/',
+            {'image': 'data:image/jpeg;base64,' + base64.b64encode(self.jpeg(copy, 40)).decode(), 'title': 'Копия'},
+            content_type='application/json', headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+        data = response.json()
+        self.assertTrue(data['success'], data)
+        self.assertEqual([item['id'] for item in data['similar']], [original.pk])
+
+        copy_photo = Photo.objects.get(pk=data['photo_id'])
+        self.assertNotEqual(copy_photo.source_hash, original.source_hash)
+        self.client.logout()
+        response = self.client.get(f'/fotos/{original.pk}/similar/')
+        self.assertContains(response, f'/fotos/{copy_photo.pk}/')
+        self.assertNotContains(response, f'/fotos/{other.pk}/')
+
+    def test_limit_counts_only_requested_statuses(self):
+        def photo(bits, status):
+            return Photo.objects.create(image=f'photos/{bits}.jpg', phash=f'{bits:016x}', status=status)
+
+        # Ближайшие соседи - не готовые фото и не должны занимать места в limit
+        photo(0b1, Photo.Status.FAILED)
+        photo(0b10, Photo.Status.PROCESSING)
+        deleted = photo(0b100, Photo.Status.READY)
+        ready = [photo(0b11, Photo.Status.READY), photo(0b111, Photo.Status.READY)]
+        similar_index.refresh()
+        deleted.delete()
+
+        found = find_similar(f'{0:016x}', limit=2, fields=('id',))
+        self.assertEqual([(item.pk, item.distance) for item in found], [(ready[0].pk, 2), (ready[1].pk, 3)])
+
+    def png(self, img):
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def test_upload_does_not_decode_and_warns_after_processing(self):
+        original = upload_photo(ContentFile(self.jpeg(self.scene(1600, 1200))), 'a.jpg', 'Оригинал')
+        user = User.objects.create_user('admin', password='pw', is_superuser=True)
+        self.client.force_login(user)
+        copy = self.png(self.scene(1600, 1200).resize((800, 600)))
+
+        # С воркером загрузка только сохраняет исходник: ни одного декодирования
+        with override_settings(PHOTO_QUEUE_EAGER=False), CountDecodes() as decodes:
+            data = self.client.post(
+                '/fotos/upload/',
+                {'image': 'data:image/png;base64,' + base64.b64encode(copy).decode(), 'title': 'Копия'},
+                content_type='application/json', headers={'x-requested-with': 'XMLHttpRequest'},
+            ).json()
+            self.client.post('/fotos/upload/', {
+                'images': SimpleUploadedFile('copy.png', copy, content_type='image/png'), 'title': 'Ещё копия',
+            })
+        self.assertEqual(decodes.count, 0)
+        self.assertEqual(data['similar'], [])
+        first, second = Photo.objects.filter(status=Photo.Status.PROCESSING).order_by('id')
+        self.assertEqual(first.phash, '')
+
+        # Фото с большим id обработано первым, и индекс успел обновиться до
+        # обработки первого
+        run_jobs([claim_job(second.jobs.get().pk)])
+        self.assertEqual(len(similar_index.search(original.phash, settings.SIMILAR_MAX_DISTANCE)), 2)
+        run_jobs([claim_job(first.jobs.get().pk)])
+        status = self.client.get(f'/fotos/status/{first.pk}/').json()
+        self.assertEqual(status['status'], Photo.Status.READY)
+        self.assertEqual({item['id'] for item in status['similar']}, {original.pk, second.pk})
+        # Фото, обработанное позже фото с большим id, тоже попало в индекс
+        status = self.client.get(f'/fotos/status/{second.pk}/').json()
+        self.assertEqual({item['id'] for item in status['similar']}, {original.pk, first.pk})
+
+    @override_settings(SIMILAR_UPLOAD_WARNING=False)
+    def test_upload_warning_is_optional(self):
+        photo = upload_photo(ContentFile(self.jpeg(self.scene(800, 600))), 'a.jpg')
+        self.assertNotEqual(photo.phash, '')  # при обработке хеш считается всегда
+        copy = upload_photo(ContentFile(self.jpeg(self.scene(800, 600), 60)), 'b.jpg')
+        user = User.objects.create_user('admin', password='pw', is_superuser=True)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(f'/fotos/status/{copy.pk}/').json()['similar'], [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RenditionTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def legacy_photo(self, width=2400, height=1600, name='photos/legacy.jpg'):
+        """Фото без размеров, как до make_renditions"""
+        name = default_storage.save(name, make_image(width, height))
+        return Photo.objects.create(title='Старое', image=name, width=width, height=height)
+
+    def test_make_renditions_and_gallery_markup(self):
+        photo = self.legacy_photo()
+        small = self.legacy_photo(200, 150, 'photos/small.jpg')
+        stdout = io.StringIO()
+        call_command('make_renditions', stdout=stdout)
+        self.assertIn('Обработано фото: 2', stdout.getvalue())
+
+        photo.refresh_from_db()
+        sizes = {size: (rendition['width'], rendition['height']) for size, rendition in photo.renditions.items()}
+        self.assertEqual(sizes, {'thumbnail': (300, 200), 'medium': (800, 533), 'large': (1620, 1080)})
+        for rendition in photo.renditions.values():
+            with Image.open(default_storage.open(rendition['name'])) as img:
+                self.assertEqual(img.size, (rendition['width'], rendition['height']))
+        self.assertEqual(photo.thumbnail.name, photo.renditions['thumbnail']['name'])
+        # Меньше превью - все размеры указывают на сам файл
+        small.refresh_from_db()
+        self.assertEqual({rendition['name'] for rendition in small.renditions.values()}, {small.image.name})
+
+        # Без --all уже обработанные фото пропускаются
+        call_command('make_renditions', stdout=stdout)
+        self.assertIn('Обработано фото: 0', stdout.getvalue())
+
+        # Плитка галереи - превью, полный размер - только в srcset и лайтбоксе
+        html = self.client.get('/fotos/').content.decode()
+        self.assertIn(f'src="{photo.thumbnail_url}"', html)
+        self.assertIn(f'data-full="{photo.large_url}"', html)
+        self.assertIn(
+            f'srcset="{photo.thumbnail_url} 300w, {photo.medium_url} 800w, {photo.large_url} 1620w"', html
+        )
+        self.assertNotIn(f'src="{photo.image.url}"', html)
+
+    @override_settings(PHOTO_QUEUE_EAGER=True, PHOTO_WORKER_PROCESSES=1)
+    def test_modern_variants_are_written_and_served(self):
+        photo = upload_photo(ContentFile(make_image(2400, 1600).getvalue()), 'a.jpg')
+        names = [photo.image.name, *(rendition['name'] for rendition in photo.renditions.values())]
+        for name in names:
+            with Image.open(default_storage.open(name)) as jpeg:
+                size = jpeg.size
+            for ext, image_format in (('avif', 'AVIF'), ('webp', 'WEBP')):
+                with Image.open(default_storage.open(variant_path(name, ext))) as variant:
+                    self.assertEqual((variant.format, variant.size), (image_format, size), name)
+                # Тот же кадр меньшим файлом
+                self.assertLess(default_storage.size(variant_path(name, ext)), default_storage.size(name), name)
+
+        # По URL JPEG браузер получает лучший формат из принимаемых
+        path = photo.renditions['medium']['name']
+        factory = RequestFactory()
+        for accept, served in (('image/avif,image/webp,*/*', 'avif'), ('image/webp,*/*', 'webp'), ('*/*', 'jpg')):
+            response = serve_media(factory.get(f'/media/{path}', headers={'accept': accept}), path)
+            self.addCleanup(response.close)
+            self.assertEqual(b''.join(response.streaming_content), self.read(variant_path(path, served)), accept)
+            self.assertEqual(response['Vary'], 'Accept')
+
+        # Только форматы из IMAGE_MODERN_FORMATS
+        with override_settings(IMAGE_MODERN_FORMATS=['webp']):
+            other = upload_photo(ContentFile(make_image(1200, 900).getvalue()), 'b.jpg')
+        self.assertTrue(default_storage.exists(variant_path(other.image.name, 'webp')))
+        self.assertFalse(default_storage.exists(variant_path(other.image.name, 'avif')))
+
+
+class PhotoImgTagTests(TestCase):
+    renditions = {
+        'thumbnail': {'name': 'thumbnails/a_thumbnail.jpg', 'width': 300, 'height': 200},
+        'medium': {'name': 'renditions/a_medium.jpg', 'width': 800, 'height': 533},
+        'large': {'name': 'renditions/a_large.jpg', 'width': 1620, 'height': 1080},
+    }
+
+    def render(self, photo, arguments=''):
+        return Template('{% load fotos %}{% photo_img photo ' + arguments + ' %}').render(Context({'photo': photo}))
+
+    def test_srcset_sizes_and_dimensions(self):
+        photo = Photo(
+            pk=1, title='Море "ночью"', image='photos/a.jpg', renditions=self.renditions,
+            width=2400, height=1600, dominant_color='#102030', placeholder='data:image/jpeg;base64,AAAA',
+        )
+        html = self.render(photo, "'thumbnail' sizes='50vw' loading='lazy' data_full=photo.large_url")
+        self.assertHTMLEqual(html, (
+            '<img alt="Море &quot;ночью&quot;" src="/media/thumbnails/a_thumbnail.jpg"'
+            ' srcset="/media/thumbnails/a_thumbnail.jpg 300w, /media/renditions/a_medium.jpg 800w,'
+            ' /media/renditions/a_large.jpg 1620w"'
+            ' sizes="50vw" width="300" height="200" loading="lazy" data-full="/media/renditions/a_large.jpg"'
+            ' class="lqip" style="background-color: #102030; background-image: url(\'data:image/jpeg;base64,AAAA\')">'
+        ))
+        # Свой класс сохраняется рядом с lqip; размеры - выбранного варианта
+        html = self.render(photo, "'large' class='detail-img'")
+        self.assertIn('class="detail-img lqip"', html)
+        self.assertIn('width="1620" height="1080"', html)
+
+    def test_photo_without_renditions(self):
+        html = self.render(Photo(pk=2, image='photos/b.jpg'), "'thumbnail' sizes='50vw'")
+        # Нечего выбирать: только исходник, без srcset/sizes и неизвестных размеров
+        self.assertHTMLEqual(html, '<img alt="Фото" src="/media/photos/b.jpg">')
+
+    def test_detail_page_uses_large_with_sizes(self):
+        photo = Photo.objects.create(title='Море', image='photos/a.jpg', renditions=self.renditions)
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_superuser=True))
+        html = self.client.get(f'/fotos/{photo.pk}/').content.decode()
+        self.assertIn('src="/media/renditions/a_large.jpg"', html)
+        self.assertIn(f'sizes="{DETAIL_IMAGE_SIZES}"', html)
+        self.assertNotIn('src="/media/photos/a.jpg"', html)
+
+
+class BackfillMetadataTests(TempMediaMixin, TestCase):
+    def photo(self, content, **fields):
+        name = default_storage.save('photos/legacy.jpg', content)
+        return Photo.objects.create(image=name, **fields)
+
+    def test_backfill_fills_metadata_once(self):
+        jpeg = make_image(1200, 800).getvalue()
+        legacy = self.photo(ContentFile(jpeg))
+        png = self.photo(make_image(640, 480, format='PNG'))
+        filled = self.photo(ContentFile(jpeg), width=1, height=1, phash='0' * 16)
+        processing = self.photo(ContentFile(jpeg), status=Photo.Status.PROCESSING)
+        missing = Photo.objects.create(image='photos/missing.jpg')
+        # Загружено новым конвейером: исходный формат известен, сохранён сжатый JPEG
+        ingested = self.photo(ContentFile(jpeg), format='PNG', phash='')
+
+        version = album_version()
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('backfill_metadata', stdout=stdout, stderr=stderr)
+        self.assertIn('Обработано фото: 3', stdout.getvalue())
+        self.assertIn(f'Фото #{missing.pk}:', stderr.getvalue())
+        self.assertGreater(album_version(), version)
+
+        legacy.refresh_from_db()
+        self.assertEqual(
+            (legacy.width, legacy.height, legacy.file_size, legacy.format), (1200, 800, len(jpeg), '')
+        )
+        self.assertRegex(legacy.dominant_color, r'^#[0-9a-f]{6}$')
+        self.assertTrue(legacy.placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertRegex(legacy.phash, r'^[0-9a-f]{16}$')
+        png.refresh_from_db()
+        self.assertEqual((png.width, png.height, png.format), (640, 480, 'PNG'))
+        # Формат - исходный, а не сжатого файла: JPEG исходником не считается
+        ingested.refresh_from_db()
+        self.assertEqual((ingested.width, ingested.format), (1200, 'PNG'))
+        # Заполненные и необработанные не трогаются
+        filled.refresh_from_db()
+        processing.refresh_from_db()
+        self.assertEqual((filled.width, processing.width), (1, None))
+
+        # Размеры берутся из полей: файл больше не открывается
+        with mock.patch('PIL.Image.open', side_effect=AssertionError('файл открыт')):
+            self.assertEqual(legacy.get_image_size(), (1200, 800))
+            self.assertEqual(legacy.get_file_size_mb(), round(len(jpeg) / (1024 * 1024), 2))
+
+
+@override_settings(PHOTO_QUEUE_EAGER=True, PHOTO_WORKER_PROCESSES=1)
+class ContentAddressedStorageTests(TempMediaMixin, TestCase):
+    def test_same_name_is_stored_once(self):
+        name = source_file_name('a' * 64)
+        self.assertEqual(name, f'photos/aa/aa/{"a" * 64}.jpg')
+        self.assertEqual(default_storage.save(name, ContentFile(b'first')), name)
+        self.assertEqual(default_storage.save(name, ContentFile(b'first')), name)
+        self.assertEqual(self.media_names('photos'), [name])
+        # Остальные имена - как в обычном FileSystemStorage
+        self.assertNotEqual(default_storage.save('incoming/x.jpg', ContentFile(b'1')),
+                            default_storage.save('incoming/x.jpg', ContentFile(b'2')))
+
+    def test_duplicate_upload_reuses_processed_files(self):
+        content = make_image(1600, 1200).getvalue()
+        first = upload_photo(ContentFile(content), 'a.jpg', 'Первое')
+        self.assertEqual(first.status, Photo.Status.READY)
+        self.assertEqual(first.image.name, source_file_name(processed_key(first.source_hash)))
+        files = self.media_names('photos', 'renditions')
+
+        with mock.patch('fotos.tasks.prepare_photo') as prepare:
+            second = upload_photo(ContentFile(content), 'b.jpg', 'Второе')
+        prepare.assert_not_called()
+        self.assertEqual(second.status, Photo.Status.READY)
+        self.assertEqual(
+            [(photo.image.name, photo.thumbnail.name, photo.renditions, photo.width) for photo in (first, second)],
+            [(first.image.name, first.thumbnail.name, first.renditions, first.width)] * 2,
+        )
+        # Ни новой копии, ни исходника в incoming/
+        self.assertEqual(self.media_names('photos', 'renditions'), files)
+        self.assertEqual(self.media_names('incoming'), [])
+
+    def test_changed_processing_settings_give_new_names(self):
+        content = make_image(1600, 1200).getvalue()
+        first = upload_photo(ContentFile(content), 'a.jpg', 'Первое')
+        old_files = {name: self.read(name) for name in self.media_names('photos', 'renditions')}
+
+        with override_settings(IMAGE_QUALITY={**settings.IMAGE_QUALITY, 'medium': 40}):
+            # Повтор исходника не берёт файлы, сжатые прежними параметрами
+            second = upload_photo(ContentFile(content), 'b.jpg', 'Второе')
+            self.assertNotEqual(second.renditions['medium']['name'], first.renditions['medium']['name'])
+
+            call_command('make_renditions', all=True, stdout=io.StringIO())
+            first.refresh_from_db()
+            self.assertEqual(first.image.name, second.image.name)
+            self.assertEqual(first.renditions, second.renditions)
+
+        # Старые файлы не перезаписаны, и на них больше никто не ссылается
+        self.assertEqual({name: self.read(name) for name in old_files}, old_files)
+        references = MediaReferences()
+        self.assertFalse(any(map(references.is_referenced, old_files)))
+        self.assertTrue(all(map(references.is_referenced, photo_file_names(first) & set(self.media_names()))))
+
+    def test_shard_media_moves_flat_files(self):
+        content = make_image(1600, 1200).getvalue()
+        first = upload_photo(ContentFile(content), 'a.jpg', 'Первое')
+        second = upload_photo(ContentFile(content), 'b.jpg', 'Второе')
+        legacy = upload_photo(ContentFile(make_image(600, 800).getvalue()), 'c.jpg', 'Старое')
+        # Раскладка до подпапок: файлы в корне папок, у legacy - имена не по хешу
+        flat = {}
+        for photo in (first, legacy):
+            for name in photo_file_names(photo):
+                if default_storage.exists(name):
+                    folder, filename = name.split('/')[0], os.path.basename(name)
+                    if photo is legacy:
+                        filename = filename.replace(processed_key(photo.source_hash), f'{photo.id:06d}')
+                    flat[name] = f'{folder}/{filename}'
+                    os.renames(default_storage.path(name), default_storage.path(flat[name]))
+        for photo in (first, legacy):
+            Photo.objects.filter(source_hash=photo.source_hash).update(
+                image=flat[photo.image.name], thumbnail=flat[photo.thumbnail.name],
+                renditions={size: {**r, 'name': flat[r['name']]} for size, r in photo.renditions.items()},
+            )
+
+        out = io.StringIO()
+        call_command('shard_media', dry_run=True, stdout=out)
+        self.assertIn('Нужно перенести фото: 3', out.getvalue())
+        call_command('shard_media', sleep=0, linger=0, stdout=out)
+        call_command('shard_media', sleep=0, linger=0, stdout=out)
+        self.assertIn('Перенесено фото: 0', out.getvalue())
+
+        for photo in Photo.objects.all():
+            names = photo_file_names(photo)
+            self.assertTrue(all(map(is_sharded, names)))
+            self.assertTrue(os.path.exists(photo.image.path))
+            self.assertTrue(all(os.path.exists(default_storage.path(r['name'])) for r in photo.renditions.values()))
+        self.assertEqual(Photo.objects.get(id=second.id).image.name, first.image.name)
+        self.assertEqual(Photo.objects.get(id=legacy.id).image.name, sharded_name(f'photos/{legacy.id:06d}.jpg'))
+        # Старые имена удалены
+        self.assertTrue(all(map(is_sharded, self.media_names('photos', 'thumbnails', 'renditions'))))
+
+
+@override_settings(PHOTO_QUEUE_EAGER=True, PHOTO_WORKER_PROCESSES=1)
+class MediaCleanupTests(TempMediaMixin, TestCase):
+    def test_bulk_delete_queues_files(self):
+        first = make_image(800, 600).getvalue()
+        sea = upload_photo(ContentFile(first), 'a.jpg', 'Море')
+        copy = upload_photo(ContentFile(first), 'b.jpg', 'Копия')
+        forest = upload_photo(ContentFile(make_image(600, 800).getvalue()), 'c.jpg', 'Лес')
+        forest_files = photo_file_names(forest) & set(self.media_names())
+        self.assertTrue(forest_files)
+
+        user = User.objects.create_user('admin', password='pw', is_superuser=True)
+        self.client.force_login(user)
+        with override_settings(PHOTO_QUEUE_EAGER=False):
+            response = self.client.post(
+                '/fotos/delete/', {'ids': [sea.pk, forest.pk, 999999]}, content_type='application/json'
+            )
+        self.assertEqual(response.json()['deleted'], 2)
+        self.assertEqual(list(Photo.objects.values_list('pk', flat=True)), [copy.pk])
+        # Файлы ещё на месте - их удалит воркер
+        self.assertTrue(forest_files <= set(self.media_names()))
+        self.assertTrue(MediaDeletion.objects.exists())
+
+        delete_queued_files()
+        self.assertFalse(MediaDeletion.objects.exists())
+        self.assertFalse(forest_files & set(self.media_names()))
+        # Файлы общие с копией (тот же исходник) остались
+        self.assertTrue(os.path.exists(copy.image.path))
+
+        response = self.client.post('/fotos/delete/', {'ids': 'все'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_gc_media_removes_orphans_incrementally(self):
+        photo = upload_photo(ContentFile(make_image(800, 600).getvalue()), 'a.jpg', 'Море')
+        kept = self.media_names()
+        old = time.time() - 2 * 60 * 60
+        orphans = [
+            f'photos/{"b" * 64}.jpg', f'renditions/{"b" * 64}_medium.webp',
+            'photos/17.jpg', 'thumbnails/17_thumbnail.jpg',
+        ]
+        for name in orphans + ['photos/fresh.jpg']:
+            default_storage.save(name, ContentFile(b'x'))
+        for name in orphans:
+            os.utime(default_storage.path(name), (old, old))
+        for name in kept:
+            os.utime(default_storage.path(name), (old, old))
+
+        out = io.StringIO()
+        call_command('gc_media', max_files=3, sleep=0, stdout=out)
+        self.assertIn('следующий запуск продолжит', out.getvalue())
+        call_command('gc_media', sleep=0, stdout=out)
+        call_command('gc_media', sleep=0, stdout=out)
+
+        self.assertEqual(self.media_names(), sorted([*kept, 'photos/fresh.jpg']))
+        self.assertTrue(os.path.exists(photo.image.path))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, '.gc_media.cursor')))
+
+
+class ExportTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.media_root, 'photos'))
+        self.photos = []
+        for title, description in (('Море', 'Закат, "вечер"\nвторая строка'), ('Горы/снег', ''), ('', 'без названия')):
+            photo = Photo.objects.create(title=title, description=description, status=Photo.Status.READY)
+            photo.image.name = f'photos/{photo.pk}.jpg'
+            photo.save(update_fields=['image'])
+            with open(photo.image.path, 'wb') as f:
+                f.write(make_image(64, 48).getvalue())
+            self.photos.append(photo)
+        # Файл удалён с диска - в архиве его нет, в manifest пустое имя
+        self.missing = Photo.objects.create(title='Пропавшее', status=Photo.Status.READY, image='photos/missing.jpg')
+
+    def read_archive(self, content):
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertIsNone(archive.testzip())
+        self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+        manifest = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode('utf-8-sig'))))
+        return archive, manifest
+
+    def test_export_streams_zip_with_manifest(self):
+        response = self.client.get('/fotos/export/')
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        archive, manifest = self.read_archive(b''.join(response.streaming_content))
+
+        sea, mountains, untitled = self.photos
+        names = [f'{sea.pk:06d} Море.jpg', f'{mountains.pk:06d} Горы снег.jpg', f'{untitled.pk:06d}.jpg']
+        self.assertEqual(archive.namelist(), ['manifest.csv', *names])
+        with open(sea.image.path, 'rb') as f:
+            self.assertEqual(archive.read(names[0]), f.read())
+        self.assertEqual(
+            [(row['file'], row['title'], row['description']) for row in manifest],
+            [(names[0], 'Море', 'Закат, "вечер"\nвторая строка'), (names[1], 'Горы/снег', ''),
+             (names[2], '', 'без названия'), ('', 'Пропавшее', '')],
+        )
+
+    def test_export_selection(self):
+        sea, mountains, untitled = self.photos
+        response = self.client.get(f'/fotos/export/?from={mountains.pk}')
+        archive, manifest = self.read_archive(b''.join(response.streaming_content))
+        self.assertEqual([int(row['id']) for row in manifest], [mountains.pk, untitled.pk, self.missing.pk])
+
+        response = self.client.get(f'/fotos/export/?ids={sea.pk},{untitled.pk},x')
+        archive, manifest = self.read_archive(b''.join(response.streaming_content))
+        self.assertEqual([int(row['id']) for row in manifest], [sea.pk, untitled.pk])
+        self.assertEqual(len(archive.namelist()), 3)
+
+    async def test_export_under_asgi(self):
+        response = await self.async_client.get(f'/fotos/export/?to={self.photos[0].pk}')
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        archive, manifest = self.read_archive(content)
+        self.assertEqual(archive.namelist(), ['manifest.csv', f'{self.photos[0].pk:06d} Море.jpg'])
+
+
+class ImportPhotosTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def add_file(self, relpath, content):
+        path = os.path.join(self.directory, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def import_photos(self):
+        call_command('import_photos', self.directory, processes=1, batch_size=2, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_import_is_deduplicated_and_resumable(self):
+        first, second = make_image(400, 300).getvalue(), make_image(300, 400, format='PNG').getvalue()
+        self.add_file('2019/море.jpg', first)
+        self.add_file('2019/море_копия.jpg', first)
+        self.add_file('2020/лес.png', second)
+        self.add_file('2020/битый.jpg', b'not an image')
+
+        self.import_photos()
+        photos = Photo.objects.order_by('title')
+        self.assertEqual([(photo.title, photo.status) for photo in photos], [
+            ('лес', Photo.Status.READY), ('море', Photo.Status.READY),
+        ])
+        self.assertTrue(all(photo.source_hash and photo.renditions for photo in photos))
+
+        # Новый файл в архиве: импортируется только он, уже обработанные пропускаются
+        self.add_file('2021/горы.jpg', make_image(500, 500).getvalue())
+        with mock.patch('fotos.management.commands.import_photos.prepare_photo', wraps=prepare_photo) as prepare:
+            self.import_photos()
+        # Битый файл не попал в файл прогресса и пробуется снова
+        called = sorted(os.path.basename(call.args[0]) for call in prepare.call_args_list)
+        self.assertEqual(called, ['битый.jpg', 'горы.jpg'])
+        self.assertEqual(Photo.objects.count(), 3)
+
+    def test_copy_of_failed_file_is_not_a_duplicate(self):
+        content = make_image(400, 300).getvalue()
+        self.add_file('a/море.jpg', content)
+        self.add_file('b/море_копия.jpg', content)
+
+        with mock.patch('fotos.management.commands.import_photos.save_prepared', side_effect=OSError('disk full')):
+            self.import_photos()
+        self.assertFalse(Photo.objects.exists())
+        # Первый файл не записан - копия не отмечена в файле прогресса как его повтор
+        checkpoint = os.path.join(self.directory, '.import_photos.checkpoint')
+        self.assertFalse(os.path.exists(checkpoint))
+        self.import_photos()
+        with open(checkpoint, encoding='utf-8') as f:
+            self.assertEqual(sorted(f.read().split()), [os.path.join('a', 'море.jpg'), os.path.join('b', 'море_копия.jpg')])
+        self.assertEqual(list(Photo.objects.values_list('title', 'status')), [('море', Photo.Status.READY)])
+
+
+class StaticFilesTests(TestCase):
+    def test_collected_files_are_hashed_and_precompressed(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        storages = {
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+        }
+        with override_settings(STATIC_ROOT=static_root, STORAGES=storages, DEBUG=False, WHITENOISE_AUTOREFRESH=False):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            url = static('fotos/css/style.css')
+            self.assertRegex(url, r'^/static/fotos/css/style\.[0-9a-f]{12}\.css$')
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')['Content-Encoding'], 'gzip')
+            # Ссылки на фоны в CSS тоже с хешем
+            css = b''.join(self.client.get(url).streaming_content).decode()
+            self.assertRegex(css, r'/static/images/bg-mobile\.[0-9a-f]{12}\.jpg')
+            # Файла нет в манифесте - ошибка, а не тихая ссылка без хеша
+            with self.assertRaises(ValueError):
+                static('fotos/css/missing.css')
+
+    def test_asgi_serves_static_before_django(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        storages = {
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+        }
+        with override_settings(STATIC_ROOT=static_root, STORAGES=storages, DEBUG=False, WHITENOISE_AUTOREFRESH=False):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            url = static('fotos/css/style.css')
+            passed = []
+
+            async def django_application(scope, receive, send):
+                passed.append(scope['path'])
+
+            application = ASGIStaticFiles(django_application)
+
+            def get(path, headers=()):
+                messages = []
+
+                async def send(message):
+                    messages.append(message)
+
+                scope = {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'headers': list(headers)}
+                async_to_sync(application)(scope, None, send)
+                return messages
+
+            messages = get(url, [(b'accept-encoding', b'gzip, br')])
+            self.assertEqual(passed, [])
+            self.assertEqual(messages[0]['status'], 200)
+            headers = dict(messages[0]['headers'])
+            self.assertEqual(headers[b'content-encoding'], b'br')
+            self.assertIn(b'immutable', headers[b'cache-control'])
+            body = b''.join(message.get('body', b'') for message in messages[1:])
+            with open(os.path.join(static_root, url.removeprefix('/static/') + '.br'), 'rb') as f:
+                self.assertEqual(body, f.read())
+            self.assertFalse(messages[-1].get('more_body'))
+
+            messages = get(url, [(b'range', b'bytes=0-9')])
+            self.assertEqual(messages[0]['status'], 206)
+            self.assertEqual(len(b''.join(message.get('body', b'') for message in messages[1:])), 10)
+
+            # Не статика - дальше в Django
+            get('/fotos/')
+            self.assertEqual(passed, ['/fotos/'])
@@ -0,0 +1,140 @@
+"""
+Докачиваемая загрузка по частям: init -> PUT частей -> finish.
+
+Части пишутся сразу на диск в FILE_UPLOAD_TEMP_DIR, поэтому расход памяти
+на одну загрузку не зависит от размера файла.
+"""
+import fcntl
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Незавершённые загрузки старше этого времени удаляются
+STALE_UPLOAD_AGE = 24 * 60 * 60  # секунд
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkedUploadFile(File):
+    """Собранный файл; storage переносит его на место, а не копирует в память"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def upload_dir():
+    path = os.path.join(settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), 'chunked')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _paths(upload_id):
+    if not UPLOAD_ID_RE.match(upload_id):
+        raise UploadError('Неизвестная загрузка')
+    base = os.path.join(upload_dir(), upload_id)
+    return base + '.part', base + '.json'
+
+
+def start_upload(filename, size, title='', description=''):
+    """Создаёт новую загрузку и возвращает её id"""
+    if size <= 0:
+        raise UploadError('Пустой файл')
+    if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        max_mb = settings.CHUNKED_UPLOAD_MAX_SIZE // (1024 * 1024)
+        raise UploadError(f'Файл {filename} слишком большой (макс. {max_mb}MB)')
+
+    cleanup_stale_uploads()
+
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _paths(upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w', encoding='utf-8') as meta_file:
+        json.dump({
+            'filename': os.path.basename(filename),
+            'size': size,
+            'title': title,
+            'description': description,
+        }, meta_file)
+    return upload_id
+
+
+def get_upload(upload_id):
+    """Возвращает (метаданные, уже принятое количество байт)"""
+    part_path, meta_path = _paths(upload_id)
+    try:
+        with open(meta_path, encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        return meta, os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise UploadError('Неизвестная загрузка')
+
+
+def append_chunk(upload_id, offset, stream, length):
+    """Дописывает часть из потока запроса, читая его небольшими блоками"""
+    meta, _ = get_upload(upload_id)
+    if offset + length > meta['size']:
+        raise UploadError('Часть выходит за пределы файла')
+
+    part_path, _ = _paths(upload_id)
+    try:
+        part_file = open(part_path, 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Неизвестная загрузка')
+    with part_file:
+        # Проверка смещения и запись - под блокировкой файла: повтор части,
+        # пришедший, пока предыдущая ещё пишется, получает 409 и не
+        # дописывает те же байты второй раз
+        try:
+            fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Часть с этим смещением уже принимается')
+        received = part_file.seek(0, os.SEEK_END)
+        if offset != received:
+            raise UploadError(f'Ожидалось смещение {received}')
+        remaining = length
+        while remaining > 0:
+            block = stream.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            part_file.write(block)
+            remaining -= len(block)
+        return part_file.tell()
+
+
+def finish_upload(upload_id):
+    """Проверяет, что файл принят целиком; возвращает (метаданные, файл)"""
+    meta, received = get_upload(upload_id)
+    if received != meta['size']:
+        raise UploadError(f'Получено {received} из {meta["size"]} байт')
+    part_path, _ = _paths(upload_id)
+    return meta, ChunkedUploadFile(open(part_path, 'rb'), name=meta['filename'])
+
+
+def discard_upload(upload_id):
+    for path in _paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def cleanup_stale_uploads():
+    """Удаляет брошенные загрузки"""
+    deadline = time.time() - STALE_UPLOAD_AGE
+    with os.scandir(upload_dir()) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
@@ -4,11 +4,22 @@ from . import views
 urlpatterns = [
     path('', views.greeting, name='greeting'),  # Главная страница
     path('fotos/', views.gallery, name='gallery'),
+    path('fotos/feed/', views.gallery_feed, name='gallery_feed'),  # JSON для бесконечной прокрутки
     path('fotos/upload/', views.upload_photos, name='upload_photos'),  # Только для суперюзера
+    path('fotos/status/<int:pk>/', views.photo_status, name='photo_status'),  # Статус обработки
+    path('fotos/upload/chunked/', views.chunked_upload_start, name='chunked_upload_start'),
+    path('fotos/upload/chunked/<str:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    path('fotos/upload/chunked/<str:upload_id>/finish/', views.chunked_upload_finish, name='chunked_upload_finish'),
     path('fotos/delete/<int:pk>/', views.delete_photo, name='delete_photo'),  # Удаление
+    path('fotos/delete/', views.delete_photos, name='delete_photos'),  # Удаление нескольких фото
     path('fotos/edit/<int:pk>/', views.edit_photo, name='edit_photo'),  # Редактирование
     path('fotos/conclusion/', views.conclusion, name='conclusion'),
+    path('fotos/search/', views.search, name='search'),  # Полнотекстовый поиск
+    path('fotos/search/api/', views.search_api, name='search_api'),
+    path('fotos/export/', views.export_album, name='export_album'),  # ZIP всего альбома или выборки
     path('fotos/<int:pk>/', views.photo_detail, name='photo_detail'),
+    path('fotos/<int:pk>/similar/', views.similar_photos, name='similar_photos'),  # По перцептивному хешу
+    path('metrics', views.metrics, name='metrics'),  # Prometheus
     
     # Авторизация
     path('login/', views.user_login, name='login'),
@@ -1,46 +1,260 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import authenticate, login, logout
-from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.shortcuts import get_object_or_404
-from PIL import Image, ImageOps
-import io
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from functools import partial
+from asgiref.sync import sync_to_async
 import base64
 import json
-import os 
-from .models import Photo
+from .aio import offload
+from .cache import album_version, cache_anonymous_page
+from .db import retry_if_locked
+from .export import aexport_zip, export_zip
+from .metrics import render_metrics, stage_timer
+from .models import Photo, validate_image_dimensions
+from .search import search_photos
+from .similar import find_similar
+from .tasks import add_processing_photos, new_processing_photo
+from . import uploads
 
+@cache_anonymous_page()
 def greeting(request):
     """Главная страница с поздравлением"""
     return render(request, 'greeting.html')
 
-def gallery(request):
-    photos_list = Photo.objects.all()
-    
-    # ВСЕГДА показываем по 3 фото на странице (убрали адаптивность)
-    per_page = 6
-    
-    paginator = Paginator(photos_list, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return render(request, 'gallery.html', {'page_obj': page_obj, 'per_page': per_page})
+# Поля, которые нужны сетке галереи (описание не загружаем)
+GALLERY_FIELDS = ('id', 'title', 'image', 'renditions', 'width', 'height', 'dominant_color', 'placeholder')
+GALLERY_PER_PAGE = 6
+GALLERY_FEED_MAX = 60
 
-def photo_detail(request, pk: int):
-    photo = get_object_or_404(Photo, pk=pk)
-    return render(request, 'detail.html', {'photo': photo})
+# Атрибут sizes: ширина картинки на экране по сетке из style.css
+# (2 колонки на телефоне, 3 на планшете, 6 в карточке 980px на десктопе)
+GALLERY_TILE_SIZES = '(max-width: 767px) 46vw, (max-width: 1023px) 30vw, 150px'
+DETAIL_IMAGE_SIZES = '(max-width: 1064px) 92vw, 924px'
+
+def _cursor(value):
+    """id фото из параметра запроса (None, если параметра нет или он некорректен)"""
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def _keyset_query(photos, after, before, per_page):
+    # На одну запись больше страницы - чтобы узнать, есть ли продолжение
+    if before is not None:
+        return photos.filter(id__lt=before).order_by('-id')[:per_page + 1]
+    if after is not None:
+        photos = photos.filter(id__gt=after)
+    return photos.order_by('id')[:per_page + 1]
+
+def _keyset_result(page, after, before, per_page):
+    if before is not None:
+        return page[:per_page][::-1], len(page) > per_page, True
+    return page[:per_page], after is not None, len(page) > per_page
+
+def keyset_page(photos, after=None, before=None, per_page=GALLERY_PER_PAGE):
+    """
+    Keyset-пагинация по id (совпадает с Meta.ordering): без COUNT(*) и OFFSET,
+    поэтому скорость не зависит ни от глубины страницы, ни от размера альбома.
+    Возвращает (фото, есть_предыдущая, есть_следующая)
+    """
+    page = list(_keyset_query(photos, after, before, per_page))
+    return _keyset_result(page, after, before, per_page)
+
+async def akeyset_page(photos, after=None, before=None, per_page=GALLERY_PER_PAGE):
+    """keyset_page для асинхронных view"""
+    page = [photo async for photo in _keyset_query(photos, after, before, per_page)]
+    return _keyset_result(page, after, before, per_page)
+
+def gallery_page(after=None, before=None, per_page=GALLERY_PER_PAGE):
+    """Страница плиток галереи"""
+    return keyset_page(Photo.objects.ready().only(*GALLERY_FIELDS), after, before, per_page)
+
+async def agallery_page(after=None, before=None, per_page=GALLERY_PER_PAGE):
+    return await akeyset_page(Photo.objects.ready().only(*GALLERY_FIELDS), after, before, per_page)
+
+# Галерея, лента и страница фото асинхронные: под ASGI медленные клиенты
+# не занимают потоки воркера. Шаблоны этих страниц не обращаются к БД
+# (нет user и messages), поэтому рендерятся прямо в цикле событий
+
+@cache_anonymous_page(query_params=('after', 'before'))
+async def gallery(request):
+    after = _cursor(request.GET.get('after'))
+    before = _cursor(request.GET.get('before'))
+    photos, has_previous, has_next = await agallery_page(after, before)
+    return render(request, 'gallery.html', {
+        'photos': photos,
+        'has_previous': has_previous and bool(photos),
+        'has_next': has_next and bool(photos),
+        'first_id': photos[0].id if photos else None,
+        'last_id': photos[-1].id if photos else None,
+        'tile_sizes': GALLERY_TILE_SIZES,
+    })
+
+@cache_anonymous_page(query_params=('after', 'limit'))
+async def gallery_feed(request):
+    """Следующая порция плиток галереи в JSON (для бесконечной прокрутки)"""
+    try:
+        limit = min(int(request.GET.get('limit', GALLERY_PER_PAGE)), GALLERY_FEED_MAX)
+    except ValueError:
+        limit = GALLERY_PER_PAGE
+    photos, has_previous, has_next = await agallery_page(_cursor(request.GET.get('after')), per_page=max(limit, 1))
+    return JsonResponse({
+        'photos': [{
+            'id': photo.id,
+            'title': photo.title,
+            'thumbnail_url': photo.thumbnail_url,
+            'thumbnail_size': photo.get_rendition_size('thumbnail'),
+            'srcset': photo.srcset,
+            'sizes': GALLERY_TILE_SIZES,
+            'large_url': photo.large_url,
+            'detail_url': reverse('photo_detail', args=[photo.id]),
+            'dominant_color': photo.dominant_color,
+            'placeholder': photo.placeholder,
+        } for photo in photos],
+        'next': photos[-1].id if has_next else None,
+    })
+
+@cache_anonymous_page()
+async def photo_detail(request, pk: int):
+    photo = await aget_object_or_404(Photo.objects.ready(), pk=pk)
+    return render(request, 'detail.html', {'photo': photo, 'image_sizes': DETAIL_IMAGE_SIZES})
+
+SIMILAR_PER_PAGE = 24
+
+@cache_anonymous_page()
+async def similar_photos(request, pk: int):
+    """Похожие фото: серии снимков, пересохранённые копии (по dHash)"""
+    photo = await aget_object_or_404(Photo.objects.ready().only('id', 'title', 'phash'), pk=pk)
+    photos = await sync_to_async(find_similar)(
+        photo.phash, exclude_id=photo.id, limit=SIMILAR_PER_PAGE, fields=GALLERY_FIELDS
+    )
+    return render(request, 'similar.html', {
+        'photo': photo,
+        'photos': photos,
+        'tile_sizes': GALLERY_TILE_SIZES,
+    })
+
+SEARCH_PER_PAGE = 24
+
+def _page_number(value):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+async def _search(request):
+    query = request.GET.get('q', '').strip()
+    page = _page_number(request.GET.get('page'))
+    # Запрос к FTS5 через raw() - у него нет асинхронного варианта
+    photos, has_next = await sync_to_async(search_photos)(query, page, SEARCH_PER_PAGE, GALLERY_FIELDS)
+    return query, page, photos, has_next
+
+async def search(request):
+    """Поиск по названиям и описаниям (FTS5), лучшие совпадения первыми"""
+    query, page, photos, has_next = await _search(request)
+    return render(request, 'search.html', {
+        'query': query,
+        'photos': photos,
+        'page': page,
+        'has_previous': page > 1,
+        'has_next': has_next,
+        'tile_sizes': GALLERY_TILE_SIZES,
+    })
+
+async def search_api(request):
+    """Поиск в JSON: ?q=...&page=N"""
+    query, page, photos, has_next = await _search(request)
+    return JsonResponse({
+        'query': query,
+        'page': page,
+        'photos': [{
+            'id': photo.id,
+            'title': photo.title,
+            'thumbnail_url': photo.thumbnail_url,
+            'srcset': photo.srcset,
+            'sizes': GALLERY_TILE_SIZES,
+            'detail_url': reverse('photo_detail', args=[photo.id]),
+            'dominant_color': photo.dominant_color,
+            'placeholder': photo.placeholder,
+        } for photo in photos],
+        'next_page': page + 1 if has_next else None,
+    })
+
+EXPORT_MAX_IDS = 1000
+
+def _id_list(value):
+    """id фото из параметра вида "1,5,7" (некорректные пропускаются)"""
+    ids = (_cursor(part.strip()) for part in value.split(',')[:EXPORT_MAX_IDS])
+    return [pk for pk in ids if pk is not None]
+
+def export_photos(params):
+    """Готовые фото для экспорта: все, диапазон ?from=&to= (id включительно) или ?ids=1,2,3"""
+    photos = Photo.objects.ready()
+    if 'ids' in params:
+        photos = photos.filter(id__in=_id_list(params['ids']))
+    first, last = _cursor(params.get('from')), _cursor(params.get('to'))
+    if first is not None:
+        photos = photos.filter(id__gte=first)
+    if last is not None:
+        photos = photos.filter(id__lte=last)
+    return photos
+
+async def export_album(request):
+    """ZIP с фото и manifest.csv, собирается на лету во время скачивания"""
+    photos = export_photos(request.GET)
+    created_at = timezone.now()
+    # Под ASGI нужен асинхронный итератор, под WSGI - обычный,
+    # иначе Django сначала соберёт весь архив в список
+    if isinstance(request, ASGIRequest):
+        chunks = aexport_zip(photos, created_at)
+    else:
+        chunks = export_zip(photos, created_at)
+    filename = f"album-{created_at:%Y%m%d}.zip"
+    return StreamingHttpResponse(chunks, content_type='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        # Не буферизовать ответ целиком в nginx-прокси
+        'X-Accel-Buffering': 'no',
+    })
+
+CONCLUSION_PER_PAGE = 50
+
+def conclusion_page(after, before, can_upload):
+    """Страница содержания: только id и название (описание нужно лишь для редактирования)"""
+    fields = ('id', 'title', 'description') if can_upload else ('id', 'title')
+    photos, has_previous, has_next = keyset_page(
+        Photo.objects.ready().only(*fields), after, before, CONCLUSION_PER_PAGE
+    )
+    return {
+        'photos': photos,
+        'has_previous': has_previous and bool(photos),
+        'has_next': has_next and bool(photos),
+        'first_id': photos[0].id if photos else None,
+        'last_id': photos[-1].id if photos else None,
+    }
 
 def conclusion(request):
     """Страница содержания с кнопкой загрузки (только для суперюзера)"""
-    photos = Photo.objects.all()
     can_upload = request.user.is_authenticated and request.user.is_superuser
+    after = _cursor(request.GET.get('after'))
+    before = _cursor(request.GET.get('before'))
     return render(request, 'conclusion.html', {
-        'photos': photos, 
+        # Вызывается шаблоном только если фрагмента нет в кеше
+        'page': partial(conclusion_page, after, before, can_upload),
+        'cursor': f'{after}:{before}',
+        'album_version': album_version(),
+        'cache_timeout': settings.ALBUM_CACHE_TIMEOUT,
         'can_upload': can_upload
     })
 
@@ -49,92 +263,54 @@ def is_superuser(user):
     return user.is_authenticated and user.is_superuser
 
 @user_passes_test(is_superuser)
-def upload_photos(request):
+async def upload_photos(request):
     """Страница загрузки фотографий (только для суперюзера)"""
     if request.method == 'POST':
         # Обработка AJAX загрузки
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            return handle_ajax_upload(request)
+            return await handle_ajax_upload(request)
         
         # Обычная обработка формы
-        return handle_regular_upload(request)
+        return await handle_regular_upload(request)
     
-    return render(request, 'upload.html')
+    # Шаблон выводит сообщения из сессии - рендерим вне цикла событий
+    return await sync_to_async(render)(request, 'upload.html')
+
+SIMILAR_WARNING_LIMIT = 5
 
-def compress_image(image_file, max_width=1920, max_height=1080, quality=85):
+def upload_similar(photo):
     """
-    Сжимает изображение до указанных размеров с оптимизацией качества
-    Оптимизировано для Amvera (ограниченные ресурсы)
+    Уже загруженные фото, похожие на новое. phash считает обработка: пока фото
+    в очереди, список пуст - предупреждение тогда отдаёт photo_status
     """
-    try:
-        # Открываем изображение
-        img = Image.open(image_file)
-        
-        # Конвертируем в RGB если нужно (для JPEG)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # Создаём белый фон для прозрачных изображений
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Поворачиваем если нужно (EXIF данные)
-        img = ImageOps.exif_transpose(img)
-        
-        # Получаем текущие размеры
-        width, height = img.size
-        
-        # Вычисляем новые размеры (сохраняем пропорции)
-        if width > max_width or height > max_height:
-            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-        
-        # Сохраняем в буфер с оптимизацией
-        img_io = io.BytesIO()
-        img.save(
-            img_io, 
-            format='JPEG', 
-            quality=quality, 
-            optimize=True,
-            progressive=True
-        )
-        img_io.seek(0)
-        
-        return img_io, img.size
-        
-    except Exception as e:
-        raise ValueError(f"Ошибка обработки изображения: {str(e)}")
+    if not settings.SIMILAR_UPLOAD_WARNING:
+        return []
+    return find_similar(
+        photo.phash, exclude_id=photo.id, statuses=(Photo.Status.READY, Photo.Status.PROCESSING),
+        limit=SIMILAR_WARNING_LIMIT, fields=('id', 'title', 'status'),
+    )
 
-def create_thumbnail(image_io, size=(300, 300), quality=80):
-    """Создаёт превью изображение"""
-    try:
-        img = Image.open(image_io)
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        
-        thumb_io = io.BytesIO()
-        img.save(
-            thumb_io, 
-            format='JPEG', 
-            quality=quality, 
-            optimize=True
-        )
-        thumb_io.seek(0)
-        
-        return thumb_io
-        
-    except Exception as e:
-        raise ValueError(f"Ошибка создания превью: {str(e)}")
+def similar_json(photos):
+    return [{
+        'id': photo.id,
+        'title': photo.title,
+        'status': photo.status,
+        'distance': photo.distance,
+        'detail_url': reverse('photo_detail', args=[photo.id]),
+    } for photo in photos]
+
+# Загрузки асинхронные: разбор запроса, base64, Pillow и запись файлов
+# выполняются в ограниченном пуле потоков (offload), запись в БД - через
+# sync_to_async, поэтому медленный клиент или сжатие не занимают воркер
 
 @csrf_exempt
 @require_http_methods(["POST"])
 @user_passes_test(is_superuser)
-def handle_ajax_upload(request):
-    """AJAX обработка загрузки файлов (только для суперюзера) с сжатием"""
+async def handle_ajax_upload(request):
+    """AJAX загрузка файлов (только для суперюзера); сжатие выполняется в фоне"""
     try:
         # Получаем данные из запроса
-        data = json.loads(request.body)
+        data = await offload(lambda: json.loads(request.body))
         image_data = data.get('image')
         title = data.get('title', '')
         description = data.get('description', '')
@@ -146,46 +322,31 @@ def handle_ajax_upload(request):
         if ',' in image_data:
             header, image_data = image_data.split(',', 1)
         
-        # Создаём временный файл для обработки
-        import uuid
-        temp_filename = f"temp_{uuid.uuid4().hex[:8]}.jpg"
-        temp_image = ContentFile(base64.b64decode(image_data))
-        temp_image.name = temp_filename
-        
-        # Сжимаем изображение
-        compressed_io, final_size = compress_image(temp_image)
-        
-        # Создаём финальный файл
-        final_filename = f"photo_{uuid.uuid4().hex[:8]}.jpg"
-        final_image = ContentFile(compressed_io.read())
-        final_image.name = final_filename
-        
-        # Сохраняем в базу
-        photo = Photo.objects.create(
-            title=title,
-            description=description,
-            image=final_image
-        )
-        
-        # Создаём превью
-        compressed_io.seek(0)
-        thumbnail_io = create_thumbnail(compressed_io)
-        thumbnail_name = f"thumb_{photo.id}.jpg"
-        thumbnail_content = ContentFile(thumbnail_io.read())
-        thumbnail_content.name = thumbnail_name
+        temp_image = ContentFile(await offload(base64.b64decode, image_data))
+        with stage_timer('validate'):
+            await offload(validate_image_dimensions, temp_image)
+        temp_image.seek(0)
         
-        # Можно сохранить превью отдельно если нужно
-        # photo.thumbnail = thumbnail_content
-        # photo.save()
+        # Сохраняем исходник и ставим в очередь на сжатие
+        with stage_timer('store'):
+            photo = await offload(new_processing_photo, temp_image, 'upload.jpg', title, description)
+        with stage_timer('enqueue'):
+            photo, = await sync_to_async(add_processing_photos)([photo])
+        similar = await sync_to_async(upload_similar)(photo)
         
         return JsonResponse({
             'success': True, 
-            'message': f'Фото успешно загружено и сжато до {final_size[0]}x{final_size[1]}!',
+            'message': 'Фото загружено и поставлено в обработку',
             'photo_id': photo.id,
             'photo_url': photo.image.url,
-            'size': f"{final_size[0]}x{final_size[1]}"
+            'status': photo.status,
+            'status_url': reverse('photo_status', args=[photo.id]),
+            # Предупреждение: похожее фото уже есть (серия, пересохранённая копия)
+            'similar': similar_json(similar),
         })
         
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]})
     except Exception as e:
         return JsonResponse({
             'success': False, 
@@ -193,15 +354,15 @@ def handle_ajax_upload(request):
         })
 
 @user_passes_test(is_superuser)
-def handle_regular_upload(request):
-    """Обработка обычной загрузки через форму (только для суперюзера) с сжатием"""
+async def handle_regular_upload(request):
+    """Обработка обычной загрузки через форму (только для суперюзера); сжатие выполняется в фоне"""
     try:
-        images = request.FILES.getlist('images')
+        # Разбор multipart (большие файлы пишутся на диск)
+        images = await offload(lambda: request.FILES.getlist('images'))
         title = request.POST.get('title', '')
         description = request.POST.get('description', '')
         
-        uploaded_count = 0
-        total_saved_mb = 0
+        pending = []
         
         for image in images:
             # Валидация файла
@@ -214,36 +375,34 @@ def handle_regular_upload(request):
                 continue
             
             try:
-                # Сжимаем изображение
-                compressed_io, final_size = compress_image(image)
+                # Проверяем только заголовок файла, без полного декодирования
+                with stage_timer('validate'):
+                    await offload(validate_image_dimensions, image)
+                image.seek(0)
                 
-                # Создаём финальный файл
-                import uuid
-                final_filename = f"photo_{uuid.uuid4().hex[:8]}.jpg"
-                final_image = ContentFile(compressed_io.read())
-                final_image.name = final_filename
-                
-                # Сохраняем в базу
-                photo = Photo.objects.create(
-                    title=title or image.name,
-                    description=description,
-                    image=final_image
-                )
-                
-                uploaded_count += 1
-                
-                # Подсчитываем сэкономленное место
-                original_mb = image.size / (1024 * 1024)
-                final_mb = len(compressed_io.getvalue()) / (1024 * 1024)
-                total_saved_mb += (original_mb - final_mb)
+                # Сохраняем исходник; сжатие выполнит воркер
+                with stage_timer('store'):
+                    pending.append(await offload(
+                        new_processing_photo, image, image.name, title or image.name, description
+                    ))
                 
+            except ValidationError as e:
+                messages.error(request, f'Файл {image.name}: {e.messages[0]}')
+                continue
             except Exception as e:
                 messages.error(request, f'Ошибка обработки файла {image.name}: {str(e)}')
                 continue
         
-        if uploaded_count > 0:
-            saved_mb_str = f" (сэкономлено {total_saved_mb:.1f} МБ)" if total_saved_mb > 0 else ""
-            messages.success(request, f'Успешно загружено и сжато {uploaded_count} фото{saved_mb_str}!')
+        if pending:
+            # Все фото и задания записываем одной транзакцией
+            with stage_timer('enqueue'):
+                pending = await sync_to_async(add_processing_photos)(pending)
+            messages.success(request, f'Загружено {len(pending)} фото, они появятся в галерее после обработки')
+            for photo in pending:
+                similar = await sync_to_async(upload_similar)(photo)
+                if similar:
+                    titles = ', '.join(f'«{other.title or f"Фото #{other.id}"}»' for other in similar)
+                    messages.warning(request, f'{photo.title or "Фото"} похоже на уже загруженные: {titles}')
         else:
             messages.error(request, 'Не удалось загрузить фотографии')
             
@@ -251,7 +410,110 @@ def handle_regular_upload(request):
         
     except Exception as e:
         messages.error(request, f'Ошибка при загрузке: {str(e)}')
-        return render(request, 'upload.html')
+        return await sync_to_async(render)(request, 'upload.html')
+
+# =============================================================================
+# ЗАГРУЗКА ПО ЧАСТЯМ (бинарные части вместо base64 в JSON, с докачкой)
+# =============================================================================
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@user_passes_test(is_superuser)
+def chunked_upload_start(request):
+    """Начало загрузки по частям: принимает имя и размер файла"""
+    try:
+        data = json.loads(request.body)
+        upload_id = uploads.start_upload(
+            data.get('filename', 'upload.jpg'),
+            int(data.get('size', 0)),
+            data.get('title', ''),
+            data.get('description', '')
+        )
+        return JsonResponse({
+            'success': True,
+            'upload_id': upload_id,
+            'offset': 0,
+            'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+            'upload_url': reverse('chunked_upload', args=[upload_id])
+        })
+    except (ValueError, uploads.UploadError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+@csrf_exempt
+@require_http_methods(["GET", "PUT"])
+@user_passes_test(is_superuser)
+async def chunked_upload(request, upload_id):
+    """GET - сколько байт уже принято (для докачки), PUT - очередная часть"""
+    try:
+        if request.method == 'GET':
+            meta, offset = await offload(uploads.get_upload, upload_id)
+        else:
+            offset = await offload(
+                uploads.append_chunk,
+                upload_id,
+                int(request.headers.get('Upload-Offset', -1)),
+                request,
+                int(request.META.get('CONTENT_LENGTH') or 0)
+            )
+        return JsonResponse({'success': True, 'offset': offset})
+    except (ValueError, uploads.UploadError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@user_passes_test(is_superuser)
+async def chunked_upload_finish(request, upload_id):
+    """Завершение загрузки: файл передаётся в очередь обработки"""
+    try:
+        meta, image = await offload(uploads.finish_upload, upload_id)
+        with image:
+            with stage_timer('validate'):
+                await offload(validate_image_dimensions, image)
+            with stage_timer('store'):
+                photo = await offload(
+                    new_processing_photo,
+                    image, meta['filename'], meta['title'] or meta['filename'], meta['description']
+                )
+        with stage_timer('enqueue'):
+            photo, = await sync_to_async(add_processing_photos)([photo])
+        await offload(uploads.discard_upload, upload_id)
+        similar = await sync_to_async(upload_similar)(photo)
+        return JsonResponse({
+            'success': True,
+            'message': 'Фото загружено и поставлено в обработку',
+            'photo_id': photo.id,
+            'status': photo.status,
+            'status_url': reverse('photo_status', args=[photo.id]),
+            'similar': similar_json(similar),
+        })
+    except uploads.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+    except ValidationError as e:
+        await offload(uploads.discard_upload, upload_id)
+        return JsonResponse({'success': False, 'error': e.messages[0]}, status=400)
+    except Exception as e:
+        # Ошибка диска, Pillow и т.п.: докачка не поможет - загрузку удаляем
+        await offload(uploads.discard_upload, upload_id)
+        return JsonResponse({'success': False, 'error': f'Ошибка при загрузке: {str(e)}'}, status=500)
+
+@user_passes_test(is_superuser)
+def photo_status(request, pk):
+    """Статус фоновой обработки фото (для опроса из JS)"""
+    photo = get_object_or_404(Photo, pk=pk)
+    job = photo.jobs.order_by('-id').first()
+    data = {
+        'success': True,
+        'photo_id': photo.id,
+        'status': photo.status,
+        'attempts': job.attempts if job else 0,
+        'error': job.last_error if job else '',
+    }
+    if photo.status == Photo.Status.READY:
+        data['photo_url'] = photo.image.url
+        data['thumbnail_url'] = photo.thumbnail_url
+        # Предупреждение о похожих, если при загрузке фото ещё ждало обработки
+        data['similar'] = similar_json(upload_similar(photo))
+    return JsonResponse(data)
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -273,6 +535,38 @@ def delete_photo(request, pk):
             'error': f'Ошибка при удалении: {str(e)}'
         })
 
+BULK_DELETE_MAX = 1000
+
+@retry_if_locked
+def _delete_photos(ids):
+    # Строки и очередь их файлов (сигнал post_delete) - одной транзакцией;
+    # сами файлы удалит воркер
+    with transaction.atomic():
+        deleted, per_model = Photo.objects.filter(id__in=ids).delete()
+    return per_model.get(Photo._meta.label, 0)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@user_passes_test(is_superuser)
+def delete_photos(request):
+    """Удаление нескольких фото: {"ids": [1, 2, 3]} (только для суперюзера)"""
+    try:
+        ids = json.loads(request.body).get('ids')
+    except (ValueError, AttributeError):
+        ids = None
+    if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+        return JsonResponse({'success': False, 'error': 'Нужен список id: {"ids": [1, 2, 3]}'}, status=400)
+    if len(ids) > BULK_DELETE_MAX:
+        return JsonResponse(
+            {'success': False, 'error': f'Не больше {BULK_DELETE_MAX} фото за запрос'}, status=400
+        )
+    deleted = _delete_photos(ids)
+    return JsonResponse({
+        'success': True,
+        'deleted': deleted,
+        'message': f'Удалено фото: {deleted}',
+    })
+
 # =============================================================================
 # НОВАЯ ФУНКЦИЯ РЕДАКТИРОВАНИЯ ФОТО
 # =============================================================================
@@ -292,14 +586,15 @@ def edit_photo(request, pk):
         
         if field == 'title':
             photo.title = value
-            photo.save()
+            # Только это поле: не затираем имена файлов, которые мог сменить shard_media
+            photo.save(update_fields=['title'])
             return JsonResponse({
                 'success': True, 
                 'message': 'Название успешно обновлено!'
             })
         elif field == 'description':
             photo.description = value
-            photo.save()
+            photo.save(update_fields=['description'])
             return JsonResponse({
                 'success': True, 
                 'message': 'Описание успешно обновлено!'
@@ -316,6 +611,20 @@ def edit_photo(request, pk):
             'error': f'Ошибка при редактировании: {str(e)}'
         })
 
+# =============================================================================
+# МЕТРИКИ
+# =============================================================================
+
+def metrics(request):
+    """Метрики всех процессов для Prometheus (по токену METRICS_TOKEN или суперюзеру)"""
+    token = settings.METRICS_TOKEN
+    authorized = (
+        token and request.headers.get('Authorization') == f'Bearer {token}'
+    ) or is_superuser(request.user)
+    if not authorized:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # =============================================================================
 # СИСТЕМА АВТОРИЗАЦИИ
 # =============================================================================
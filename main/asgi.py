@@ -12,5 +12,16 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
+# Под ASGI синхронный код каждого запроса выполняется в своём потоке, а
+# соединение с БД привязано к потоку: постоянные соединения копились бы
+# открытыми после каждого запроса. Поэтому здесь соединение на запрос
+# (для SQLite это доли миллисекунды); см. README, "ОСОБЕННОСТИ PRODUCTION"
+os.environ.setdefault('DJANGO_CONN_MAX_AGE', '0')
+# Статику отдаёт ASGIStaticFiles, а не синхронный WhiteNoiseMiddleware
+os.environ.setdefault('DJANGO_STATIC_MIDDLEWARE', 'false')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from main.staticfiles import ASGIStaticFiles  # noqa: E402 - после django.setup()
+
+application = ASGIStaticFiles(django_application)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -33,12 +34,22 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # runserver тоже отдаёт статику через WhiteNoise - как в production
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',    
     'fotos',
 ]
 
+# WhiteNoiseMiddleware синхронный: под ASGI через него каждый запрос уходил бы
+# в поток. Поэтому main/asgi.py выключает его (DJANGO_STATIC_MIDDLEWARE=false)
+# и отдаёт статику до Django (main.staticfiles); WSGI и runserver - через middleware
+STATIC_MIDDLEWARE = os.getenv('DJANGO_STATIC_MIDDLEWARE', 'true').lower() == 'true'
+
 MIDDLEWARE = [    
+    'fotos.metrics.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # /static/ до сессий и CSRF: статика не касается БД и шаблонов
+    *(['whitenoise.middleware.WhiteNoiseMiddleware'] if STATIC_MIDDLEWARE else []),
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -51,7 +62,7 @@ ROOT_URLCONF = 'main.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'fotos.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -89,13 +100,71 @@ else:  # Local development
     MEDIA_ROOT = BASE_DIR / 'media'
     print(f"🖥️ Local mode: DB_PATH = {DB_PATH}, MEDIA_ROOT = {MEDIA_ROOT}")
 
+# Профиль SQLite для одновременной работы воркеров gunicorn и process_photos:
+#   WAL - читатели не блокируются пишущей транзакцией (и наоборот);
+#   synchronous=NORMAL - в WAL безопасно, fsync только на checkpoint;
+#   cache_size в КиБ (отрицательное значение), mmap_size в байтах
+SQLITE_PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'cache_size=-20000',  # ~20 МБ на соединение
+    'mmap_size=134217728',  # 128 МБ
+    'temp_store=MEMORY',
+]
+# Сколько ждать освобождения базы, прежде чем получить "database is locked"
+SQLITE_BUSY_TIMEOUT = 20  # секунд
+# Повторы пишущих операций после "database is locked" (fotos.db.retry_if_locked)
+SQLITE_LOCK_RETRIES = 3
+SQLITE_LOCK_RETRY_DELAY = 0.1  # секунд, удваивается
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': DB_PATH,
+        'OPTIONS': {
+            'init_command': '; '.join(f'PRAGMA {pragma}' for pragma in SQLITE_PRAGMAS),
+            # Пишущая транзакция сразу берёт блокировку записи: без тупика
+            # при повышении блокировки с чтения до записи
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_BUSY_TIMEOUT,
+        },
+        # Постоянные соединения в production (прагмы выполняются один раз).
+        # Под ASGI соединения привязаны к потокам запросов, поэтому main/asgi.py
+        # выключает их через DJANGO_CONN_MAX_AGE=0
+        'CONN_MAX_AGE': int(os.getenv('DJANGO_CONN_MAX_AGE', 0 if DEBUG else 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# =============================================================================
+# CACHE
+# =============================================================================
+# Кеш страниц альбома для анонимных посетителей (без Redis):
+#   file   - общий для всех процессов (воркеры gunicorn и process_photos),
+#            поэтому сброс версии альбома виден всем сразу
+#   locmem - в памяти процесса; годится, только если процесс один
+CACHE_BACKEND = os.getenv('DJANGO_CACHE_BACKEND', 'locmem' if DEBUG else 'file')
+
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', '/data/cache' if not DEBUG else os.path.join(tempfile.gettempdir(), 'foto-album-cache')),
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
+
+# Сколько хранить закешированные фрагменты; при изменении альбома они
+# устаревают сразу за счёт версии в ключе
+ALBUM_CACHE_TIMEOUT = 24 * 60 * 60  # секунд
+
 # =============================================================================
 # PASSWORD VALIDATION
 # =============================================================================
@@ -120,9 +189,37 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+# WhiteNoise один раз при старте читает STATIC_ROOT и держит пути, размеры и
+# заголовки в памяти - запрос к статике не трогает диск ради stat.
+# В DEBUG файлы ищутся заново на каждый запрос
+WHITENOISE_AUTOREFRESH = DEBUG
 
 MEDIA_URL = '/media/'
 
+STORAGES = {
+    # Обработанные фото называются по SHA-256 исходника (fotos.storage):
+    # повторная загрузка того же файла не создаёт вторую копию
+    'default': {'BACKEND': 'fotos.storage.ContentAddressedStorage'},
+    # collectstatic добавляет хеш содержимого к именам и заранее сжимает
+    # файлы в .gz и .br (brotli - если установлен пакет Brotli); WhiteNoise
+    # отдаёт сжатый вариант по Accept-Encoding, файлы с хешем - как immutable
+    # на год. Файл, которого нет в манифесте, - ошибка: без collectstatic
+    # production не запустится. При DEBUG и в тестах (main.test_runner)
+    # имена без хеша
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+
+# Отдача медиа в production (fotos.media.serve_media)
+# Файлы в этих папках никогда не перезаписываются - кешируются как immutable
+MEDIA_IMMUTABLE_PREFIXES = ('photos/', 'thumbnails/', 'renditions/')
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # год
+MEDIA_CACHE_MAX_AGE = 60 * 60  # час, для остальных файлов
+
+# Передать отдачу файлов обратному прокси: '' (отдаёт Django), 'x-accel' (nginx) или 'x-sendfile'
+MEDIA_ACCEL_REDIRECT = os.getenv('MEDIA_ACCEL_REDIRECT', '')
+# Для nginx: internal-location, указывающий на MEDIA_ROOT
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # =============================================================================
@@ -182,8 +279,22 @@ LOGGING = {
     },
 }
 
-# Настройки для статических файлов
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# =============================================================================
+# МЕТРИКИ (fotos.metrics: заголовок Server-Timing и /metrics для Prometheus)
+# =============================================================================
+# Каждый процесс (воркеры gunicorn, process_photos) пишет сюда свой файл
+# metrics-<pid>.json; /metrics суммирует все файлы. Папку очищают при запуске
+METRICS_DIR = os.getenv(
+    'DJANGO_METRICS_DIR',
+    '/data/metrics' if not DEBUG else os.path.join(tempfile.gettempdir(), 'foto-album-metrics'),
+)
+# Как часто процесс сбрасывает счётчики в файл
+METRICS_FLUSH_INTERVAL = 1.0  # секунд
+# Токен для Prometheus (Authorization: Bearer <token>); без него /metrics видит только суперюзер
+METRICS_TOKEN = os.getenv('DJANGO_METRICS_TOKEN', '')
+
+# Тесты пишут снимки метрик во временную папку, а не в METRICS_DIR
+TEST_RUNNER = 'main.test_runner.TestRunner'
 
 # =============================================================================
 # ADDITIONAL SETTINGS
@@ -205,6 +316,10 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024  # 20MB
 # Место для хранения временных файлов
 FILE_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'media/thumbnails') if DEBUG else '/tmp'
 
+# Загрузка по частям (/fotos/upload/chunked/): части пишутся сразу на диск
+CHUNKED_UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024  # 2MB
+CHUNKED_UPLOAD_MAX_SIZE = 20 * 1024 * 1024  # 20MB
+
 # Разрешённые расширения файлов
 FILE_UPLOAD_PERMISSIONS = 0o644
 
@@ -223,12 +338,57 @@ IMAGE_QUALITY = {
     'ultra': 90
 }
 
+# Современные форматы рядом с каждым JPEG (в порядке предпочтения);
+# отдаются браузерам, которые их принимают (Accept), JPEG - запасной вариант.
+# Форматы, которые не поддерживает установленный Pillow, пропускаются
+IMAGE_MODERN_FORMATS = ['avif', 'webp']
+IMAGE_MODERN_QUALITY = {
+    'avif': 60,
+    'webp': 80,
+}
+
 # Автоматическая оптимизация изображений
 AUTO_OPTIMIZE_IMAGES = True
 MAX_IMAGE_WIDTH = 1920
 MAX_IMAGE_HEIGHT = 1080
 DEFAULT_IMAGE_QUALITY = 85
 
+# Быстрое декодирование: JPEG читается сразу в уменьшенном масштабе (Image.draft),
+# затем уменьшение с reducing_gap. Сравнение режимов: manage.py benchmark --suite decode
+IMAGE_FAST_DECODE = True
+IMAGE_REDUCING_GAP = 2.0
+
+# =============================================================================
+# ФОНОВАЯ ОБРАБОТКА ФОТО (python manage.py process_photos)
+# =============================================================================
+
+# Обрабатывать фото прямо в запросе, без воркера (удобно для локальной разработки)
+PHOTO_QUEUE_EAGER = os.getenv('PHOTO_QUEUE_EAGER', str(DEBUG)).lower() == 'true'
+
+# Сколько фото сжимать параллельно (пул процессов воркера)
+PHOTO_WORKER_PROCESSES = int(os.getenv('PHOTO_WORKER_PROCESSES', os.cpu_count() or 1))
+
+# Сколько раз пытаться обработать фото и пауза перед повтором (удваивается)
+PHOTO_JOB_MAX_ATTEMPTS = 3
+PHOTO_JOB_RETRY_DELAY = 30  # секунд
+
+# Задание "в работе" дольше этого времени считается брошенным упавшим воркером
+PHOTO_JOB_LOCK_TIMEOUT = 10 * 60  # секунд
+
+# Асинхронные view (ASGI): потоков для Pillow, base64 и файлов (fotos.aio.offload)
+# на процесс; заодно ограничивает число одновременно разбираемых загрузок
+ASYNC_OFFLOAD_THREADS = int(os.getenv('DJANGO_ASYNC_OFFLOAD_THREADS', 4))
+
+# Похожие фото (fotos.similar): dHash отличается не больше чем на столько бит из 64
+SIMILAR_MAX_DISTANCE = 10
+# Как часто индекс похожих строится заново (новые фото добавляются сразу,
+# пересборка нужна для удалённых и пересчитанных backfill_metadata)
+SIMILAR_INDEX_MAX_AGE = 60 * 60  # секунд
+# Предупреждать, если похожее фото уже есть в альбоме: в ответе загрузки (если
+# фото обработано сразу) или в photo_status после обработки. Хеш считает
+# обработка, сама загрузка изображение не декодирует
+SIMILAR_UPLOAD_WARNING = os.getenv('SIMILAR_UPLOAD_WARNING', 'true').lower() == 'true'
+
 # Отключаем проверку хоста при DEBUG=False (для Amvera)
 if not DEBUG:
     # Разрешаем все хосты из ALLOWED_HOSTS
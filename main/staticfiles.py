@@ -0,0 +1,70 @@
+"""
+Отдача статики под ASGI (main/asgi.py).
+
+WhiteNoiseMiddleware только синхронный: под ASGI Django переводил бы через
+него в поток каждый запрос, в том числе к асинхронным view, а FileResponse
+читал бы в память целиком. Поэтому под ASGI статика отдаётся до Django:
+поиск файла, заголовки, сжатые варианты и Range - те же, что у WhiteNoise
+(его же таблица файлов), а файл читается блоками в пуле потоков
+(fotos.aio.offload). Под WSGI и runserver работает WhiteNoiseMiddleware
+(settings.STATIC_MIDDLEWARE).
+"""
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from fotos.aio import offload
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _request_headers(scope):
+    """Заголовки запроса в виде META - как их ждёт WhiteNoise"""
+    headers = {}
+    for name, value in scope['headers']:
+        key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+        headers[key] = value.decode('latin-1')
+    return headers
+
+
+class ASGIStaticFiles:
+    """ASGI-обёртка: /static/ отдаёт сама, остальные запросы передаёт application"""
+
+    def __init__(self, application):
+        self.application = application
+        self.whitenoise = WhiteNoiseMiddleware()
+
+    def find(self, path):
+        if self.whitenoise.autorefresh:
+            return self.whitenoise.find_file(path)
+        return self.whitenoise.files.get(path)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            path = scope['path'].removeprefix(scope.get('root_path', ''))
+            if path.startswith(self.whitenoise.static_prefix):
+                if self.whitenoise.autorefresh:
+                    # В DEBUG файл ищется на диске - не в цикле событий
+                    static_file = await offload(self.find, path)
+                else:
+                    static_file = self.find(path)
+                if static_file is not None:
+                    return await self.serve(static_file, scope, send)
+        return await self.application(scope, receive, send)
+
+    async def serve(self, static_file, scope, send):
+        response = await offload(static_file.get_response, scope['method'], _request_headers(scope))
+        await send({
+            'type': 'http.response.start',
+            'status': int(response.status),
+            'headers': [
+                (name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                for name, value in response.headers
+            ],
+        })
+        if response.file is None:
+            return await send({'type': 'http.response.body'})
+        try:
+            while block := await offload(response.file.read, BLOCK_SIZE):
+                await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            await offload(response.file.close)
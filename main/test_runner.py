@@ -0,0 +1,39 @@
+"""
+Запуск тестов (settings.TEST_RUNNER).
+
+Снимки метрик (fotos.metrics) каждый процесс пишет в METRICS_DIR, в
+production это /data/metrics. На время тестов METRICS_DIR - временная папка,
+чтобы прогон тестов не смешивал свои счётчики с метриками сайта.
+
+Статика в тестах - обычный StaticFilesStorage: манифест collectstatic в
+тестах не нужен (хранилище production проверяет StaticFilesTests).
+"""
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.temp_dir = tempfile.mkdtemp(prefix='foto-album-tests-')
+        self.test_settings = override_settings(
+            METRICS_DIR=self.temp_dir,
+            STORAGES={
+                **settings.STORAGES,
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        from fotos.metrics import collector
+
+        # Иначе atexit сбросит счётчики тестов уже в настоящий METRICS_DIR
+        collector.reset()
+        self.test_settings.disable()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -2,21 +2,19 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.views.static import serve
 from django.urls import re_path
+from fotos.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('fotos.urls')),
 ]
 
-# Добавляем обработку статических и медиа файлов для development
+# Статику (/static/) отдаёт WhiteNoise (под ASGI - main.staticfiles); здесь только медиа
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 else:
     # Для production - обслуживаем файлы напрямую
     urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-        re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
-    ]
\ No newline at end of file
+        re_path(r'^media/(?P<path>.*)$', serve_media),
+    ]
@@ -11,16 +11,35 @@ document.addEventListener('DOMContentLoaded', () => {
     }, 80); // Немного быстрее для короткого текста
   }
 
-  // Лайтбокс для галереи
+  // Убираем заглушку, когда картинка загрузилась (load не всплывает - ловим на захвате)
+  const clearPlaceholder = (img) => {
+    img.classList.remove('lqip');
+    img.style.backgroundColor = '';
+    img.style.backgroundImage = '';
+  };
+  document.addEventListener('load', (e) => {
+    if (e.target instanceof HTMLImageElement && e.target.classList.contains('lqip')) {
+      clearPlaceholder(e.target);
+    }
+  }, true);
+  document.querySelectorAll('img.lqip').forEach((img) => {
+    if (img.complete && img.naturalWidth) clearPlaceholder(img);
+  });
+
+  // Лайтбокс для галереи. Только сетка #gallery: в поиске и похожих фото
+  // плитки - ссылки на страницу фото, там клик открывает её, а не лайтбокс
   const lightbox = document.getElementById('lightbox');
   const lightboxImg = document.getElementById('lightbox-img');
   if (lightbox && lightboxImg) {
     document.addEventListener('click', (e) => {
       const target = e.target;
-      if (target && target.matches('.gallery img')) {
+      if (target && target.matches('#gallery img')) {
         const full = target.getAttribute('data-full') || target.src;
         const title = target.getAttribute('data-title') || '';
         const desc = target.getAttribute('data-desc') || '';
+        // Те же размеры, что у плитки, но под ширину экрана: телефон не качает 1920px
+        lightboxImg.sizes = '100vw';
+        lightboxImg.srcset = target.srcset || '';
         lightboxImg.src = full;
         lightboxImg.alt = title || desc || 'Увеличенное фото';
         lightbox.classList.add('open');
@@ -29,14 +48,187 @@ document.addEventListener('DOMContentLoaded', () => {
 
     lightbox.addEventListener('click', () => {
       lightbox.classList.remove('open');
+      lightboxImg.srcset = '';
       lightboxImg.src = '';
     });
   }
 
+  // Бесконечная прокрутка галереи
+  initInfiniteGallery();
+
   // Создаём модальное окно для подтверждения удаления
   createDeleteModal();
+
+  // Загрузка фото по частям с докачкой
+  const uploadForm = document.querySelector('.upload-form[data-chunked-url]');
+  if (uploadForm && window.fetch) {
+    uploadForm.addEventListener('submit', (e) => {
+      e.preventDefault();
+      uploadFilesChunked(uploadForm);
+    });
+  }
 });
 
+// =============================================================================
+// ЗАГРУЗКА ПО ЧАСТЯМ: файл уходит бинарными частями, обрыв связи докачивается
+// =============================================================================
+
+async function uploadFilesChunked(form) {
+  const files = Array.from(form.querySelector('input[type="file"]').files);
+  const title = form.querySelector('[name="title"]').value;
+  const description = form.querySelector('[name="description"]').value;
+  const progress = form.querySelector('.upload-progress');
+  const submitBtn = form.querySelector('button[type="submit"]');
+
+  const totalBytes = files.reduce((sum, file) => sum + file.size, 0) || 1;
+  let doneBytes = 0;
+  let uploaded = 0;
+
+  submitBtn.disabled = true;
+  if (progress) {
+    progress.hidden = false;
+    progress.value = 0;
+  }
+
+  for (const file of files) {
+    try {
+      await uploadOneFileChunked(form.dataset.chunkedUrl, file, title, description, (sent) => {
+        if (progress) progress.value = Math.round((doneBytes + sent) / totalBytes * 100);
+      });
+      uploaded++;
+    } catch (error) {
+      showMessage(`Файл ${file.name}: ${error.message}`, 'error');
+    }
+    doneBytes += file.size;
+  }
+
+  submitBtn.disabled = false;
+  if (uploaded > 0) {
+    showMessage(`Загружено ${uploaded} фото, они появятся в галерее после обработки`, 'success');
+    setTimeout(() => {
+      window.location.href = form.dataset.doneUrl;
+    }, 1000);
+  }
+}
+
+async function uploadOneFileChunked(startUrl, file, title, description, onProgress) {
+  const headers = {
+    'X-CSRFToken': getCookie('csrftoken'),
+    'X-Requested-With': 'XMLHttpRequest'
+  };
+
+  const startResponse = await fetch(startUrl, {
+    method: 'POST',
+    headers: {...headers, 'Content-Type': 'application/json'},
+    body: JSON.stringify({filename: file.name, size: file.size, title: title, description: description})
+  });
+  const session = await startResponse.json();
+  if (!session.success) throw new Error(session.error);
+
+  let offset = 0;
+  let retries = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + session.chunk_size);
+    try {
+      const response = await fetch(session.upload_url, {
+        method: 'PUT',
+        headers: {...headers, 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(offset)},
+        body: chunk
+      });
+      const data = await response.json();
+      if (!data.success) throw new Error(data.error);
+      offset = data.offset;
+      retries = 0;
+      onProgress(offset);
+    } catch (error) {
+      // Связь оборвалась - узнаём у сервера, сколько уже принято, и продолжаем
+      if (++retries > 5) throw error;
+      await new Promise((resolve) => setTimeout(resolve, 1000 * retries));
+      const state = await fetch(session.upload_url, {headers: headers}).then((r) => r.json()).catch(() => null);
+      if (state && state.success) offset = state.offset;
+    }
+  }
+
+  const finishResponse = await fetch(session.upload_url + 'finish/', {method: 'POST', headers: headers});
+  const result = await finishResponse.json();
+  if (!result.success) throw new Error(result.error);
+  return result;
+}
+
+// =============================================================================
+// БЕСКОНЕЧНАЯ ПРОКРУТКА: следующие плитки подгружаются из /fotos/feed/
+// =============================================================================
+
+function initInfiniteGallery() {
+  const gallery = document.getElementById('gallery');
+  const dataEl = document.getElementById('gallery-data');
+  if (!gallery || !dataEl || !('IntersectionObserver' in window)) return;
+
+  const data = JSON.parse(dataEl.textContent);
+  let nextCursor = data.nextCursor;
+  if (nextCursor === null) return;
+
+  // Ссылка "Далее" больше не нужна, "Назад" оставляем
+  const nextLink = document.querySelector('#gallery-pagination a[href*="after="]');
+  if (nextLink) nextLink.remove();
+
+  const sentinel = document.createElement('div');
+  sentinel.className = 'gallery-sentinel';
+  gallery.after(sentinel);
+
+  let loading = false;
+  const observer = new IntersectionObserver((entries) => {
+    if (!entries[0].isIntersecting || loading || nextCursor === null) return;
+    loading = true;
+    fetch(`${data.feedUrl}?after=${nextCursor}`)
+      .then((response) => response.json())
+      .then((page) => {
+        page.photos.forEach((photo) => gallery.appendChild(createGalleryTile(photo)));
+        nextCursor = page.next;
+        if (nextCursor === null) observer.disconnect();
+      })
+      .catch((error) => console.error('Feed error:', error))
+      .finally(() => {
+        loading = false;
+      });
+  }, {rootMargin: '400px'});
+  observer.observe(sentinel);
+}
+
+function createGalleryTile(photo) {
+  const tile = document.createElement('div');
+  tile.className = 'photo';
+
+  const img = document.createElement('img');
+  img.src = photo.thumbnail_url;
+  img.alt = photo.title || 'Фото';
+  img.loading = 'lazy';
+  img.dataset.full = photo.large_url;
+  img.dataset.title = photo.title || '';
+  if (photo.srcset) {
+    img.srcset = photo.srcset;
+    img.sizes = photo.sizes;
+  }
+  if (photo.thumbnail_size) {
+    img.width = photo.thumbnail_size[0];
+    img.height = photo.thumbnail_size[1];
+  }
+  if (photo.placeholder || photo.dominant_color) {
+    img.classList.add('lqip');
+    if (photo.dominant_color) img.style.backgroundColor = photo.dominant_color;
+    if (photo.placeholder) img.style.backgroundImage = `url('${photo.placeholder}')`;
+  }
+  tile.appendChild(img);
+
+  if (photo.title) {
+    const title = document.createElement('div');
+    title.className = 'photo-title';
+    title.textContent = photo.title;
+    tile.appendChild(title);
+  }
+  return tile;
+}
+
 // Функции для удаления фотографий (глобальные)
 function deletePhoto(photoId, photoTitle) {
   showDeleteModal(photoId, photoTitle);